@@ -0,0 +1,99 @@
+import os
+import time
+
+from flask import g, has_request_context, request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# The app's own registry, so /metrics doesn't also export prometheus_client's default process
+# and platform collectors. With PROMETHEUS_MULTIPROC_DIR set (it must be, before the first
+# import of prometheus_client), every process writes its values to files in that directory.
+registry = CollectorRegistry()
+
+
+def render():
+    """
+    Returns the metrics in the Prometheus text exposition format: those of this process, or
+    with PROMETHEUS_MULTIPROC_DIR those of every process that shares the directory, merged.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        merged = CollectorRegistry()
+        multiprocess.MultiProcessCollector(merged)
+        return generate_latest(merged)
+    return generate_latest(registry)
+
+
+def init_app(app, engine):
+    """Records the duration and database queries of every request of the app, and every query on its engine."""
+    app.before_request(_start_request_metrics)
+    app.after_request(_record_request_metrics)
+    event.listen(engine, 'before_cursor_execute', _count_db_query)
+
+
+def _start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    g.db_query_count = 0
+
+
+def _record_request_metrics(response):
+    if 'metrics_started' in g:
+        # The route pattern, not the path, so /jobs/1 and /jobs/2 share a series
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        http_request_duration.labels(method=request.method, route=route, status=response.status_code) \
+            .observe(time.perf_counter() - g.metrics_started)
+        http_request_db_queries.labels(route=route).observe(g.db_query_count)
+    return response
+
+
+def _count_db_query(conn, cursor, statement, parameters, context, executemany):
+    db_queries.inc()
+    if has_request_context() and 'db_query_count' in g:
+        g.db_query_count += 1
+
+
+# Web requests, labelled with the route pattern (not the path) to keep the series bounded
+http_request_duration = Histogram(
+    'easygost_http_request_duration_seconds', 'Time spent handling HTTP requests.',
+    ('method', 'route', 'status'), registry=registry)
+http_request_db_queries = Histogram(
+    'easygost_http_request_db_queries', 'Database queries issued while handling one HTTP request.',
+    ('route',), buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500), registry=registry)
+db_queries = Counter(
+    'easygost_db_queries_total', 'Database queries issued, in requests and background work.', registry=registry)
+
+ssh_test_duration = Histogram(
+    'easygost_ssh_test_duration_seconds', 'Duration of SSH connection tests by outcome.', ('outcome',),
+    registry=registry)
+systemctl_duration = Histogram(
+    'easygost_systemctl_duration_seconds', 'Duration of systemctl commands.', ('action', 'outcome'),
+    registry=registry)
+
+config_generation_duration = Histogram(
+    'easygost_config_generation_seconds', 'Time to generate and hash the GOST config shards of an apply.',
+    registry=registry)
+# Written by whichever process applied last, so across processes the most recent value wins
+config_shard_bytes = Gauge(
+    'easygost_config_shard_bytes', 'Size of the last written GOST config shard of each server.', ('server_id',),
+    multiprocess_mode='mostrecent', registry=registry)
+config_shard_routes = Gauge(
+    'easygost_config_shard_routes', 'Number of routes in the last written GOST config shard of each server.',
+    ('server_id',), multiprocess_mode='mostrecent', registry=registry)
+
+apply_duration = Histogram(
+    'easygost_apply_duration_seconds', 'Duration of GOST config apply jobs.', ('result',),
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300), registry=registry)
+apply_shards = Counter(
+    'easygost_apply_shards_total', 'Config shards handled by apply jobs, by result.', ('result',), registry=registry)
+apply_skipped_transits = Counter(
+    'easygost_apply_skipped_transits_total', 'Transits the generator left out of an apply.', registry=registry)
+
+# Summed over the processes that are still running
+live_status_streams = Gauge(
+    'easygost_live_status_streams', 'Open live status streams (Server-Sent Events).',
+    multiprocess_mode='livesum', registry=registry)
+live_status_events = Counter(
+    'easygost_live_status_events_total', 'Change events published to the live status streams, by kind.', ('kind',),
+    registry=registry)
@@ -0,0 +1,364 @@
+import csv
+import io
+import ipaddress
+import json
+import os
+
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.orm import aliased
+
+from extensions import db
+import models
+from gost_config_generator import RELAY_CHAIN_PROTOCOLS
+from port_allocator import PortIndex, parse_port_range
+from credential_vault import vault
+
+FORMATS = ('csv', 'json', 'yaml')
+KINDS = ('servers', 'transits')
+SUPPORTED_PROTOCOLS = ('ws', 'wss', 'relay+tls', 'tcp', 'udp') # Same choices as the add_transit form
+
+# Fields of an import/export record, in CSV column order. Transits refer to their servers by
+# name so that an export can be imported into another instance. Exports leave out ssh_password.
+# Servers need either ssh_password or ssh_key_path (a private key file on this host).
+SERVER_IMPORT_FIELDS = ('name', 'ip_address', 'ssh_port', 'ssh_username', 'ssh_key_path', 'ssh_password')
+TRANSIT_IMPORT_FIELDS = ('name', 'server_a', 'server_a_listen_port', 'server_b', 'server_b_connect_port',
+                         'encryption_protocol', 'destination_ip', 'destination_port')
+SERVER_EXPORT_FIELDS = SERVER_IMPORT_FIELDS[:-1]
+TRANSIT_EXPORT_FIELDS = TRANSIT_IMPORT_FIELDS
+
+EXPORT_BATCH_SIZE = 1000
+
+
+def guess_format(filename=None, content_type=None):
+    """Guesses the import format from a file name or a Content-Type header. Returns None if unknown."""
+    if filename and '.' in filename:
+        extension = filename.rsplit('.', 1)[1].lower()
+        if extension == 'yml':
+            return 'yaml'
+        if extension in FORMATS:
+            return extension
+    if content_type:
+        for fmt in FORMATS:
+            if fmt in content_type:
+                return fmt
+    return None
+
+
+def parse_records(content, fmt):
+    """
+    Parses CSV (with a header row), a JSON array or a YAML list into a list of dictionaries.
+    Empty CSV cells are treated like missing fields. Raises ValueError if the content can't be parsed.
+    """
+    if fmt == 'csv':
+        return [{key: value for key, value in row.items() if key and value not in (None, '')}
+                for row in csv.DictReader(io.StringIO(content))]
+    if fmt == 'json':
+        try:
+            records = json.loads(content)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {str(e)}")
+    elif fmt == 'yaml':
+        import yaml # Only YAML imports and exports need it, so it isn't loaded at startup
+        try:
+            records = yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Invalid YAML: {str(e)}")
+    else:
+        raise ValueError(f"Unsupported format '{fmt}'. Choose one of: {', '.join(FORMATS)}.")
+    if records is None:
+        return []
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise ValueError("Expected a list of records.")
+    return records
+
+
+def _text(record, field, errors, max_length=None):
+    value = record.get(field)
+    value = str(value).strip() if value is not None else ''
+    if not value:
+        errors.append(f"'{field}' is required.")
+        return None
+    if max_length and len(value) > max_length:
+        errors.append(f"'{field}' must be at most {max_length} characters.")
+        return None
+    return value
+
+
+def _port(record, field, errors, default=None):
+    value = record.get(field, default)
+    if value in (None, ''):
+        errors.append(f"'{field}' is required.")
+        return None
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        errors.append(f"'{field}' must be a number.")
+        return None
+    if not 1 <= port <= 65535:
+        errors.append(f"'{field}' must be between 1 and 65535.")
+        return None
+    return port
+
+
+def _validate_server_records(records):
+    """Returns (rows to insert, per-row errors, allocated ports) for server records."""
+    # Every uniqueness check runs against these preloaded sets instead of one query per row
+    taken_names = {name for (name,) in db.session.query(models.Servers.name)}
+    taken_ips = {ip for (ip,) in db.session.query(models.Servers.ip_address)}
+
+    rows, errors = [], []
+    for index, record in enumerate(records, start=1):
+        row_errors = []
+        name = _text(record, 'name', row_errors, max_length=100)
+        ip_address = _text(record, 'ip_address', row_errors, max_length=45)
+        ssh_username = _text(record, 'ssh_username', row_errors, max_length=100)
+        ssh_key_path = str(record.get('ssh_key_path') or '').strip() or None
+        if ssh_key_path:
+            ssh_password = None
+            if not os.path.isfile(ssh_key_path):
+                row_errors.append(f"SSH key file '{ssh_key_path}' does not exist on this host.")
+        else:
+            ssh_password = _text(record, 'ssh_password', row_errors)
+        ssh_port = _port(record, 'ssh_port', row_errors, default=22)
+
+        if ip_address:
+            try:
+                ip_address = str(ipaddress.ip_address(ip_address))
+            except ValueError:
+                row_errors.append(f"'{ip_address}' is not a valid IP address.")
+                ip_address = None
+        if name in taken_names:
+            row_errors.append(f"Server name '{name}' already exists.")
+        if ip_address in taken_ips:
+            row_errors.append(f"IP address '{ip_address}' already exists.")
+
+        if row_errors:
+            errors.append({'row': index, 'name': name, 'errors': row_errors})
+            continue
+        taken_names.add(name)
+        taken_ips.add(ip_address)
+        rows.append({
+            'name': name,
+            'ip_address': ip_address,
+            'ssh_username': ssh_username,
+            'ssh_password': vault.encrypt(ssh_password) or '',
+            'ssh_key_path': ssh_key_path,
+            'ssh_port': ssh_port,
+            # Imported servers are not SSH-tested; `flask check-health` picks them up
+            'connection_status': 'pending',
+        })
+    return rows, errors, []
+
+
+def _resolve_server(record, field, server_ids_by_name, existing_ids, errors):
+    """Resolves a server reference given by name (`server_a`) or by ID (`server_a_id`)."""
+    if record.get(f"{field}_id") not in (None, ''):
+        try:
+            server_id = int(record[f"{field}_id"])
+        except (TypeError, ValueError):
+            errors.append(f"'{field}_id' must be a number.")
+            return None
+        if server_id not in existing_ids:
+            errors.append(f"Server ID {server_id} ('{field}_id') does not exist.")
+            return None
+        return server_id
+    name = _text(record, field, errors)
+    if name is None:
+        return None
+    if name not in server_ids_by_name:
+        errors.append(f"Server '{name}' ('{field}') does not exist.")
+        return None
+    return server_ids_by_name[name]
+
+
+def _validate_transit_records(records):
+    """Returns (rows to insert, per-row errors, allocated listen ports) for transit records."""
+    servers = db.session.query(models.Servers.id, models.Servers.name, models.Servers.ssh_port).all()
+    server_ids_by_name = {server.name: server.id for server in servers}
+    existing_ids = set(server_ids_by_name.values())
+    taken_names = {name for (name,) in db.session.query(models.Transits.name)}
+    # Listen ports in use on each server: its SSH port, its transits' listen ports and,
+    # with GOST_B_SIDE_CONFIGS, the connect ports it serves as a relay's Server B node or hop
+    port_index = PortIndex.from_rows(db.session.query(models.Transits.server_a_id, models.Transits.server_a_listen_port))
+    for server in servers:
+        port_index.add(server.id, server.ssh_port)
+    b_side = current_app.config['GOST_B_SIDE_CONFIGS']
+    if b_side:
+        relay_protocols = list(RELAY_CHAIN_PROTOCOLS)
+        for server_id, port in db.session.query(models.Transits.server_b_id, models.Transits.server_b_connect_port).filter(
+                models.Transits.encryption_protocol.in_(relay_protocols)):
+            port_index.add(server_id, port)
+        for server_id, port in db.session.query(models.TransitBNodes.server_id, models.TransitBNodes.connect_port).join(
+                models.Transits).filter(models.Transits.encryption_protocol.in_(relay_protocols)):
+            port_index.add(server_id, port)
+        for server_id, port in db.session.query(models.TransitHops.server_id, models.TransitHops.connect_port).join(
+                models.Transits).filter(models.Transits.encryption_protocol.in_(relay_protocols)):
+            port_index.add(server_id, port)
+    allocation_start, allocation_end = parse_port_range(current_app.config['PORT_ALLOCATION_RANGE'])
+
+    rows, errors, pending_allocations = [], [], []
+    for index, record in enumerate(records, start=1):
+        row_errors = []
+        name = _text(record, 'name', row_errors, max_length=100)
+        server_a_id = _resolve_server(record, 'server_a', server_ids_by_name, existing_ids, row_errors)
+        server_b_id = _resolve_server(record, 'server_b', server_ids_by_name, existing_ids, row_errors)
+        # A missing listen port is allocated from PORT_ALLOCATION_RANGE after every explicit port is known
+        allocate_port = record.get('server_a_listen_port') in (None, '')
+        server_a_listen_port = None if allocate_port else _port(record, 'server_a_listen_port', row_errors)
+        server_b_connect_port = _port(record, 'server_b_connect_port', row_errors)
+        protocol = _text(record, 'encryption_protocol', row_errors)
+        destination_ip = _text(record, 'destination_ip', row_errors, max_length=45)
+        destination_port = _port(record, 'destination_port', row_errors)
+
+        if name in taken_names:
+            row_errors.append(f"Transit name '{name}' already exists.")
+        if server_a_id is not None and server_a_id == server_b_id:
+            row_errors.append("Server A and Server B cannot be the same server.")
+        if protocol and protocol not in SUPPORTED_PROTOCOLS:
+            row_errors.append(f"Unsupported protocol '{protocol}'. Choose one of: {', '.join(SUPPORTED_PROTOCOLS)}.")
+        if server_a_id is not None and server_a_listen_port is not None and port_index.is_used(server_a_id, server_a_listen_port):
+            row_errors.append(f"Port {server_a_listen_port} is already in use on Server A.")
+        relay_b_side = b_side and protocol in RELAY_CHAIN_PROTOCOLS
+        if (relay_b_side and server_b_id is not None and server_b_connect_port is not None
+                and port_index.is_used(server_b_id, server_b_connect_port)):
+            row_errors.append(f"Port {server_b_connect_port} is already in use on Server B.")
+
+        if row_errors:
+            errors.append({'row': index, 'name': name, 'errors': row_errors})
+            continue
+        taken_names.add(name)
+        if not allocate_port:
+            port_index.add(server_a_id, server_a_listen_port)
+        if relay_b_side:
+            port_index.add(server_b_id, server_b_connect_port)
+        rows.append({
+            'name': name,
+            'server_a_id': server_a_id,
+            'server_a_listen_port': server_a_listen_port,
+            'server_b_id': server_b_id,
+            'server_b_connect_port': server_b_connect_port,
+            'encryption_protocol': protocol,
+            'destination_ip': destination_ip,
+            'destination_port': destination_port,
+            'status': 'pending',
+        })
+        if allocate_port:
+            pending_allocations.append((index, rows[-1]))
+
+    allocated = []
+    for index, row in pending_allocations:
+        row['server_a_listen_port'] = port_index.allocate(row['server_a_id'], allocation_start, allocation_end)
+        if row['server_a_listen_port'] is None:
+            errors.append({'row': index, 'name': row['name'],
+                           'errors': [f"No free port left on Server A in {current_app.config['PORT_ALLOCATION_RANGE']}."]})
+        else:
+            allocated.append({'row': index, 'name': row['name'], 'port': row['server_a_listen_port']})
+    if len(allocated) < len(pending_allocations):
+        rows = [row for row in rows if row['server_a_listen_port'] is not None]
+        errors.sort(key=lambda error: error['row'])
+    return rows, errors, allocated
+
+
+def import_records(kind, records, skip_invalid=False, dry_run=False):
+    """
+    Validates and inserts server or transit records in a single transaction.
+
+    All records are validated in memory first. If any of them is invalid, nothing is
+    inserted unless skip_invalid is set, in which case the valid records still are.
+    With dry_run nothing is ever inserted. Must run in an app context.
+
+    Transits without a server_a_listen_port get the next free port of their Server A.
+
+    Returns a report: {'total', 'valid', 'inserted', 'errors': [{'row', 'name', 'errors'}],
+    'allocated_ports': [{'row', 'name', 'port'}]}, where 'row' is the 1-based position of
+    the record in the input.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown kind '{kind}'. Choose one of: {', '.join(KINDS)}.")
+    model = models.Servers if kind == 'servers' else models.Transits
+    validate = _validate_server_records if kind == 'servers' else _validate_transit_records
+    rows, errors, allocated = validate(records)
+
+    inserted = 0
+    if rows and not dry_run and (skip_invalid or not errors):
+        try:
+            # One executemany (batched by SQLAlchemy) instead of a flush per object
+            db.session.execute(insert(model), rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        inserted = len(rows)
+    return {'total': len(records), 'valid': len(rows), 'inserted': inserted, 'errors': errors,
+            'allocated_ports': allocated}
+
+
+def _export_rows(kind):
+    """Yields export records as dictionaries, reading the table in batches."""
+    if kind == 'servers':
+        query = db.session.query(*[getattr(models.Servers, field) for field in SERVER_EXPORT_FIELDS]).order_by(models.Servers.id)
+    else:
+        server_a = aliased(models.Servers)
+        server_b = aliased(models.Servers)
+        query = db.session.query(
+            models.Transits.name,
+            server_a.name.label('server_a'),
+            models.Transits.server_a_listen_port,
+            server_b.name.label('server_b'),
+            models.Transits.server_b_connect_port,
+            models.Transits.encryption_protocol,
+            models.Transits.destination_ip,
+            models.Transits.destination_port,
+        ).join(server_a, models.Transits.server_a_id == server_a.id).join(
+            server_b, models.Transits.server_b_id == server_b.id
+        ).order_by(models.Transits.id)
+    for row in query.yield_per(EXPORT_BATCH_SIZE):
+        yield dict(row._mapping)
+
+
+def export_records(kind, fmt):
+    """
+    Yields chunks of text exporting all servers or transits in the given format.
+    Chunks cover EXPORT_BATCH_SIZE records each, so the export never holds a whole table.
+    Must be consumed in an app context.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown kind '{kind}'. Choose one of: {', '.join(KINDS)}.")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}'. Choose one of: {', '.join(FORMATS)}.")
+    fields = SERVER_EXPORT_FIELDS if kind == 'servers' else TRANSIT_EXPORT_FIELDS
+    return _export_chunks(_export_rows(kind), fmt, fields)
+
+
+def _export_chunks(rows, fmt, fields):
+    if fmt == 'json':
+        yield '['
+    elif fmt == 'csv':
+        yield ','.join(fields) + '\r\n' # The header, formatted like csv.DictWriter.writeheader()
+
+    batch = []
+    first = True
+    for row in rows:
+        batch.append(row)
+        if len(batch) < EXPORT_BATCH_SIZE:
+            continue
+        yield _format_batch(batch, fmt, fields, first)
+        first = False
+        batch = []
+    if batch:
+        yield _format_batch(batch, fmt, fields, first)
+    if fmt == 'json':
+        yield ']\n'
+
+
+def _format_batch(batch, fmt, fields, first):
+    if fmt == 'json':
+        text = ',\n'.join(json.dumps(row) for row in batch)
+        return text if first else ',\n' + text
+    if fmt == 'yaml':
+        import yaml
+        return yaml.safe_dump(batch, sort_keys=False, allow_unicode=True)
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, fieldnames=fields).writerows(batch)
+    return buffer.getvalue()
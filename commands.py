@@ -0,0 +1,295 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+from flask import Blueprint
+
+from extensions import db
+from gost_config_generator import ROUTE_BUILDERS
+import models
+
+# The `flask` CLI commands, registered on the app's own group by create_app(). Every web worker
+# imports this module, so the modules behind the commands are only imported by the command that
+# runs them (see STARTUP_UNLOADED_MODULES). Option choices are spelled out here for the same reason.
+bp = Blueprint('commands', __name__, cli_group=None)
+
+BULK_KINDS = ('servers', 'transits') # bulk_io.KINDS
+BULK_FORMATS = ('csv', 'json', 'yaml') # bulk_io.FORMATS
+
+# Modules only the CLI and background tasks need; `flask benchmark-startup` checks that a web
+# worker has not loaded any of them by the end of its first request. asyncio and ssl are not
+# listed: SQLAlchemy imports asyncio (and through it ssl) itself.
+STARTUP_UNLOADED_MODULES = ('bulk_io', 'health_checker', 'latency_prober', 'metrics_collector', 'route_optimizer',
+                            'tunnel_benchmark')
+
+# Run in a fresh interpreter by `flask benchmark-startup`, so nothing is imported yet
+_STARTUP_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+response = app.test_client().get(sys.argv[1])
+responded = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': created - imported,
+                  'first_request': responded - created, 'status': response.status_code,
+                  'loaded': [name for name in ('paramiko', 'cryptography', 'yaml') if name in sys.modules],
+                  'modules': sorted(sys.modules)}))
+'''
+
+
+@bp.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Applies pending database migrations. Run it once before starting the web workers."""
+    from migrations import upgrade_database
+
+    applied = upgrade_database()
+    for version in applied:
+        print(f"Info: Applied database migration {version}")
+    print(f"Info: Database schema is up to date ({len(applied)} migration(s) applied).")
+
+
+@bp.cli.command('probe-latency')
+@click.option('--interval', type=float, default=0,
+              help='Keep probing every INTERVAL seconds instead of running once.')
+def probe_latency_command(interval):
+    """Measures the latency of every transit and stores the results."""
+    from latency_prober import probe_transit_latencies
+
+    while True:
+        started = time.monotonic()
+        probed_count = probe_transit_latencies()
+        print(f"Info: Probed {probed_count} transit(s) in {time.monotonic() - started:.2f}s")
+        if not interval:
+            break
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+@bp.cli.command('check-health')
+@click.option('--interval', type=float, default=0,
+              help='Keep checking every INTERVAL seconds instead of running once.')
+def check_health_command(interval):
+    """Refreshes the connection status of every server."""
+    from health_checker import check_server_health
+
+    while True:
+        started = time.monotonic()
+        status_counts = check_server_health()
+        summary = ', '.join(f"{status}: {count}" for status, count in sorted(status_counts.items())) or 'no servers'
+        print(f"Info: Checked {sum(status_counts.values())} server(s) in {time.monotonic() - started:.2f}s ({summary})")
+        if not interval:
+            break
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+@bp.cli.command('collect-metrics')
+@click.option('--interval', type=float, default=0,
+              help='Keep collecting every INTERVAL seconds instead of running once.')
+def collect_metrics_command(interval):
+    """Scrapes the traffic metrics of every transit from GOST and stores them."""
+    from metrics_collector import collect_transit_metrics
+
+    while True:
+        started = time.monotonic()
+        server_count, transit_count, errors = collect_transit_metrics()
+        for error in errors:
+            print(f"Warning: {error}")
+        print(f"Info: Scraped {server_count} server(s), recorded {transit_count} transit(s) "
+              f"in {time.monotonic() - started:.2f}s")
+        if not interval:
+            break
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+@bp.cli.command('probe-links')
+@click.option('--interval', type=float, default=0,
+              help='Keep probing every INTERVAL seconds instead of running once.')
+def probe_links_command(interval):
+    """Measures the links between servers and to the transit destinations for the route optimizer."""
+    from route_optimizer import probe_route_links
+
+    while True:
+        started = time.monotonic()
+        server_count, link_count, errors = probe_route_links()
+        for error in errors:
+            print(f"Warning: {error}")
+        print(f"Info: Probed {link_count} link(s) from {server_count} server(s) in {time.monotonic() - started:.2f}s")
+        if not interval:
+            break
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+def _format_chain(chain, server_names):
+    return ' -> '.join(server_names.get(server_id, str(server_id)) for server_id in chain)
+
+
+@bp.cli.command('optimize-routes')
+@click.option('--apply', 'apply_changes', is_flag=True,
+              help='Move the transits to their better chains (they become pending).')
+@click.option('--deploy', is_flag=True, help='With --apply, also apply the GOST config right away.')
+def optimize_routes_command(apply_changes, deploy):
+    """Finds transits with a faster measured chain of relays and optionally moves them to it."""
+    from gost_apply import apply_gost_config_job
+    from jobs import submit_job
+    from route_optimizer import plan_route_changes, apply_route_changes
+
+    changes = plan_route_changes()
+    server_names = dict(db.session.query(models.Servers.id, models.Servers.name))
+    for change in changes:
+        current_cost = 'not measured' if change['current_cost_ms'] is None else f"{change['current_cost_ms']}ms"
+        print(f"Info: Transit '{change['transit'].name}': "
+              f"{_format_chain(change['current_chain'], server_names)} ({current_cost}) -> "
+              f"{_format_chain(change['chain'], server_names)} ({change['cost_ms']}ms)")
+    if not apply_changes:
+        print(f"Info: {len(changes)} transit(s) have a better chain. Run with --apply to move them.")
+        return
+
+    applied, errors = apply_route_changes(changes)
+    for error in errors:
+        print(f"Warning: {error}")
+    print(f"Info: Moved {len(applied)} transit(s) to a better chain.")
+    if deploy and applied:
+        job_id = submit_job('apply_gost_config', apply_gost_config_job)
+        job = db.session.get(models.Jobs, job_id)
+        while job.status not in ('succeeded', 'failed'):
+            time.sleep(1)
+            db.session.refresh(job)
+        print(f"Info: GOST config apply job {job_id} {job.status}: {job.message or ''}".rstrip())
+        if job.status == 'failed':
+            raise SystemExit(1)
+
+
+@bp.cli.command('rotate-credentials')
+@click.option('--batch-size', type=click.IntRange(min=1), default=500, show_default=True,
+              help='Servers re-encrypted per transaction.')
+def rotate_credentials_command(batch_size):
+    """Re-encrypts every SSH password with the active Fernet key."""
+    from credential_vault import vault, rotate_server_passwords
+
+    started = time.monotonic()
+    rotated, failed = rotate_server_passwords(batch_size=batch_size)
+    for server_id in failed:
+        print(f"Error: The SSH password of server ID {server_id} can't be decrypted with any configured key.")
+    print(f"Info: Re-encrypted {rotated} SSH password(s) with key '{vault.active_key_id}' "
+          f"in {time.monotonic() - started:.2f}s")
+    if failed:
+        raise SystemExit(1)
+
+
+@bp.cli.command('import-data')
+@click.argument('kind', type=click.Choice(BULK_KINDS))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(BULK_FORMATS), help='Defaults to the file extension.')
+@click.option('--skip-invalid', is_flag=True, help='Insert the valid records even if some are invalid.')
+@click.option('--dry-run', is_flag=True, help='Only validate, insert nothing.')
+def import_data_command(kind, path, fmt, skip_invalid, dry_run):
+    """Imports servers or transits from a CSV, JSON or YAML file."""
+    from bulk_io import guess_format, parse_records, import_records
+
+    fmt = fmt or guess_format(filename=path)
+    if not fmt:
+        raise click.UsageError('Cannot tell the format from the file name, use --format.')
+    with open(path, encoding='utf-8') as f:
+        try:
+            records = parse_records(f.read(), fmt)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    report = import_records(kind, records, skip_invalid=skip_invalid, dry_run=dry_run)
+    for error in report['errors']:
+        print(f"Error: Row {error['row']} ({error['name'] or 'no name'}): {' '.join(error['errors'])}")
+    print(f"Info: {report['total']} record(s), {report['valid']} valid, {report['inserted']} inserted.")
+    if report['allocated_ports']:
+        print(f"Info: Allocated listen ports for {len(report['allocated_ports'])} transit(s).")
+    if report['errors']:
+        raise SystemExit(1)
+
+
+@bp.cli.command('export-data')
+@click.argument('kind', type=click.Choice(BULK_KINDS))
+@click.option('--format', 'fmt', type=click.Choice(BULK_FORMATS), default='csv', show_default=True)
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='Defaults to stdout.')
+def export_data_command(kind, fmt, output):
+    """Exports servers (without passwords) or transits as CSV, JSON or YAML."""
+    from bulk_io import export_records
+
+    for chunk in export_records(kind, fmt):
+        output.write(chunk)
+
+
+@bp.cli.command('benchmark-startup')
+@click.option('--runs', type=click.IntRange(min=1), default=5, show_default=True)
+@click.option('--path', default='/', show_default=True, help='URL of the first request.')
+def benchmark_startup_command(runs, path):
+    """Measures the cold start of a web worker: imports, create_app() and the first request."""
+    timings = {'process': [], 'import': [], 'create_app': [], 'first_request': []}
+    for _i in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', _STARTUP_PROBE, path], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            raise click.ClickException(f"Startup probe failed: {result.stderr.strip()}")
+        # create_app() prints its own Info lines, the probe's result comes last
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        timings['process'].append(elapsed)
+        for name in ('import', 'create_app', 'first_request'):
+            timings[name].append(probe[name])
+    for name, values in timings.items():
+        print(f"Info: {name:<14} median {statistics.median(values) * 1000:7.1f}ms, max {max(values) * 1000:7.1f}ms")
+    print(f"Info: First request to {path} returned {probe['status']}; "
+          f"loaded on startup: {', '.join(probe['loaded']) or 'none of paramiko, cryptography, yaml'}")
+    loaded_early = [name for name in STARTUP_UNLOADED_MODULES if name in probe['modules']]
+    if loaded_early:
+        raise click.ClickException(f"A web worker loaded modules only the CLI needs: {', '.join(loaded_early)}. "
+                                   f"Import them inside the functions that use them.")
+
+
+@bp.cli.command('benchmark-tunnels')
+@click.option('--protocol', 'protocols', multiple=True, type=click.Choice(tuple(ROUTE_BUILDERS)),
+              help='Protocol to benchmark, repeatable. Defaults to all of them.')
+@click.option('--profile', 'profile_names', multiple=True,
+              help="Tuning profile to benchmark, repeatable; 'default' is the built-in one. Defaults to all of them.")
+@click.option('--gost', 'gost_path', type=click.Path(exists=True, dir_okay=False),
+              help='GOST v2 binary to run the configs with. Defaults to gost on the PATH, else a Python stand-in.')
+@click.option('--size', type=click.IntRange(min=1), default=64, show_default=True,
+              help='MiB sent through each tunnel for the throughput.')
+@click.option('--connections', type=click.IntRange(min=1), default=500, show_default=True,
+              help='New connections opened for the setup rate.')
+@click.option('--samples', type=click.IntRange(min=1), default=2000, show_default=True,
+              help='Round trips measured for the latency.')
+@click.option('--output', type=click.File('w', encoding='utf-8'), help='Write the JSON report to this file.')
+def benchmark_tunnels_command(protocols, profile_names, gost_path, size, connections, samples, output):
+    """Measures the throughput, setup rate and latency of each protocol and tuning profile on localhost."""
+    from gost_config_generator import DEFAULT_GOST_TUNING, GostTuning
+    from tunnel_benchmark import BENCHMARK_PROTOCOLS, find_gost_binary, run_tunnel_benchmark
+
+    tunings = {'default': DEFAULT_GOST_TUNING}
+    try:
+        tunings.update((profile.name, GostTuning.from_profile(profile))
+                       for profile in models.TuningProfiles.query.order_by(models.TuningProfiles.name))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    unknown = [name for name in profile_names if name not in tunings]
+    if unknown:
+        raise click.UsageError(f"Unknown tuning profile(s): {', '.join(unknown)}")
+    if profile_names:
+        tunings = {name: tunings[name] for name in profile_names}
+
+    try:
+        gost_binary = find_gost_binary(gost_path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Info: Running the configs with {gost_binary or 'the Python stand-in (no GOST v2 binary found)'}")
+    report = run_tunnel_benchmark(protocols or BENCHMARK_PROTOCOLS, tunings, gost_binary,
+                                  {'throughput_bytes': size * 1024 * 1024, 'connections': connections,
+                                   'latency_samples': samples})
+    if output:
+        json.dump(report, output, indent=4)
+        print(f"Info: Wrote the report to {output.name}")
+    if any('error' in result for result in report['results']):
+        raise SystemExit(1)
@@ -0,0 +1,142 @@
+import os
+
+DEFAULT_FERNET_KEY_FOR_DEV = b'jG5FCcuiEW8ORq4T7eO_yFA9hDUiTbjGZXNv7SdOwJk=' # Default for dev if not set
+FERNET_KEY_ENV_VAR = 'FERNET_ENCRYPTION_KEY'
+
+
+def load_config(app):
+    """Reads the app's settings from the environment. Called once by create_app()."""
+    app.secret_key = os.environ.get('FLASK_SECRET_KEY', os.urandom(24))
+
+    # Configure Flask-Babel
+    app.config['BABEL_DEFAULT_LOCALE'] = 'zh'
+    app.config['BABEL_TRANSLATION_DIRECTORIES'] = 'translations'
+    # Using default locale 'zh' as per config. No localeselector needed for now.
+
+    # Fernet Key for password encryption
+    # Attempt to load from environment variable, otherwise use a default (for dev/test)
+    # In production, FERNET_ENCRYPTION_KEY MUST be set as an environment variable.
+    env_fernet_key = os.environ.get(FERNET_KEY_ENV_VAR)
+
+    if env_fernet_key:
+        app.config['FERNET_KEY'] = env_fernet_key.encode()
+        print(f"Info: Loaded Fernet key from environment variable {FERNET_KEY_ENV_VAR}.")
+    else:
+        print(f"Warning: Environment variable {FERNET_KEY_ENV_VAR} not set. "
+              f"Using a default Fernet key for development/testing. "
+              f"Ensure {FERNET_KEY_ENV_VAR} is set in a production environment.")
+        app.config['FERNET_KEY'] = DEFAULT_FERNET_KEY_FOR_DEV
+        # For a stricter production setup, you might raise an error here if the key isn't set:
+        # else:
+        #     raise EnvironmentError(f"FATAL: Environment variable {FERNET_KEY_ENV_VAR} is not set. "
+        #                            "This is required for production.")
+    # Several Fernet keys with key IDs, e.g. while rotating: 'new_id:new_key,old_id:old_key'. The first
+    # key encrypts new passwords, the others only decrypt. Overrides FERNET_ENCRYPTION_KEY, whose key ID is 'default'.
+    app.config['FERNET_KEYS'] = os.environ.get('FERNET_ENCRYPTION_KEYS')
+    # Seconds a decrypted SSH password is kept in memory (0: decrypt on every use)
+    app.config['CREDENTIAL_CACHE_TTL'] = float(os.environ.get('CREDENTIAL_CACHE_TTL', '60'))
+
+    # GOST configs are sharded per Server A: one JSON file and one service unit per server,
+    # so an apply only rewrites and reloads the servers whose config actually changed.
+    app.config['GOST_CONFIG_DIR'] = os.environ.get('GOST_CONFIG_DIR', os.path.join(app.instance_path, 'gost_configs'))
+    # Write shards as compact JSON without indentation: less than half the size for large shards
+    app.config['GOST_CONFIG_COMPACT'] = os.environ.get('GOST_CONFIG_COMPACT', 'false').lower() in ('1', 'true', 'yes')
+    # Name of the tuning profile for servers and transits that don't have one. Without it they get
+    # the built-in defaults (Debug on, no retries, no node options).
+    app.config['GOST_DEFAULT_TUNING_PROFILE'] = os.environ.get('GOST_DEFAULT_TUNING_PROFILE')
+    # Also generate and deploy the Server B end of every relay (a listener on the connect port
+    # forwarding to the destination). Disable it if Server B's GOST is managed by hand.
+    app.config['GOST_B_SIDE_CONFIGS'] = os.environ.get('GOST_B_SIDE_CONFIGS', 'true').lower() in ('1', 'true', 'yes')
+    app.config['GOST_SERVICE_TEMPLATE'] = os.environ.get('GOST_SERVICE_TEMPLATE', 'gost@{server_id}.service')
+    # How a changed shard is reloaded:
+    #   'systemctl'        - restart the shard's service (drops every live connection)
+    #   'systemctl-reload' - `systemctl reload`, i.e. the unit's ExecReload (e.g. a SIGHUP)
+    #   'api'              - push only the changed routes through the GOST v3 web API,
+    #                        falling back to a restart if the API call fails
+    app.config['GOST_RELOAD_BACKEND'] = os.environ.get('GOST_RELOAD_BACKEND', 'systemctl')
+    # Major version of the GOST the servers run, which decides the format of the shards: 'v2' writes
+    # Routes of ServeNodes/ChainNodes, 'v3' writes the services and chains the 'api' backend creates,
+    # under the same names, so a restart loads exactly what hot reloads leave running. Only v3 has a web API.
+    app.config['GOST_VERSION'] = os.environ.get('GOST_VERSION', 'v2').lower()
+    if app.config['GOST_RELOAD_BACKEND'] == 'api' and app.config['GOST_VERSION'] != 'v3':
+        print("Warning: GOST_RELOAD_BACKEND 'api' needs GOST_VERSION=v3, GOST v2 has no web API. "
+              "Changed shards are restarted instead.")
+    app.config['GOST_API_URL_TEMPLATE'] = os.environ.get('GOST_API_URL_TEMPLATE', 'http://{ip_address}:18080')
+    app.config['GOST_API_USERNAME'] = os.environ.get('GOST_API_USERNAME')
+    app.config['GOST_API_PASSWORD'] = os.environ.get('GOST_API_PASSWORD')
+    # Where shards are deployed: 'local' keeps them in GOST_CONFIG_DIR for a GOST running on
+    # this host; 'ssh' additionally uploads each shard over SFTP to its Server A and runs
+    # GOST_REMOTE_RELOAD_COMMAND there. Shards are reloaded concurrently on a bounded pool.
+    app.config['GOST_DEPLOY_MODE'] = os.environ.get('GOST_DEPLOY_MODE', 'local')
+    app.config['GOST_REMOTE_CONFIG_PATH'] = os.environ.get('GOST_REMOTE_CONFIG_PATH', '/etc/gost/config.json')
+    app.config['GOST_REMOTE_RELOAD_COMMAND'] = os.environ.get('GOST_REMOTE_RELOAD_COMMAND', 'sudo systemctl restart gost.service')
+    app.config['GOST_DEPLOY_MAX_WORKERS'] = int(os.environ.get('GOST_DEPLOY_MAX_WORKERS', '16'))
+    app.config['GOST_DEPLOY_TIMEOUT'] = float(os.environ.get('GOST_DEPLOY_TIMEOUT', '10')) # Seconds, per host and step
+    # Latency prober (`flask probe-latency`): TCP connect time to each transit's Server A listen port
+    app.config['LATENCY_PROBE_CONCURRENCY'] = int(os.environ.get('LATENCY_PROBE_CONCURRENCY', '200'))
+    app.config['LATENCY_PROBE_TIMEOUT'] = float(os.environ.get('LATENCY_PROBE_TIMEOUT', '3')) # Seconds per probe
+    app.config['LATENCY_PROBE_JITTER'] = float(os.environ.get('LATENCY_PROBE_JITTER', '2')) # Max random start delay, seconds
+    app.config['LATENCY_WINDOW_SECONDS'] = int(os.environ.get('LATENCY_WINDOW_SECONDS', '3600')) # Window for p50/p95
+    app.config['LATENCY_WINDOW_SAMPLES'] = int(os.environ.get('LATENCY_WINDOW_SAMPLES', '60')) # Of which at most the last N
+    app.config['LATENCY_HISTORY_SECONDS'] = int(os.environ.get('LATENCY_HISTORY_SECONDS', '86400')) # Sample retention
+    # Fleet health checker (`flask check-health`): TCP check of every server's SSH port, plus an
+    # SSH login check through the connection pool if HEALTH_CHECK_SSH is enabled
+    app.config['HEALTH_CHECK_CONCURRENCY'] = int(os.environ.get('HEALTH_CHECK_CONCURRENCY', '500'))
+    app.config['HEALTH_CHECK_TIMEOUT'] = float(os.environ.get('HEALTH_CHECK_TIMEOUT', '3')) # Seconds per check
+    app.config['HEALTH_CHECK_SSH'] = os.environ.get('HEALTH_CHECK_SSH', 'false').lower() in ('1', 'true', 'yes')
+    app.config['HEALTH_CHECK_SSH_WORKERS'] = int(os.environ.get('HEALTH_CHECK_SSH_WORKERS', '32'))
+    # Traffic metrics collector (`flask collect-metrics`): scrapes the Prometheus exporter of GOST v3
+    # (started with `-metrics :9000`) on every Server A. {ip_address} and {server_id} are filled in.
+    app.config['GOST_METRICS_URL_TEMPLATE'] = os.environ.get('GOST_METRICS_URL_TEMPLATE', 'http://{ip_address}:9000/metrics')
+    app.config['METRICS_SCRAPE_TIMEOUT'] = float(os.environ.get('METRICS_SCRAPE_TIMEOUT', '5')) # Seconds per server
+    app.config['METRICS_SCRAPE_WORKERS'] = int(os.environ.get('METRICS_SCRAPE_WORKERS', '32'))
+    # How long the 1-minute, hourly and daily buckets are kept, in seconds
+    app.config['METRICS_RETENTION_1M'] = int(os.environ.get('METRICS_RETENTION_1M', str(2 * 86400)))
+    app.config['METRICS_RETENTION_1H'] = int(os.environ.get('METRICS_RETENTION_1H', str(90 * 86400)))
+    app.config['METRICS_RETENTION_1D'] = int(os.environ.get('METRICS_RETENTION_1D', str(730 * 86400)))
+    # The status page lists the METRICS_TOP_N busiest transits over the last METRICS_TOP_WINDOW seconds
+    app.config['METRICS_TOP_N'] = int(os.environ.get('METRICS_TOP_N', '10'))
+    app.config['METRICS_TOP_WINDOW'] = int(os.environ.get('METRICS_TOP_WINDOW', '3600'))
+    # Route optimizer (`flask probe-links`, `flask optimize-routes`): every server measures its TCP connect
+    # time and loss to the other servers and to the transit destinations, over SSH with python3
+    app.config['ROUTE_PROBE_SAMPLES'] = int(os.environ.get('ROUTE_PROBE_SAMPLES', '3')) # Connects per link
+    app.config['ROUTE_PROBE_TIMEOUT'] = float(os.environ.get('ROUTE_PROBE_TIMEOUT', '3')) # Seconds per connect
+    app.config['ROUTE_PROBE_WORKERS'] = int(os.environ.get('ROUTE_PROBE_WORKERS', '32')) # Servers probing at once
+    app.config['ROUTE_LINK_MAX_AGE'] = int(os.environ.get('ROUTE_LINK_MAX_AGE', '3600')) # Older links are ignored
+    # A link costs its latency plus this many milliseconds per 100% loss (1000: 1% loss = +10 ms)
+    app.config['ROUTE_LOSS_PENALTY_MS'] = float(os.environ.get('ROUTE_LOSS_PENALTY_MS', '1000'))
+    # Relay hops a chain may have between Server A and Server B (0: only pick the best Server B)
+    app.config['ROUTE_MAX_HOPS'] = int(os.environ.get('ROUTE_MAX_HOPS', '1'))
+    # A transit only moves to a better chain if it is faster by both margins, so routes don't flap
+    app.config['ROUTE_SWITCH_MIN_GAIN'] = float(os.environ.get('ROUTE_SWITCH_MIN_GAIN', '0.1')) # Share of the current cost
+    app.config['ROUTE_SWITCH_MIN_GAIN_MS'] = float(os.environ.get('ROUTE_SWITCH_MIN_GAIN_MS', '5'))
+    # /status and /api/status render from a cached snapshot. Changes made by this process
+    # refresh it immediately; the TTL bounds how stale it gets for writes from other processes (CLI tasks).
+    app.config['STATUS_SNAPSHOT_TTL'] = float(os.environ.get('STATUS_SNAPSHOT_TTL', '5')) # Seconds
+    # Live status stream (/api/status/stream): changes made by this process are pushed right after
+    # their commit, changes from other processes within LIVE_STATUS_POLL_INTERVAL seconds. A stream
+    # holds a worker thread, so it ends after LIVE_STATUS_STREAM_SECONDS and the browser reconnects
+    # from its last event. Unthreaded servers, or 0, make the pages poll /api/status at the poll interval.
+    app.config['LIVE_STATUS_POLL_INTERVAL'] = float(os.environ.get('LIVE_STATUS_POLL_INTERVAL', '2'))
+    app.config['LIVE_STATUS_STREAM_SECONDS'] = int(os.environ.get('LIVE_STATUS_STREAM_SECONDS', '5'))
+    # Default number of rows per page in the server and transit lists (HTML and JSON)
+    app.config['LIST_PAGE_SIZE'] = int(os.environ.get('LIST_PAGE_SIZE', '50'))
+    # Range that free Server A listen ports are allocated from (free-port API and bulk import)
+    app.config['PORT_ALLOCATION_RANGE'] = os.environ.get('PORT_ALLOCATION_RANGE', '10000-60000')
+
+    # Configure the SQLAlchemy part of the app instance
+    # Update SQLite path to be in the instance folder for better organization
+    default_db_path = os.path.join(app.instance_path, 'default.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f'sqlite:///{default_db_path}')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # SQLite: set on every connection. WAL lets the web workers, jobs and CLI tasks read while
+    # one of them writes, and the busy timeout (milliseconds) makes writers queue up instead
+    # of failing with 'database is locked'.
+    app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000'))
+    # PostgreSQL/MySQL connection pool, per process. Connections are pre-pinged on checkout.
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', '5'))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+    app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', '30')) # Seconds to wait for a free connection
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', '1800')) # Seconds before a connection is replaced
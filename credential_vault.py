@@ -0,0 +1,274 @@
+import base64
+import binascii
+import re
+import threading
+import time
+
+from sqlalchemy import bindparam
+
+from extensions import db
+import models
+
+KEY_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+# Key ID of the single key in FERNET_ENCRYPTION_KEY
+DEFAULT_KEY_ID = 'default'
+
+
+def parse_fernet_keys(value):
+    """
+    Parses FERNET_ENCRYPTION_KEYS: comma-separated 'key_id:key' pairs, the active key first.
+    Returns a list of (key_id, key) tuples. Raises ValueError for a malformed value.
+    """
+    keys = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        key_id, separator, key = part.partition(':')
+        if not separator or not key:
+            raise ValueError(f"Invalid Fernet key entry '{key_id}'. Use key_id:key.")
+        keys.append((key_id.strip(), key.strip()))
+    return keys
+
+
+class CredentialVault:
+    """
+    Encrypts and decrypts secrets such as SSH passwords with one or more Fernet keys.
+
+    Every key has a key ID, and ciphertexts are stored as '<key_id>:<Fernet token>', so a
+    secret is decrypted with its own key instead of trying them all. New secrets are always
+    encrypted with the first (active) key; the other keys only decrypt, until
+    rotate_server_passwords() has re-encrypted everything with the active key. Tokens
+    without a key ID, written before key IDs existed, are tried against every key.
+
+    The keys are checked when they are configured, but the Fernet objects (and with them the
+    cryptography package) are only built on first use. Decrypted secrets are kept in memory
+    for cache_ttl seconds (0 disables the cache), keyed by their ciphertext, so that
+    fleet-wide operations don't decrypt the same password on every run.
+
+    Without keys the vault is unconfigured until configure() or init_app() is called.
+    """
+
+    def __init__(self, keys=None, cache_ttl=60):
+        self._lock = threading.Lock()
+        self._cache = {} # ciphertext -> (secret, expires_at)
+        self._swept_at = time.monotonic()
+        self._keys = {}
+        self._ciphers = None
+        self.active_key_id = None
+        self.cache_ttl = cache_ttl
+        if keys is not None:
+            self.configure(keys, cache_ttl)
+
+    def configure(self, keys, cache_ttl=60):
+        """Sets the keys, the active one first. Raises ValueError for an invalid key or key ID."""
+        if not keys:
+            raise ValueError("At least one Fernet key is required.")
+        checked_keys = {}
+        for key_id, key in keys:
+            if not KEY_ID_PATTERN.match(key_id):
+                raise ValueError(f"Invalid Fernet key ID '{key_id}'. Use up to 32 letters, digits, '_' or '-'.")
+            if key_id in checked_keys:
+                raise ValueError(f"Duplicate Fernet key ID '{key_id}'.")
+            # The same check Fernet() makes, without importing cryptography yet
+            try:
+                valid = len(base64.urlsafe_b64decode(key)) == 32
+            except (binascii.Error, ValueError, TypeError):
+                valid = False
+            if not valid:
+                raise ValueError(f"Fernet key '{key_id}' must be 32 url-safe base64-encoded bytes.")
+            checked_keys[key_id] = key
+        with self._lock:
+            self._keys = checked_keys
+            self._ciphers = None
+            self.active_key_id = keys[0][0]
+            self.cache_ttl = cache_ttl
+        self.evict()
+
+    def init_app(self, app):
+        """Configures the vault from FERNET_KEYS (or FERNET_KEY) and CREDENTIAL_CACHE_TTL."""
+        if app.config['FERNET_KEYS']:
+            keys = parse_fernet_keys(app.config['FERNET_KEYS'])
+        else:
+            keys = [(DEFAULT_KEY_ID, app.config['FERNET_KEY'])]
+        self.configure(keys, cache_ttl=app.config['CREDENTIAL_CACHE_TTL'])
+
+    def _get_ciphers(self):
+        """Returns (Fernet per key ID, MultiFernet over all keys), building them on first use."""
+        ciphers = self._ciphers
+        if ciphers is None:
+            if not self._keys:
+                raise RuntimeError("The credential vault has no keys, call init_app() first.")
+            from cryptography.fernet import Fernet, MultiFernet
+            by_key_id = {key_id: Fernet(key) for key_id, key in self._keys.items()}
+            # The MultiFernet tries the keys in order, for tokens without a key ID
+            ciphers = self._ciphers = (by_key_id, MultiFernet(list(by_key_id.values())))
+        return ciphers
+
+    @property
+    def key_ids(self):
+        return list(self._keys)
+
+    @staticmethod
+    def key_id_of(ciphertext):
+        """Returns the key ID of a ciphertext, or None for a token without one."""
+        # Fernet tokens are URL-safe base64, so they never contain ':'
+        key_id, separator, _ = ciphertext.partition(':')
+        return key_id if separator else None
+
+    def encrypt(self, secret):
+        """Encrypts a secret with the active key. Returns None for an empty secret."""
+        if not secret:
+            return None
+        token = self._get_ciphers()[0][self.active_key_id].encrypt(secret.encode()).decode()
+        return f"{self.active_key_id}:{token}"
+
+    def _decrypt(self, ciphertext):
+        """Decrypts without the cache. Raises InvalidToken if no key fits."""
+        from cryptography.fernet import InvalidToken
+
+        ciphers, any_key = self._get_ciphers()
+        key_id = self.key_id_of(ciphertext)
+        if key_id is None:
+            return any_key.decrypt(ciphertext.encode()).decode()
+        cipher = ciphers.get(key_id)
+        if cipher is None:
+            raise InvalidToken(f"Unknown Fernet key ID '{key_id}'.")
+        return cipher.decrypt(ciphertext[len(key_id) + 1:].encode()).decode()
+
+    def decrypt(self, ciphertext):
+        """Decrypts a secret, from the cache if possible. Returns None if it can't be decrypted."""
+        if not ciphertext:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(ciphertext)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        from cryptography.fernet import InvalidToken
+
+        try:
+            secret = self._decrypt(ciphertext)
+        except InvalidToken as e:
+            # This can happen if the key is wrong or the token is corrupted
+            print(f"Error: Invalid token or key during decryption. {e}".rstrip())
+            return None
+        if self.cache_ttl > 0:
+            with self._lock:
+                self._cache[ciphertext] = (secret, now + self.cache_ttl)
+                sweep = now - self._swept_at >= self.cache_ttl
+            if sweep:
+                # Secrets that are never read again must not stay in memory either
+                self.evict_expired()
+        return secret
+
+    def needs_rotation(self, ciphertext):
+        return bool(ciphertext) and self.key_id_of(ciphertext) != self.active_key_id
+
+    def rotate(self, ciphertext):
+        """Re-encrypts a ciphertext with the active key. Raises InvalidToken if no key fits."""
+        return self.encrypt(self._decrypt(ciphertext))
+
+    def evict(self, ciphertexts=None):
+        """Drops the given ciphertexts from the cache, or the whole cache if none are given."""
+        with self._lock:
+            if ciphertexts is None:
+                self._cache.clear()
+            else:
+                for ciphertext in ciphertexts:
+                    self._cache.pop(ciphertext, None)
+
+    def evict_expired(self):
+        """Drops the cached secrets whose TTL has passed. Returns how many were dropped."""
+        now = time.monotonic()
+        with self._lock:
+            self._swept_at = now
+            expired = [ciphertext for ciphertext, (_, expires_at) in self._cache.items() if expires_at <= now]
+            for ciphertext in expired:
+                del self._cache[ciphertext]
+        return len(expired)
+
+
+def rotate_server_passwords(batch_size=500):
+    """
+    Re-encrypts every Servers.ssh_password that isn't encrypted with the active key.
+
+    Servers are walked in ID order, one short transaction per batch, so the table is never
+    locked for the whole run and it can be interrupted and started again at any time. A
+    password is only replaced if it didn't change since it was read, and updated_at is kept,
+    so a rotation doesn't count as an edit. Must run in an app context.
+
+    Returns (rotated, failed): the number of re-encrypted passwords and the IDs of the
+    servers whose password no configured key could decrypt.
+    """
+    from cryptography.fernet import InvalidToken
+
+    servers = models.Servers.__table__
+    replace_password = servers.update().where(
+        servers.c.id == bindparam('b_id'), servers.c.ssh_password == bindparam('b_old')
+    ).values(ssh_password=bindparam('b_new'), updated_at=servers.c.updated_at)
+
+    rotated = 0
+    failed = []
+    last_id = 0
+    while True:
+        batch = db.session.query(models.Servers.id, models.Servers.ssh_password).filter(
+            models.Servers.id > last_id).order_by(models.Servers.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        rows = []
+        for server_id, ciphertext in batch:
+            if not vault.needs_rotation(ciphertext):
+                continue
+            try:
+                rows.append({'b_id': server_id, 'b_old': ciphertext, 'b_new': vault.rotate(ciphertext)})
+            except InvalidToken:
+                failed.append(server_id)
+        if rows:
+            result = db.session.execute(replace_password, rows)
+            rotated += result.rowcount
+        db.session.commit()
+        vault.evict(row['b_old'] for row in rows)
+    return rotated, failed
+
+
+# Shared by everything that stores or uses SSH passwords, configured by create_app()
+vault = CredentialVault()
+
+
+if __name__ == '__main__':
+    from cryptography.fernet import Fernet
+
+    # Decrypting 1,000 passwords: a new Fernet per call (the previous utils.decrypt_password)
+    # against the vault's cached ciphers, without and with the secret cache.
+    old_key, new_key = Fernet.generate_key(), Fernet.generate_key()
+    legacy = Fernet(old_key)
+    legacy_tokens = [legacy.encrypt(f"password-{i}".encode()).decode() for i in range(1000)]
+
+    def _per_call_fernet(token):
+        return Fernet(old_key).decrypt(token.encode()).decode()
+
+    def _timed(name, decrypt, tokens):
+        start = time.perf_counter()
+        for token in tokens:
+            decrypt(token)
+        print(f"{name:<34} {(time.perf_counter() - start) * 1000:7.1f}ms")
+
+    uncached = CredentialVault([(DEFAULT_KEY_ID, old_key)], cache_ttl=0)
+    vault_tokens = [uncached.encrypt(f"password-{i}") for i in range(1000)]
+    cached = CredentialVault([(DEFAULT_KEY_ID, old_key)], cache_ttl=60)
+    _timed('new Fernet per call', _per_call_fernet, legacy_tokens)
+    _timed('vault, cached ciphers', uncached.decrypt, vault_tokens)
+    cached.decrypt(vault_tokens[0])
+    _timed('vault, cold secret cache', cached.decrypt, vault_tokens)
+    _timed('vault, warm secret cache', cached.decrypt, vault_tokens)
+
+    # Rotation: the new key becomes active, the old one still decrypts
+    rotating = CredentialVault([('2', new_key), (DEFAULT_KEY_ID, old_key)])
+    assert rotating.decrypt(legacy_tokens[0]) == 'password-0' # Token without key ID
+    assert rotating.decrypt(vault_tokens[1]) == 'password-1'
+    rotated_token = rotating.rotate(vault_tokens[1])
+    assert rotated_token.startswith('2:') and not rotating.needs_rotation(rotated_token)
+    assert CredentialVault([('2', new_key)]).decrypt(rotated_token) == 'password-1'
+    print(f"Rotated {vault_tokens[1][:12]}... to {rotated_token[:12]}...")
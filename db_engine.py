@@ -0,0 +1,152 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+SQLITE_JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SQLITE_SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def is_sqlite(database_uri):
+    return make_url(database_uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(database_uri, config):
+    """
+    Returns the SQLAlchemy create_engine() options for the configured database.
+
+    Server databases (PostgreSQL, MySQL) get a sized connection pool that recycles
+    connections before the server or a proxy drops them, and pre-pings each connection
+    on checkout so a database restart doesn't surface as errors in requests. SQLite
+    keeps Flask-SQLAlchemy's defaults; it is tuned per connection by configure_engine().
+    """
+    if is_sqlite(database_uri):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+def sqlite_pragmas(config):
+    """
+    Returns the PRAGMA statements run on every new SQLite connection.
+    Raises ValueError for an unknown journal mode or synchronous level.
+    """
+    journal_mode = config['SQLITE_JOURNAL_MODE'].upper()
+    synchronous = config['SQLITE_SYNCHRONOUS'].upper()
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f"Invalid SQLITE_JOURNAL_MODE '{journal_mode}'. Choose one of: {', '.join(SQLITE_JOURNAL_MODES)}.")
+    if synchronous not in SQLITE_SYNCHRONOUS_LEVELS:
+        raise ValueError(f"Invalid SQLITE_SYNCHRONOUS '{synchronous}'. Choose one of: {', '.join(SQLITE_SYNCHRONOUS_LEVELS)}.")
+    return [
+        # WAL lets readers and one writer work at the same time instead of locking the whole file
+        f"PRAGMA journal_mode={journal_mode}",
+        # In WAL mode NORMAL only syncs at checkpoints: still safe against corruption,
+        # a power loss can at most lose the last commits
+        f"PRAGMA synchronous={synchronous}",
+        # Wait for a lock held by another worker instead of failing with 'database is locked'
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",
+    ]
+
+
+def configure_engine(engine, config):
+    """Installs the SQLite connection pragmas on an engine. Other databases need nothing here."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+if __name__ == '__main__':
+    # Concurrency benchmark: several processes commit apply-like status batches to one
+    # SQLite file while also reading, once untuned (rollback journal, full sync, no busy
+    # timeout) and once with the settings this app uses by default.
+    # Usage: python db_engine.py --benchmark [WORKERS] [TRANSACTIONS_PER_WORKER]
+    import multiprocessing
+    import os
+    import sys
+    import tempfile
+    import time
+
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import OperationalError
+
+    UNTUNED = {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_BUSY_TIMEOUT': 0}
+    TUNED = {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'NORMAL', 'SQLITE_BUSY_TIMEOUT': 5000}
+    TRANSIT_COUNT = 5000
+    BATCH_SIZE = 50
+
+    def _engine(url, config):
+        engine = create_engine(url)
+        configure_engine(engine, config)
+        return engine
+
+    def _worker(url, config, worker_id, transactions, results):
+        engine = _engine(url, config)
+        latencies, locked = [], 0
+        for i in range(transactions):
+            first_id = (worker_id * transactions + i) * BATCH_SIZE % TRANSIT_COUNT + 1
+            start = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    # Read, then write in the same transaction, like an apply does
+                    conn.execute(text("SELECT count(*) FROM transits WHERE status = 'pending'")).scalar()
+                    conn.execute(text("UPDATE transits SET status = :status, updated_at = CURRENT_TIMESTAMP "
+                                      "WHERE id BETWEEN :first AND :last"),
+                                 {'status': 'active' if i % 2 else 'error', 'first': first_id,
+                                  'last': first_id + BATCH_SIZE - 1})
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                locked += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+        results.put((latencies, locked))
+
+    def _run(name, config, workers, transactions):
+        path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        url = f"sqlite:///{path}"
+        with _engine(url, config).begin() as conn:
+            conn.execute(text("CREATE TABLE transits (id INTEGER PRIMARY KEY, status VARCHAR(50), updated_at DATETIME)"))
+            conn.execute(text("INSERT INTO transits (id, status) VALUES (:id, 'pending')"),
+                         [{'id': i} for i in range(1, TRANSIT_COUNT + 1)])
+            conn.execute(text("CREATE INDEX ix_transits_status ON transits (status)"))
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_worker, args=(url, config, worker_id, transactions, results))
+                     for worker_id in range(workers)]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency for worker_latencies, _ in outcomes for latency in worker_latencies)
+        locked = sum(worker_locked for _, worker_locked in outcomes)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else float('nan')
+        print(f"{name:<8} {len(latencies):>6} commits in {elapsed:6.2f}s ({len(latencies) / elapsed:7.0f}/s), "
+              f"p95 {p95:7.1f}ms, {locked} 'database is locked' error(s)")
+
+    if '--benchmark' in sys.argv:
+        args = sys.argv[sys.argv.index('--benchmark') + 1:]
+        worker_count = int(args[0]) if args else 8
+        transactions_per_worker = int(args[1]) if len(args) > 1 else 200
+        print(f"{worker_count} workers x {transactions_per_worker} transactions of {BATCH_SIZE} status updates")
+        _run('untuned', UNTUNED, worker_count, transactions_per_worker)
+        _run('tuned', TUNED, worker_count, transactions_per_worker)
+    else:
+        print(sqlite_pragmas(TUNED))
+        print(engine_options('postgresql://gost@db/gost', {'DB_POOL_SIZE': 5, 'DB_MAX_OVERFLOW': 10,
+                                                             'DB_POOL_TIMEOUT': 30, 'DB_POOL_RECYCLE': 1800}))
@@ -0,0 +1,116 @@
+import os
+import posixpath
+import socket # For socket.error
+from concurrent.futures import ThreadPoolExecutor
+
+from ssh_pool import ssh_pool
+
+
+def upload_gost_config(ip, port, username, password, local_config_path, remote_path,
+                       reload_command=None, timeout=10, key_filename=None):
+    """
+    Uploads a local GOST config file to a remote server over SFTP and optionally reloads GOST there.
+
+    The file is first written next to remote_path and then renamed over it, so GOST never
+    sees a half-written config. The file is streamed, never read into memory as a whole.
+    Every network step (connect, auth, SFTP, command) is bounded by `timeout` seconds. The
+    SSH session comes from the shared connection pool. With key_filename the private key
+    file is used instead of the password.
+
+    Returns (True, message) on success, or (False, error_message) on failure.
+    """
+    import paramiko # Loaded on first use, see ssh_pool
+
+    try:
+        port = int(port)
+        with ssh_pool.connection(ip, port, username, password, timeout=timeout,
+                                 key_filename=key_filename) as client:
+            return _upload_and_reload(client, ip, local_config_path, remote_path, reload_command, timeout)
+    except paramiko.AuthenticationException:
+        return False, "Authentication failed (wrong username, password or SSH key)."
+    except paramiko.SSHException as e:
+        return False, f"SSH error: {str(e)}"
+    except socket.timeout:
+        return False, f"Connection timed out to {ip}:{port}."
+    except (socket.error, IOError) as e: # Network and SFTP errors
+        return False, f"Network error: {str(e)}"
+    except Exception as e:
+        return False, f"An unexpected error occurred: {str(e)}"
+
+
+def _upload_and_reload(client, ip, local_config_path, remote_path, reload_command, timeout):
+    """Does the SFTP upload and reload on an already connected client."""
+    sftp = client.open_sftp()
+    try:
+        sftp.get_channel().settimeout(timeout)
+        remote_dir = posixpath.dirname(remote_path)
+        if remote_dir:
+            try:
+                sftp.stat(remote_dir)
+            except FileNotFoundError:
+                sftp.mkdir(remote_dir)
+        temp_remote_path = f"{remote_path}.tmp"
+        sftp.put(local_config_path, temp_remote_path)
+        sftp.posix_rename(temp_remote_path, remote_path)
+    finally:
+        sftp.close()
+
+    if not reload_command:
+        return True, f"Uploaded config to {ip}:{remote_path}."
+
+    stdin, stdout, stderr = client.exec_command(reload_command, timeout=timeout)
+    if not stdout.channel.status_event.wait(timeout):
+        stdout.channel.close()
+        return False, f"Reload command '{reload_command}' timed out on {ip}."
+    exit_status = stdout.channel.recv_exit_status()
+    if exit_status != 0:
+        error_output = stderr.read().decode(errors='replace').strip() or stdout.read().decode(errors='replace').strip()
+        return False, f"Reload command '{reload_command}' failed on {ip} (exit {exit_status}): {error_output}"
+    return True, f"Uploaded config to {ip}:{remote_path} and ran '{reload_command}'."
+
+
+def run_in_parallel(func, items, max_workers=16):
+    """
+    Calls func(item) for every item on a bounded thread pool.
+
+    func is expected to report failures through its return value (like the
+    (success, message) tuples used throughout this app); an exception raised by
+    func is turned into (False, message) for that item.
+
+    Returns the results in the same order as items.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def _safe_call(item):
+        try:
+            return func(item)
+        except Exception as e:
+            return False, f"An unexpected error occurred: {str(e)}"
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        return list(executor.map(_safe_call, items))
+
+
+if __name__ == '__main__':
+    # Fan out to a few addresses that are not expected to answer: the wall time should be
+    # close to a single timeout, not one timeout per host.
+    import tempfile
+    import time
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as demo_config:
+        demo_config.write('{}')
+    unreachable_hosts = [f"10.255.255.{i}" for i in range(1, 9)]
+
+    start = time.monotonic()
+    results = run_in_parallel(
+        lambda ip: upload_gost_config(ip, 22, 'root', 'password', demo_config.name, '/etc/gost/config.json',
+                                      reload_command='sudo systemctl restart gost.service', timeout=2),
+        unreachable_hosts,
+        max_workers=8,
+    )
+    for ip, (success, message) in zip(unreachable_hosts, results):
+        print(f"{ip}: success={success} message={message}")
+    print(f"Deployed to {len(unreachable_hosts)} hosts in {time.monotonic() - start:.2f}s")
+    os.remove(demo_config.name)
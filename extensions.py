@@ -0,0 +1,7 @@
+from flask_babel import Babel
+from flask_sqlalchemy import SQLAlchemy
+
+# Created unbound and attached to the app by create_app(), so models and the other modules
+# can import them without importing app.py (and without an app existing yet)
+db = SQLAlchemy()
+babel = Babel()
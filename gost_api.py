@@ -0,0 +1,192 @@
+import base64
+import json
+import urllib.error
+import urllib.request
+from urllib.parse import parse_qsl, quote, urlsplit
+
+
+def route_to_gost_api_objects(transit_id, route: dict):
+    """
+    Translates one generated GOST route into GOST v3 web API objects.
+
+    Every ServeNode becomes its own service and the ChainNodes (if any) become a
+    single chain with one hop per node (see Transits.hops). Object names are derived from the transit ID so that
+    a route can later be updated or removed without knowing its previous contents.
+
+    Args:
+        transit_id: The key of the route: the ID of its transit, or a Server B or relay hop route key
+                    (gost_config_generator.b_side_route_key(), hop_route_key()).
+        route: A route dictionary as built by gost_config_generator.build_gost_route().
+
+    Returns:
+        A tuple (services, chains) of lists of GOST v3 API objects.
+    """
+    chain_name = f"transit-{transit_id}-chain"
+    chains = []
+
+    chain_nodes = route.get("ChainNodes", [])
+    if chain_nodes:
+        hops = []
+        for index, chain_node in enumerate(chain_nodes):
+            nodes = []
+            selector = {}
+            node_url = urlsplit(chain_node)
+            # e.g. relay+ws -> connector 'relay', dialer 'ws'
+            connector_type, _, dialer_type = node_url.scheme.partition('+')
+            params = dict(parse_qsl(node_url.query))
+            # A v2 node group (ip=ADDR,ADDR&strategy=...) becomes one v3 node per address
+            # plus the hop's selector
+            group_addresses = params.pop('ip').split(',') if 'ip' in params else [node_url.netloc]
+            for v2_param, v3_field in (('strategy', 'strategy'), ('max_fails', 'maxFails'), ('fail_timeout', 'failTimeout')):
+                if v2_param in params:
+                    value = params.pop(v2_param)
+                    selector[v3_field] = int(value) if v3_field == 'maxFails' else value
+            for address_index, address in enumerate(group_addresses):
+                node = {
+                    "name": f"node-{index}" if len(group_addresses) == 1 else f"node-{index}-{address_index}",
+                    "addr": address,
+                    "connector": {"type": connector_type},
+                    "dialer": {"type": dialer_type or "tcp"},
+                }
+                # Node parameters from the tuning profile (timeout, keepalive, ...) are dialer metadata in v3
+                if params:
+                    node["dialer"]["metadata"] = dict(params)
+                nodes.append(node)
+            hop = {"name": f"hop-{index}", "nodes": nodes}
+            if selector:
+                hop["selector"] = selector
+            hops.append(hop)
+        chains.append({
+            "name": chain_name,
+            "hops": hops,
+        })
+
+    services = []
+    for serve_node in route.get("ServeNodes", []):
+        serve_url = urlsplit(serve_node)
+        # e.g. relay+ws (a Server B listener) -> handler 'relay', listener 'ws'; tcp -> both 'tcp'
+        handler_type, _, listener_type = serve_url.scheme.partition('+')
+        service = {
+            "name": f"transit-{transit_id}-{handler_type}",
+            "addr": serve_url.netloc,
+            "handler": {"type": handler_type},
+            "listener": {"type": listener_type or handler_type},
+        }
+        listener_params = dict(parse_qsl(serve_url.query))
+        # v3 has no whitelist parameter (relay hops): their connect ports have to be firewalled instead
+        listener_params.pop('whitelist', None)
+        if listener_params: # e.g. the UDP session ttl
+            service["listener"]["metadata"] = listener_params
+        if chains:
+            service["handler"]["chain"] = chain_name
+        if route.get("Retries"):
+            service["handler"]["retries"] = route["Retries"]
+        # Direct forwards carry their target in the path: tcp://:LISTEN_PORT/DEST_IP:DEST_PORT
+        forward_target = serve_url.path.lstrip('/')
+        if forward_target:
+            service["forwarder"] = {"nodes": [{"name": "target-0", "addr": forward_target}]}
+        services.append(service)
+
+    return services, chains
+
+
+def assemble_gost_v3_config(routes: dict, debug=True) -> dict:
+    """
+    Builds the GOST v3 config of a shard: the services and chains of its routes exactly as
+    the web API creates them (see route_to_gost_api_objects()), so the file a GOST restart
+    loads and the state hot reloads leave behind are the same.
+
+    Args:
+        routes: {route key: route} of the shard.
+        debug: The shard's Debug key, which becomes the log level in v3.
+
+    Returns:
+        The config dictionary, to be written as JSON.
+    """
+    services, chains = [], []
+    for route_key, route in routes.items():
+        route_services, route_chains = route_to_gost_api_objects(route_key, route)
+        services.extend(route_services)
+        chains.extend(route_chains)
+    return {"services": services, "chains": chains, "log": {"level": "debug" if debug else "info"}}
+
+
+def _gost_api_request(api_url, method, path, payload=None, auth=None, timeout=10):
+    """
+    Sends a single request to the GOST web API.
+    Returns (status_code, response_text). Network errors are raised as OSError.
+    """
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(f"{api_url.rstrip('/')}{path}", data=data, method=method)
+    req.add_header('Content-Type', 'application/json')
+    if auth:
+        credentials = base64.b64encode(f"{auth[0]}:{auth[1]}".encode()).decode()
+        req.add_header('Authorization', f"Basic {credentials}")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode(errors='replace')
+
+
+def _delete_transit_objects(api_url, transit_id, auth, timeout):
+    """Deletes the services and chain of a transit. Objects that are already gone are ignored."""
+    # Generated routes only ever have tcp, udp or relay (Server B) handlers, so the names
+    # are known without the previous route contents.
+    service_names = [f"transit-{transit_id}-{handler}" for handler in ('tcp', 'udp', 'relay')]
+    chain_names = [f"transit-{transit_id}-chain"]
+    # Services reference the chain, so they have to go first
+    for kind, names in (('services', service_names), ('chains', chain_names)):
+        for name in names:
+            status, text = _gost_api_request(api_url, 'DELETE', f"/config/{kind}/{quote(name)}",
+                                             auth=auth, timeout=timeout)
+            if status >= 400 and status != 404:
+                return False, f"DELETE {kind}/{name} failed with HTTP {status}: {text.strip()}"
+    return True, None
+
+
+def _create_transit_objects(api_url, transit_id, route, auth, timeout):
+    """Creates the chain and services of a transit."""
+    services, chains = route_to_gost_api_objects(transit_id, route)
+    # The chain has to exist before a service can reference it
+    for kind, objects in (('chains', chains), ('services', services)):
+        for obj in objects:
+            status, text = _gost_api_request(api_url, 'POST', f"/config/{kind}", payload=obj,
+                                             auth=auth, timeout=timeout)
+            if status >= 400:
+                return False, f"POST {kind}/{obj['name']} failed with HTTP {status}: {text.strip()}"
+    return True, None
+
+
+def apply_route_diff_via_gost_api(api_url, new_routes: dict, diff: dict, auth=None, timeout=10):
+    """
+    Applies a route-level diff to a running GOST instance through its v3 web API.
+
+    Only the services and chains of added, changed and removed transits are touched,
+    so connections on every other route stay up.
+
+    Args:
+        api_url: Base URL of the GOST web API, e.g. http://1.2.3.4:18080.
+        new_routes: {route key: route} of the new config.
+        diff: The result of gost_config_generator.diff_route_hashes().
+        auth: Optional (username, password) tuple for basic auth.
+        timeout: Per-request timeout in seconds.
+
+    Returns:
+        (success: bool, message: str)
+    """
+    try:
+        for transit_id in diff['removed'] + diff['changed']:
+            success, error = _delete_transit_objects(api_url, transit_id, auth, timeout)
+            if not success:
+                return False, error
+        for transit_id in diff['changed'] + diff['added']:
+            success, error = _create_transit_objects(api_url, transit_id, new_routes[transit_id], auth, timeout)
+            if not success:
+                return False, error
+    except OSError as e: # Includes urllib.error.URLError and socket timeouts
+        return False, f"GOST API at {api_url} is unreachable: {str(e)}"
+
+    return True, (f"Applied {len(diff['added'])} added, {len(diff['changed'])} changed and "
+                  f"{len(diff['removed'])} removed route(s) via the GOST API.")
+
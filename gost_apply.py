@@ -0,0 +1,396 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from functools import partial
+
+from flask import current_app
+from flask_babel import gettext as _
+from sqlalchemy import insert, update
+from sqlalchemy.orm import selectinload
+
+from extensions import db
+import models
+import app_metrics
+from credential_vault import vault
+from deploy import upload_gost_config, run_in_parallel
+from gost_api import apply_route_diff_via_gost_api, assemble_gost_v3_config
+from gost_config_generator import generate_gost_routes_by_server, hash_gost_routes, \
+                                  write_gost_config, diff_route_hashes, compile_gost_tunings, \
+                                  resolve_gost_tuning, DEFAULT_GOST_TUNING, parse_route_key, \
+                                  route_key_transit_id, hash_gost_settings
+from jobs import update_job_progress
+from utils import restart_gost_service, reload_gost_service
+
+# Serializes apply jobs within this process
+_apply_lock = threading.Lock()
+# Transit IDs per UPDATE statement, well below the bound parameter limits of SQLite and PostgreSQL
+_STATUS_UPDATE_CHUNK_SIZE = 500
+
+
+def _gost_config_path(server_id):
+    """Returns the path of the GOST config shard for the given Server A."""
+    return os.path.join(current_app.config['GOST_CONFIG_DIR'], f'server_{server_id}.json')
+
+
+def _write_gost_config_file(config_path, routes: dict, tuning=DEFAULT_GOST_TUNING):
+    """
+    Atomically writes the config of the given {route key: route} via a temporary file, in
+    the format of GOST_VERSION. v2 configs are streamed route by route. Raises OSError on failure.
+    """
+    temp_config_path = f"{config_path}.tmp"
+    compact = current_app.config['GOST_CONFIG_COMPACT']
+    try:
+        with open(temp_config_path, 'w') as f:
+            if current_app.config['GOST_VERSION'] == 'v3':
+                json.dump(assemble_gost_v3_config(routes, tuning.debug), f,
+                          **({'separators': (',', ':')} if compact else {'indent': 4}))
+            else:
+                write_gost_config(routes.values(), f, compact=compact, tuning=tuning)
+        os.replace(temp_config_path, config_path)
+    except OSError:
+        # Attempt to clean up temp file if it exists
+        if os.path.exists(temp_config_path):
+            try:
+                os.remove(temp_config_path)
+            except OSError:
+                pass # Ignore errors on cleanup
+        raise
+
+
+def plan_gost_config_apply():
+    """
+    Compares the freshly generated config shards against the last applied ones.
+
+    Returns (plans, skipped_transits). There is one plan per server (as Server A and/or
+    Server B), each a dict with the server, its ID and name, the generated routes, the shard's
+    GostTuning, the hash of their config, the per-route hashes, the hash of its top-level keys,
+    the route-level diff against the last applied config, whether the shard changed at all,
+    whether its top-level keys did, and the transits that have routes in the shard.
+    skipped_transits are the transits the generator left out (e.g. a listen port
+    conflict or an unsupported protocol), so that they can't break their shard.
+    """
+    # If a transit is 'inactive' it won't be part of the new config.
+    # Server B node groups and relay hops are loaded with one extra query each instead of one per transit
+    transits_to_configure = models.Transits.query.options(
+        selectinload(models.Transits.b_nodes), selectinload(models.Transits.hops)).filter(
+        models.Transits.status.in_(['pending', 'active', 'error']) # Include 'error' to try and fix them
+    ).all()
+
+    all_servers = models.Servers.query.all()
+    servers_map = {server.id: server for server in all_servers}
+
+    tuning_profiles = models.TuningProfiles.query.all()
+    tunings = compile_gost_tunings(tuning_profiles)
+    default_tuning = DEFAULT_GOST_TUNING
+    default_profile_name = current_app.config['GOST_DEFAULT_TUNING_PROFILE']
+    if default_profile_name:
+        default_profile = next((profile for profile in tuning_profiles if profile.name == default_profile_name), None)
+        if default_profile is None:
+            print(f"Warning: GOST_DEFAULT_TUNING_PROFILE '{default_profile_name}' does not exist. Using the built-in defaults.")
+        else:
+            default_tuning = tunings[default_profile.id]
+
+    generation_started = time.perf_counter()
+    routes_by_server = generate_gost_routes_by_server(transits_to_configure, servers_map, tunings, default_tuning,
+                                                      b_side=current_app.config['GOST_B_SIDE_CONFIGS'])
+    applied_configs = {ac.server_id: ac for ac in models.AppliedConfigs.query.all()}
+
+    # A relay has routes in the shards of Server A and of its Server B nodes
+    transits_by_id = {t.id: t for t in transits_to_configure}
+    transits_by_server = {
+        server_id: [transits_by_id[transit_id] for transit_id in dict.fromkeys(map(route_key_transit_id, routes))]
+        for server_id, routes in routes_by_server.items()
+    }
+    # The generator builds a transit on all of its servers or on none
+    skipped_transits = [t for t in transits_to_configure if t.id not in routes_by_server.get(t.server_a_id, {})]
+
+    gost_version = current_app.config['GOST_VERSION']
+    plans = []
+    # Servers that had a config applied before but no longer have any routes get an
+    # empty config so that their old listeners are removed.
+    for server_id in sorted(set(routes_by_server) | set(applied_configs)):
+        routes = routes_by_server.get(server_id, {})
+        # Debug and the global Retries of a shard come from its server's profile
+        tuning = resolve_gost_tuning(tunings, default_tuning, getattr(servers_map.get(server_id), 'tuning_profile_id', None))
+        # The config itself is only serialized when the shard is written
+        config_hash, route_hashes = hash_gost_routes(routes, tuning)
+        settings_hash = hash_gost_settings(tuning, gost_version)
+
+        applied_config = applied_configs.get(server_id)
+        applied_route_hashes = {}
+        if applied_config:
+            applied_route_hashes = {parse_route_key(route_key): route_hash
+                                    for route_key, route_hash in json.loads(applied_config.route_hashes).items()}
+
+        diff = diff_route_hashes(applied_route_hashes, route_hashes)
+        settings_changed = applied_config is None or applied_config.settings_hash != settings_hash
+        plans.append({
+            'server_id': server_id,
+            'server': servers_map.get(server_id),
+            'server_name': servers_map[server_id].name if server_id in servers_map else str(server_id),
+            'routes': routes,
+            'tuning': tuning,
+            'config_hash': config_hash,
+            'route_hashes': route_hashes,
+            'settings_hash': settings_hash,
+            'diff': diff,
+            # A v3 config names its services after the route keys, so a moved route changes it
+            'changed': (applied_config is None or applied_config.config_hash != config_hash or settings_changed
+                        or (gost_version == 'v3' and any(diff.values()))),
+            'settings_changed': settings_changed,
+            'applied_config': applied_config,
+            'transits': transits_by_server.get(server_id, []),
+        })
+    app_metrics.config_generation_duration.observe(time.perf_counter() - generation_started)
+    return plans, skipped_transits
+
+
+def _record_applied_config(plan):
+    """Stores the hashes of a successfully applied config shard."""
+    applied_config = plan['applied_config']
+    if applied_config is None:
+        applied_config = models.AppliedConfigs(server_id=plan['server_id'])
+        db.session.add(applied_config)
+    applied_config.config_hash = plan['config_hash']
+    applied_config.route_hashes = json.dumps(plan['route_hashes'], sort_keys=True)
+    applied_config.settings_hash = plan['settings_hash']
+
+
+def _reload_gost_shard(plan, config):
+    """
+    Makes the GOST instance of a shard pick up its newly written config.
+    Runs on the deploy thread pool, without an app context, so it only uses the plain
+    values in plan['ssh'] and the given app config, and must not touch the database session.
+    Returns (success, message).
+    """
+    server_id = plan['server_id']
+    ssh = plan['ssh']
+    service_name = config['GOST_SERVICE_TEMPLATE'].format(server_id=server_id)
+    backend = config['GOST_RELOAD_BACKEND']
+    remote = config['GOST_DEPLOY_MODE'] == 'ssh'
+
+    if remote and ssh is None:
+        return False, f"Server {server_id} no longer exists."
+
+    # The API can only apply a diff on top of a known running state, so the first
+    # apply of a shard always goes through a full restart. So does every apply that
+    # changes a top-level key (Debug, Retries from the server's tuning profile), even
+    # together with route changes: the API can't apply those, and after a hot reload the
+    # file is uploaded without a restart. Only GOST v3 has the web API.
+    hot_reload_msg = None
+    if (backend == 'api' and config['GOST_VERSION'] == 'v3' and plan['applied_config'] is not None
+            and ssh is not None and not plan['settings_changed'] and any(plan['diff'].values())):
+        api_url = config['GOST_API_URL_TEMPLATE'].format(server_id=server_id, ip_address=ssh['ip_address'])
+        auth = None
+        if config['GOST_API_USERNAME']:
+            auth = (config['GOST_API_USERNAME'], config['GOST_API_PASSWORD'] or '')
+        success, message = apply_route_diff_via_gost_api(api_url, plan['routes'], plan['diff'], auth=auth,
+                                                         timeout=config['GOST_DEPLOY_TIMEOUT'])
+        if success:
+            hot_reload_msg = message
+        else:
+            print(f"Warning: Hot reload of server {plan['server_name']} via the GOST API failed: {message}. "
+                  f"Falling back to a full reload.")
+
+    if remote:
+        # After a successful hot reload the file only has to be in place for the next GOST start
+        success, message = upload_gost_config(
+            ssh['ip_address'], ssh['ssh_port'], ssh['ssh_username'],
+            None if ssh['ssh_key_path'] else vault.decrypt(ssh['ssh_password']),
+            plan['config_path'], config['GOST_REMOTE_CONFIG_PATH'],
+            reload_command=None if hot_reload_msg else config['GOST_REMOTE_RELOAD_COMMAND'],
+            timeout=config['GOST_DEPLOY_TIMEOUT'], key_filename=ssh['ssh_key_path'])
+        if success and hot_reload_msg:
+            return True, hot_reload_msg
+        return success, message
+
+    if hot_reload_msg:
+        return True, hot_reload_msg
+    if backend == 'systemctl-reload':
+        return reload_gost_service(service_name)
+    return restart_gost_service(service_name)
+
+
+def apply_gost_config_job(job_id):
+    """Background job: writes and reloads every changed config shard."""
+    # Two concurrent applies in this process would race on the same shards
+    with _apply_lock:
+        started = time.perf_counter()
+        success, result = _apply_gost_config_changes(job_id)
+        app_metrics.apply_duration.labels(result='succeeded' if success else 'failed').observe(time.perf_counter() - started)
+        return success, result
+
+
+def _set_transit_statuses(transit_ids, status, updated_at):
+    """
+    Sets the status of the given transits with set-based UPDATEs. Transits that already
+    have it are left alone, so their updated_at doesn't move.
+
+    updated_at is a Python (naive UTC) datetime like the column's own default, not the
+    database clock, so every transit changed by one apply gets the same timestamp.
+    """
+    transit_ids = sorted(transit_ids)
+    for start in range(0, len(transit_ids), _STATUS_UPDATE_CHUNK_SIZE):
+        chunk = transit_ids[start:start + _STATUS_UPDATE_CHUNK_SIZE]
+        # The loaded Transits objects are not used afterwards, so they need no syncing
+        db.session.execute(update(models.Transits).where(
+            models.Transits.id.in_(chunk), models.Transits.status != status
+        ).values(status=status, updated_at=updated_at).execution_options(synchronize_session=False))
+
+
+def _reload_gost_shard_timed(plan, config):
+    started = time.perf_counter()
+    try:
+        return _reload_gost_shard(plan, config)
+    finally:
+        plan['duration'] += time.perf_counter() - started
+
+
+def _apply_gost_config_changes(job_id):
+    messages = []
+    update_job_progress(job_id, 5, "Comparing generated configs with the applied ones")
+    plans, skipped_transits = plan_gost_config_apply()
+
+    try:
+        os.makedirs(current_app.config['GOST_CONFIG_DIR'], exist_ok=True)
+    except OSError as e:
+        messages.append(['error', _("Error writing GOST config to %(config_path)s: %(error)s", config_path=current_app.config['GOST_CONFIG_DIR'], error=str(e))])
+        return False, {'messages': messages}
+
+    changed_count = sum(1 for plan in plans if plan['changed'])
+    update_job_progress(job_id, 20, f"Writing and reloading {changed_count} changed config shard(s)")
+
+    applied_count = 0
+    failed_count = 0
+    plans_to_reload = []
+    # A relay only works if the shards of Server A and of its Server B nodes all applied, so
+    # the outcome of every shard is collected first and the statuses are written at the end.
+    initial_statuses = {t.id: t.status for plan in plans for t in plan['transits']}
+    active_ids = set()
+    failed_ids = set()
+    for plan in plans:
+        shard_transits = plan['transits']
+        server_id = plan['server_id']
+        server_name = plan['server_name']
+        plan['duration'] = 0.0
+        plan['message'] = None
+
+        if not plan['changed']:
+            # The running config already matches; nothing is written or restarted.
+            if plan['diff'] != {'added': [], 'removed': [], 'changed': []}:
+                _record_applied_config(plan)
+            app_metrics.apply_shards.labels(result='unchanged').inc()
+            plan['outcome'] = 'unchanged'
+            active_ids.update(t.id for t in shard_transits)
+            continue
+
+        # 1. Write the changed shard
+        config_path = _gost_config_path(server_id)
+        plan['config_path'] = config_path
+        write_started = time.perf_counter()
+        try:
+            _write_gost_config_file(config_path, plan['routes'], plan['tuning'])
+            print(f"Info: GOST configuration for server {server_name} written to {config_path}")
+            app_metrics.config_shard_bytes.labels(server_id=server_id).set(os.path.getsize(config_path))
+            app_metrics.config_shard_routes.labels(server_id=server_id).set(len(plan['routes']))
+        except OSError as e:
+            failed_count += 1
+            write_error_msg = _("Error writing GOST config to %(config_path)s: %(error)s", config_path=config_path, error=str(e))
+            messages.append(['error', write_error_msg])
+            print(f"Error: {write_error_msg}")
+            app_metrics.apply_shards.labels(result='write_failed').inc()
+            plan['outcome'] = 'write_failed'
+            plan['message'] = write_error_msg
+            # Only pending transits go to error, active ones keep their previous config
+            failed_ids.update(t.id for t in shard_transits if initial_statuses[t.id] == 'pending')
+            continue
+        finally:
+            plan['duration'] += time.perf_counter() - write_started
+        # The reload runs on other threads, which must not lazy-load from this session
+        server = plan['server']
+        plan['ssh'] = None if server is None else {
+            'ip_address': server.ip_address,
+            'ssh_port': server.ssh_port,
+            'ssh_username': server.ssh_username,
+            'ssh_password': server.ssh_password,
+            'ssh_key_path': server.ssh_key_path,
+        }
+        plans_to_reload.append(plan)
+
+    # 2. Reload the GOST instances of all written shards concurrently
+    # IMPORTANT: the systemctl backends use `sudo systemctl`, which won't work
+    # without specific sudo privileges for the web app user (e.g. on PythonAnywhere).
+    reload_results = run_in_parallel(partial(_reload_gost_shard_timed, config=current_app.config), plans_to_reload,
+                                     max_workers=current_app.config['GOST_DEPLOY_MAX_WORKERS'])
+    for plan, (success, reload_msg) in zip(plans_to_reload, reload_results):
+        plan['message'] = reload_msg
+        if success:
+            applied_count += 1
+            app_metrics.apply_shards.labels(result='applied').inc()
+            plan['outcome'] = 'applied'
+            # Only a successful reload is recorded, so failed shards are retried next time
+            _record_applied_config(plan)
+            active_ids.update(t.id for t in plan['transits']) # Assuming a successful reload means they are now active
+        else:
+            failed_count += 1
+            app_metrics.apply_shards.labels(result='reload_failed').inc()
+            plan['outcome'] = 'reload_failed'
+            messages.append(['error', _("Failed to reload GOST for server '%(server_name)s': %(reload_msg)s. Manual check required.", server_name=plan['server_name'], reload_msg=reload_msg)])
+            print(f"Error: Reloading GOST for server {plan['server_name']} failed: {reload_msg}")
+            failed_ids.update(t.id for t in plan['transits'])
+
+    # Failed transits are down on at least one of their servers, and the ones the
+    # generator left out are not running anywhere, whatever their shards did
+    failed_ids.update(t.id for t in skipped_transits)
+    active_ids -= failed_ids
+    if skipped_transits:
+        app_metrics.apply_skipped_transits.inc(len(skipped_transits))
+        messages.append(['warning', _("%(count)s transit(s) were left out of the GOST config and marked as error: %(names)s. Check their listen port, servers and protocol.",
+                                      count=len(skipped_transits), names=', '.join(t.name for t in skipped_transits))])
+
+    # 3. Persist transit statuses, the apply history and the applied hashes of the touched shards
+    try:
+        status_updated_at = datetime.utcnow()
+        _set_transit_statuses(active_ids, 'active', status_updated_at)
+        _set_transit_statuses(failed_ids, 'error', status_updated_at)
+        history_rows = []
+        for plan in plans:
+            shard_ids = {t.id for t in plan['transits']}
+            history_rows.append({
+                'job_id': job_id,
+                'server_id': plan['server_id'],
+                'server_name': plan['server_name'],
+                'outcome': plan['outcome'],
+                'transit_count': len(shard_ids),
+                'activated_count': sum(1 for transit_id in shard_ids & active_ids if initial_statuses[transit_id] != 'active'),
+                'errored_count': sum(1 for transit_id in shard_ids & failed_ids if initial_statuses[transit_id] != 'error'),
+                'duration_ms': plan['duration'] * 1000,
+                'message': plan['message'][:255] if plan['message'] else None,
+            })
+        if skipped_transits:
+            history_rows.append({
+                'job_id': job_id,
+                'server_id': None,
+                'server_name': None,
+                'outcome': 'skipped',
+                'transit_count': len(skipped_transits),
+                'activated_count': 0,
+                'errored_count': sum(1 for t in skipped_transits if t.status != 'error'),
+                'duration_ms': 0.0,
+                'message': ', '.join(t.name for t in skipped_transits)[:255],
+            })
+        if history_rows:
+            db.session.execute(insert(models.ApplyHistory), history_rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        messages.append(['error', _("Error updating transit statuses: %(error)s", error=str(e))])
+
+    if applied_count:
+        messages.append(['success', _("Applied and reloaded %(count)s changed GOST config shard(s).", count=applied_count)])
+    elif not failed_count:
+        messages.append(['info', _("GOST configuration is already up to date. Nothing was reloaded.")])
+
+    return not failed_count, {'messages': messages, 'applied': applied_count, 'failed': failed_count}
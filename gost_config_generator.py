@@ -1,6 +1,373 @@
+import functools
+import hashlib
 import json
+import math
+import sys
+from urllib.parse import parse_qsl, urlencode
 
-def generate_gost_config(transits: list, servers_map: dict) -> dict:
+from port_allocator import PortIndex
+
+# Route templates, compiled once at import instead of formatting f-strings per transit.
+# The last placeholder takes the node's query string from the tuning profile, if any.
+_DIRECT_TCP_NODE = "tcp://:{}/{}:{}".format
+_DIRECT_UDP_NODE = "udp://:{}/{}:{}{}".format
+_LISTEN_TCP_NODE = "tcp://:{}".format
+_LISTEN_UDP_NODE = "udp://:{}{}".format
+
+# Relay chain protocols and their multiplexed variants, which carry many client
+# connections over one connection to Server B instead of opening one per client
+MULTIPLEXED_CHAIN_PROTOCOLS = {'relay+ws': 'relay+mws', 'relay+wss': 'relay+mwss', 'relay+tls': 'relay+mtls'}
+
+# GOST node group load-balancing strategies for transits with several Server B nodes
+LB_STRATEGIES = ('round', 'random', 'fifo')
+
+# Number of skipped transits that are named in the summary warning of a batch
+_SKIPPED_WARNING_LIMIT = 10
+
+def parse_node_options(value):
+    """
+    Parses extra GOST node parameters given as a query string, e.g. "nodelay=true&mbind=true".
+    Returns a list of (name, value) pairs. Raises ValueError if the string is malformed.
+    """
+    if not value:
+        return []
+    try:
+        return parse_qsl(value.strip().lstrip('?'), strict_parsing=True)
+    except ValueError:
+        raise ValueError(f"Invalid node options '{value}', expected name=value pairs separated by '&'.")
+
+def _query_suffix(params):
+    return '?' + urlencode(params) if params else ''
+
+class GostTuning:
+    """
+    A tuning profile in the form the generator emits it: the values of the config and
+    route keys, and the query strings appended to the nodes. Built once per profile,
+    so the per-transit work stays a template format.
+
+    The defaults reproduce the configs generated before tuning profiles existed.
+    """
+    __slots__ = ('debug', 'retries', 'multiplex', 'chain_query', 'udp_query')
+
+    def __init__(self, debug=True, retries=0, multiplex=False, chain_query='', udp_query=''):
+        self.debug = debug
+        self.retries = retries
+        self.multiplex = multiplex
+        self.chain_query = chain_query # Appended to the ChainNodes (the connection to Server B)
+        self.udp_query = udp_query # Appended to the UDP ServeNodes
+
+    @classmethod
+    def from_profile(cls, profile):
+        """Builds the tuning of a TuningProfiles row. Raises ValueError for invalid node options."""
+        chain_params = []
+        if profile.timeout:
+            chain_params.append(('timeout', f'{profile.timeout}s'))
+        if profile.keepalive:
+            chain_params.append(('keepalive', 'true'))
+        if profile.ping:
+            chain_params.append(('ping', str(profile.ping)))
+        chain_params.extend(parse_node_options(profile.node_options))
+        udp_params = [('ttl', f'{profile.ttl}s')] if profile.ttl else []
+        return cls(debug=bool(profile.debug), retries=profile.retries or 0, multiplex=bool(profile.multiplex),
+                   chain_query=_query_suffix(chain_params), udp_query=_query_suffix(udp_params))
+
+DEFAULT_GOST_TUNING = GostTuning()
+
+def compile_gost_tunings(profiles) -> dict:
+    """Returns {profile ID: GostTuning} for an iterable of TuningProfiles rows."""
+    return {profile.id: GostTuning.from_profile(profile) for profile in profiles}
+
+def resolve_gost_tuning(tunings: dict, default_tuning, *profile_ids):
+    """Returns the tuning of the first of profile_ids that is set, or default_tuning if none is."""
+    for profile_id in profile_ids:
+        if profile_id is not None and profile_id in tunings:
+            return tunings[profile_id]
+    return default_tuning
+
+def _join_queries(*queries):
+    """Joins query strings that each start with '?' (or are empty) into one."""
+    params = '&'.join(query[1:] for query in queries if query)
+    return '?' + params if params else ''
+
+def _node_address(ip_address, port):
+    return f"[{ip_address}]:{port}" if ':' in ip_address else f"{ip_address}:{port}"
+
+def _node_group_query(transit_item, server_b, servers_map: dict):
+    """
+    Returns (query, None) with the GOST node group parameters of a transit whose Server B
+    has additional b_nodes, or (None, reason) if one of their servers is missing.
+
+    GOST v2 balances over the addresses in the chain node's `ip` parameter. It has no
+    weights, so each address is repeated in proportion to its weight (reduced by their
+    greatest common divisor). With 'fifo', which always uses the first healthy node,
+    the nodes are listed once each, heaviest first.
+    """
+    members = [(_node_address(server_b.ip_address, transit_item.server_b_connect_port),
+                getattr(transit_item, 'server_b_weight', None) or 1)]
+    for b_node in transit_item.b_nodes:
+        server = servers_map.get(b_node.server_id)
+        if server is None:
+            return None, f"Could not find Server B node (ID: {b_node.server_id})"
+        members.append((_node_address(server.ip_address, b_node.connect_port), b_node.weight or 1))
+
+    strategy = getattr(transit_item, 'lb_strategy', None) or LB_STRATEGIES[0]
+    if strategy == 'fifo':
+        addresses = [address for address, _weight in sorted(members, key=lambda member: -member[1])]
+    else:
+        divisor = functools.reduce(math.gcd, (weight for _address, weight in members))
+        addresses = [address for address, weight in members for _i in range(weight // divisor)]
+
+    params = [('ip', ','.join(addresses)), ('strategy', strategy)]
+    if getattr(transit_item, 'max_fails', None):
+        params.append(('max_fails', str(transit_item.max_fails)))
+    if getattr(transit_item, 'fail_timeout', None):
+        params.append(('fail_timeout', f'{transit_item.fail_timeout}s'))
+    return '?' + urlencode(params, safe=',:[]'), None
+
+def _build_direct_route(transit_item, server_b, tuning, group_query='', hop_addresses=()):
+    """
+    Direct forwarding from Server A to the final destination.
+    Server B's details (IP, connect_port) are not used in Server A's GOST config for this type.
+    GOST syntax for direct forward: <tcp|udp>://:LISTEN_PORT/DEST_IP:DEST_PORT
+    No ChainNodes for direct forwarding from Server A, so Server B node groups and relay hops don't apply.
+    """
+    listen_port_a = transit_item.server_a_listen_port
+    return {
+        "Retries": tuning.retries,
+        "ServeNodes": [
+            _DIRECT_TCP_NODE(listen_port_a, transit_item.destination_ip, transit_item.destination_port),
+            _DIRECT_UDP_NODE(listen_port_a, transit_item.destination_ip, transit_item.destination_port,
+                             tuning.udp_query),
+        ],
+    }
+
+def _make_relay_route_builder(gost_chain_protocol):
+    """
+    Returns a route builder for transits where Server A listens (on TCP and UDP, like gost.sh)
+    and relays to Server B with the given GOST chain protocol. Server B is then responsible
+    for forwarding to the final destination.
+    """
+    # ChainNodes define where Server A forwards the traffic to (i.e., Server B)
+    # GOST syntax for relay: relay+<protocol>://SERVER_B_IP:SERVER_B_CONNECT_PORT
+    # Considerations for TLS/WSS if Server B uses custom certs / SNI:
+    # If server_b.ip_address is a hostname, GOST uses it for SNI.
+    # If Server B's cert is not trusted by system CAs, GOST might fail TLS handshake.
+    # Options: use ` insecure=true` in ChainNode URL query if self-signed cert on Server B.
+    # e.g., `relay+wss://{server_b.ip_address}:{transit_item.server_b_connect_port}?insecure=true`
+    # This is not currently in the UI but could be an advanced option.
+    chain_node = (gost_chain_protocol + "://{}:{}{}").format
+    multiplexed_chain_node = (MULTIPLEXED_CHAIN_PROTOCOLS.get(gost_chain_protocol, gost_chain_protocol) + "://{}:{}{}").format
+
+    def build_relay_route(transit_item, server_b, tuning, group_query='', hop_addresses=()):
+        listen_port_a = transit_item.server_a_listen_port
+        node = multiplexed_chain_node if tuning.multiplex else chain_node
+        # With a node group, Server B is still the node's host (e.g. for TLS SNI) and GOST
+        # connects to the addresses in its `ip` parameter instead
+        chain_query = _join_queries(group_query, tuning.chain_query) if group_query else tuning.chain_query
+        # Relay hops come first: GOST dials the first node and tunnels through each one to the next
+        chain_nodes = [node(ip_address, connect_port, tuning.chain_query) for ip_address, connect_port in hop_addresses]
+        chain_nodes.append(node(server_b.ip_address, transit_item.server_b_connect_port, chain_query))
+        return {
+            "Retries": tuning.retries,
+            "ServeNodes": [_LISTEN_TCP_NODE(listen_port_a), _LISTEN_UDP_NODE(listen_port_a, tuning.udp_query)],
+            "ChainNodes": chain_nodes,
+        }
+    return build_relay_route
+
+def _make_b_side_route_builder(gost_chain_protocol):
+    """
+    Returns a route builder for the Server B end of a relay: a listener for Server A's
+    chain protocol on the connect port that forwards to the final destination.
+    GOST syntax: relay+<protocol>://:CONNECT_PORT/DEST_IP:DEST_PORT
+    """
+    listen_node = (gost_chain_protocol + "://:{}/{}:{}").format
+    multiplexed_listen_node = (MULTIPLEXED_CHAIN_PROTOCOLS.get(gost_chain_protocol, gost_chain_protocol) + "://:{}/{}:{}").format
+
+    def build_b_side_route(transit_item, connect_port, tuning):
+        # The listener has to speak exactly what Server A's chain node dials, so it follows
+        # the same tuning as the Server A route
+        node = multiplexed_listen_node if tuning.multiplex else listen_node
+        return {
+            "Retries": tuning.retries,
+            "ServeNodes": [node(connect_port, transit_item.destination_ip, transit_item.destination_port)],
+        }
+    return build_b_side_route
+
+def _make_hop_route_builder(gost_chain_protocol):
+    """
+    Returns a route builder for a relay hop between Server A and Server B: a listener for
+    the chain protocol on the hop's connect port without a forward target, so it connects
+    to whatever the previous node asks for. GOST's whitelist limits that to the next node(s).
+    GOST syntax: relay+<protocol>://:CONNECT_PORT?whitelist=tcp,udp:HOSTS:PORTS
+    """
+    listen_node = (gost_chain_protocol + "://:{}{}").format
+    multiplexed_listen_node = (MULTIPLEXED_CHAIN_PROTOCOLS.get(gost_chain_protocol, gost_chain_protocol) + "://:{}{}").format
+
+    def build_hop_route(next_addresses, connect_port, tuning):
+        node = multiplexed_listen_node if tuning.multiplex else listen_node
+        hosts = sorted({ip_address for ip_address, _port in next_addresses})
+        ports = sorted({str(port) for _ip_address, port in next_addresses}, key=int)
+        # The whitelist separates its fields with ':', so IPv6 next nodes can't be listed
+        query = '' if any(':' in host for host in hosts) else \
+            '?' + urlencode([('whitelist', f"tcp,udp:{','.join(hosts)}:{','.join(ports)}")], safe=',:')
+        return {
+            "Retries": tuning.retries,
+            "ServeNodes": [node(connect_port, query)],
+        }
+    return build_hop_route
+
+# Transits.encryption_protocol of relays -> the GOST protocol Server A dials Server B with
+RELAY_CHAIN_PROTOCOLS = {'ws': 'relay+ws', 'wss': 'relay+wss', 'relay+tls': 'relay+tls'}
+
+# Transits.encryption_protocol -> function(transit_item, server_b, tuning, group_query, hop_addresses) returning the route
+ROUTE_BUILDERS = {
+    'tcp': _build_direct_route,
+    'udp': _build_direct_route,
+    **{protocol: _make_relay_route_builder(chain_protocol) for protocol, chain_protocol in RELAY_CHAIN_PROTOCOLS.items()},
+}
+
+# Transits.encryption_protocol -> function(transit_item, connect_port, tuning) returning the
+# route of a Server B node. Direct forwards don't involve Server B.
+B_SIDE_ROUTE_BUILDERS = {
+    protocol: _make_b_side_route_builder(chain_protocol) for protocol, chain_protocol in RELAY_CHAIN_PROTOCOLS.items()
+}
+
+# Transits.encryption_protocol -> function(next addresses, connect_port, tuning) returning the
+# route of a relay hop (see Transits.hops)
+HOP_ROUTE_BUILDERS = {
+    protocol: _make_hop_route_builder(chain_protocol) for protocol, chain_protocol in RELAY_CHAIN_PROTOCOLS.items()
+}
+
+def _lookup_builder(builders: dict, protocol):
+    builder = builders.get(protocol)
+    if builder is None and protocol:
+        # Protocols are stored lowercase; only other spellings pay for lower()
+        builder = builders.get(protocol.lower())
+    return builder
+
+def b_side_route_key(transit_id, connect_port):
+    """Returns the key of a transit's route on one of its Server B nodes, e.g. '12-b9090'."""
+    return f"{transit_id}-b{connect_port}"
+
+def hop_route_key(transit_id, connect_port):
+    """Returns the key of a transit's route on one of its relay hops, e.g. '12-h9090'."""
+    return f"{transit_id}-h{connect_port}"
+
+def route_key_transit_id(route_key) -> int:
+    """Returns the transit ID of a route key: a transit ID (Server A route), a b_side_route_key() or a hop_route_key()."""
+    return route_key if isinstance(route_key, int) else int(str(route_key).partition('-')[0])
+
+def parse_route_key(route_key):
+    """Restores a route key read back from JSON, where every key is a string."""
+    return int(route_key) if str(route_key).isdigit() else route_key
+
+def _build_route(transit_item, servers_map: dict, tuning=DEFAULT_GOST_TUNING):
+    """Returns (route, None), or (None, reason) if the transit has to be skipped."""
+    if transit_item.server_a_id not in servers_map:
+        return None, f"Could not find Server A (ID: {transit_item.server_a_id})"
+    # For direct TCP/UDP forward, server_b is not strictly needed for GOST config on Server A,
+    # but the transit rule itself requires it, so we check.
+    server_b = servers_map.get(transit_item.server_b_id)
+    if not server_b:
+        return None, f"Could not find Server B (ID: {transit_item.server_b_id})"
+
+    protocol = transit_item.encryption_protocol
+    builder = _lookup_builder(ROUTE_BUILDERS, protocol)
+    if builder is None:
+        return None, f"Unknown or unsupported protocol '{protocol}'"
+
+    group_query = ''
+    if getattr(transit_item, 'b_nodes', None):
+        group_query, reason = _node_group_query(transit_item, server_b, servers_map)
+        if group_query is None:
+            return None, reason
+    hop_addresses = []
+    for hop in getattr(transit_item, 'hops', None) or ():
+        if builder is _build_direct_route:
+            return None, "Direct forwards can't have relay hops"
+        server = servers_map.get(hop.server_id)
+        if server is None:
+            return None, f"Could not find relay hop (ID: {hop.server_id})"
+        hop_addresses.append((server.ip_address, hop.connect_port))
+    return builder(transit_item, server_b, tuning, group_query, hop_addresses), None
+
+def _build_b_side_routes(transit_item, tuning=DEFAULT_GOST_TUNING):
+    """
+    Returns [(server ID, connect port, route)] for Server B and every additional Server B
+    node of a relay transit; an empty list for direct forwards. Must only be called for
+    transits whose Server A route could be built, which checks that the servers exist.
+    """
+    builder = _lookup_builder(B_SIDE_ROUTE_BUILDERS, transit_item.encryption_protocol)
+    if builder is None:
+        return []
+    listeners = [(transit_item.server_b_id, transit_item.server_b_connect_port)]
+    listeners.extend((b_node.server_id, b_node.connect_port) for b_node in getattr(transit_item, 'b_nodes', None) or ())
+    return [(server_id, connect_port, builder(transit_item, connect_port, tuning))
+            for server_id, connect_port in listeners]
+
+def _build_hop_routes(transit_item, servers_map: dict, tuning=DEFAULT_GOST_TUNING):
+    """
+    Returns [(server ID, connect port, route)] for every relay hop of a transit, in order.
+    Like _build_b_side_routes(), only for transits whose Server A route could be built.
+    """
+    hops = getattr(transit_item, 'hops', None)
+    builder = _lookup_builder(HOP_ROUTE_BUILDERS, transit_item.encryption_protocol)
+    if not hops or builder is None:
+        return []
+    # Each hop may only connect on to the next one; the last one to any node of the Server B group
+    next_addresses = [(servers_map[transit_item.server_b_id].ip_address, transit_item.server_b_connect_port)]
+    next_addresses.extend((servers_map[b_node.server_id].ip_address, b_node.connect_port)
+                          for b_node in getattr(transit_item, 'b_nodes', None) or ())
+    hop_routes = []
+    for hop in reversed(hops):
+        hop_routes.append((hop.server_id, hop.connect_port, builder(next_addresses, hop.connect_port, tuning)))
+        next_addresses = [(servers_map[hop.server_id].ip_address, hop.connect_port)]
+    hop_routes.reverse()
+    return hop_routes
+
+def _transit_tuning(transit_item, servers_map: dict, tunings: dict, default_tuning):
+    """The transit's own profile wins over its Server A's profile."""
+    server_a = servers_map.get(transit_item.server_a_id)
+    return resolve_gost_tuning(tunings, default_tuning, getattr(transit_item, 'tuning_profile_id', None),
+                               getattr(server_a, 'tuning_profile_id', None))
+
+def build_gost_route(transit_item, servers_map: dict, tuning=DEFAULT_GOST_TUNING):
+    """
+    Builds the GOST route for a single Transit.
+
+    Args:
+        transit_item: A Transits SQLAlchemy model object.
+        servers_map: A dictionary mapping server IDs to Server SQLAlchemy model objects.
+        tuning: The GostTuning to build the route with.
+
+    Returns:
+        The route dictionary, or None if the transit has to be skipped.
+    """
+    route, reason = _build_route(transit_item, servers_map, tuning)
+    if route is None:
+        print(f"Warning: {reason} for Transit ID {transit_item.id} ('{transit_item.name}'). Skipping this transit.")
+    return route
+
+def _warn_skipped_transits(skipped: list):
+    """Prints one summary warning for a batch of (transit, reason) pairs instead of one line per transit."""
+    if not skipped:
+        return
+    details = '; '.join(f"Transit ID {transit_item.id} ('{transit_item.name}'): {reason}"
+                        for transit_item, reason in skipped[:_SKIPPED_WARNING_LIMIT])
+    if len(skipped) > _SKIPPED_WARNING_LIMIT:
+        details += f"; and {len(skipped) - _SKIPPED_WARNING_LIMIT} more"
+    print(f"Warning: Skipped {len(skipped)} transit(s) while generating GOST routes. {details}.")
+
+def assemble_gost_config(routes, tuning=DEFAULT_GOST_TUNING) -> dict:
+    """Wraps a list of GOST routes into a full GOST configuration dictionary."""
+    return {
+        "Debug": tuning.debug, 
+        "Retries": tuning.retries,
+        "Routes": list(routes)
+    }
+
+def generate_gost_config(transits: list, servers_map: dict, tunings: dict = None,
+                         default_tuning=DEFAULT_GOST_TUNING) -> dict:
     """
     Generates a GOST v2.x JSON configuration from a list of Transit objects.
     The configuration is for Server A in the transit definition.
@@ -9,95 +376,258 @@ def generate_gost_config(transits: list, servers_map: dict) -> dict:
         transits: A list of Transits SQLAlchemy model objects.
         servers_map: A dictionary mapping server IDs to Server SQLAlchemy model objects
                      for easy lookup of Server A and Server B details.
+        tunings: {tuning profile ID: GostTuning}, see compile_gost_tunings().
+        default_tuning: The GostTuning of transits and servers without a profile; also
+                        used for the top-level config keys.
 
     Returns:
         A Python dictionary representing the GOST JSON configuration.
     """
-    config = {
-        "Debug": True, 
-        "Retries": 0,
-        "Routes": []
-    }
+    # Example: transit_item.status could be 'active', 'pending', 'inactive', 'error'
+    # This function assumes that filtering of transits (e.g., only 'active' ones)
+    # is done by the caller if needed. Here, we process all passed transits.
+    tunings = tunings or {}
+    routes = []
+    skipped = []
+    for transit_item in transits:
+        tuning = _transit_tuning(transit_item, servers_map, tunings, default_tuning)
+        current_route, reason = _build_route(transit_item, servers_map, tuning)
+        if current_route is None:
+            skipped.append((transit_item, reason))
+        else:
+            routes.append(current_route)
+    _warn_skipped_transits(skipped)
+
+    return assemble_gost_config(routes, default_tuning)
+
+def generate_gost_routes_by_server(transits: list, servers_map: dict, tunings: dict = None,
+                                   default_tuning=DEFAULT_GOST_TUNING, b_side=True) -> dict:
+    """
+    Builds the GOST routes of every server, keyed by transit ID on Server A.
 
-    if not transits:
-        return config
+    With b_side, every relay transit also gets a route on Server B and on each of its
+    additional Server B nodes (see B_SIDE_ROUTE_BUILDERS), keyed by b_side_route_key(),
+    and one on each of its relay hops (see HOP_ROUTE_BUILDERS), keyed by hop_route_key().
+    A server's routes as Server A, relay hop and Server B end up in the same shard.
 
-    for transit_item in transits: # Renamed to avoid conflict with transit module if any
-        # Example: transit_item.status could be 'active', 'pending', 'inactive', 'error'
-        # This function assumes that filtering of transits (e.g., only 'active' ones)
-        # is done by the caller if needed. Here, we process all passed transits.
+    A transit is skipped if any of its ports is already taken on its server, by an older
+    transit or by the server's SSH port: GOST would fail to bind it and refuse to start
+    with the whole shard. A transit is always generated on all of its servers or on none.
 
-        server_a = servers_map.get(transit_item.server_a_id)
-        server_b = servers_map.get(transit_item.server_b_id)
+    Each route is tuned with the transit's tuning profile, else its Server A's profile,
+    else default_tuning (tunings maps profile IDs to GostTuning objects).
 
-        if not server_a:
-            print(f"Warning: Could not find Server A (ID: {transit_item.server_a_id}) for Transit ID {transit_item.id} ('{transit_item.name}'). Skipping this transit.")
+    Returns:
+        A dictionary mapping each server ID to a dictionary of {route key: route}.
+        Skipped transits are left out and reported in a single warning.
+    """
+    tunings = tunings or {}
+    port_index = PortIndex.from_rows(
+        (server.id, server.ssh_port) for server in servers_map.values() if getattr(server, 'ssh_port', None)
+    )
+    routes_by_server = {}
+    skipped = []
+    # Lowest ID first, so on a conflict the transit that was there first keeps its port
+    for transit_item in sorted(transits, key=lambda t: t.id):
+        if port_index.is_used(transit_item.server_a_id, transit_item.server_a_listen_port):
+            skipped.append((transit_item, f"Listen port {transit_item.server_a_listen_port} is already in use on Server A (ID: {transit_item.server_a_id})"))
             continue
-        # For direct TCP/UDP forward, server_b is not strictly needed for GOST config on Server A,
-        # but the transit rule itself requires it, so we check.
-        if not server_b:
-            print(f"Warning: Could not find Server B (ID: {transit_item.server_b_id}) for Transit ID {transit_item.id} ('{transit_item.name}'). Skipping this transit.")
+        tuning = _transit_tuning(transit_item, servers_map, tunings, default_tuning)
+        current_route, reason = _build_route(transit_item, servers_map, tuning)
+        if current_route is None:
+            skipped.append((transit_item, reason))
             continue
 
+        listener_routes = []
+        if b_side:
+            listener_routes.extend((b_side_route_key, 'Server B', *b_side_route)
+                                   for b_side_route in _build_b_side_routes(transit_item, tuning))
+            listener_routes.extend((hop_route_key, 'relay hop', *hop_route)
+                                   for hop_route in _build_hop_routes(transit_item, servers_map, tuning))
+        claimed = {(transit_item.server_a_id, transit_item.server_a_listen_port)}
+        conflict = None
+        for _route_key, role, server_id, connect_port, _route in listener_routes:
+            if (server_id, connect_port) in claimed or port_index.is_used(server_id, connect_port):
+                conflict = (role, server_id, connect_port)
+                break
+            claimed.add((server_id, connect_port))
+        if conflict:
+            skipped.append((transit_item, f"Connect port {conflict[2]} is already in use on {conflict[0]} (ID: {conflict[1]})"))
+            continue
 
-        listen_port_a = transit_item.server_a_listen_port
-        
-        current_route = {
-            "Retries": 0, 
-            "ServeNodes": [],
-        }
+        for server_id, port in claimed:
+            port_index.add(server_id, port)
+        routes_by_server.setdefault(transit_item.server_a_id, {})[transit_item.id] = current_route
+        for route_key, _role, server_id, connect_port, listener_route in listener_routes:
+            routes_by_server.setdefault(server_id, {})[route_key(transit_item.id, connect_port)] = listener_route
+    _warn_skipped_transits(skipped)
+    return routes_by_server
+
+def generate_gost_configs_by_server(transits: list, servers_map: dict, tunings: dict = None,
+                                    default_tuning=DEFAULT_GOST_TUNING, b_side=True) -> dict:
+    """
+    Generates one GOST configuration per server.
 
-        db_protocol = transit_item.encryption_protocol.lower()
-
-        if db_protocol in ['tcp', 'udp']: 
-            # Direct forwarding from Server A to final destination.
-            # Server B's details (IP, connect_port) are not used in Server A's GOST config for this type.
-            # GOST syntax for direct forward: <tcp|udp>://:LISTEN_PORT/DEST_IP:DEST_PORT
-            current_route["ServeNodes"].append(f"tcp://:{listen_port_a}/{transit_item.destination_ip}:{transit_item.destination_port}")
-            current_route["ServeNodes"].append(f"udp://:{listen_port_a}/{transit_item.destination_ip}:{transit_item.destination_port}")
-            # No ChainNodes for direct forwarding from Server A.
-        
-        elif db_protocol in ['ws', 'wss', 'relay+tls']:
-            # Server A listens (e.g., on TCP/UDP), then relays to Server B using the specified protocol.
-            # Server B is then responsible for forwarding to the final destination.
-            
-            # Server A's listeners for incoming traffic for this transit
-            current_route["ServeNodes"].append(f"tcp://:{listen_port_a}") 
-            current_route["ServeNodes"].append(f"udp://:{listen_port_a}") # gost.sh often includes both
-
-            chain_protocol_map = {
-                'ws': 'relay+ws',
-                'wss': 'relay+wss',
-                'relay+tls': 'relay+tls'
-            }
-            gost_chain_protocol = chain_protocol_map[db_protocol]
-            
-            # ChainNodes define where Server A forwards the traffic to (i.e., Server B)
-            # GOST syntax for relay: relay+<protocol>://SERVER_B_IP:SERVER_B_CONNECT_PORT
-            current_route["ChainNodes"] = [
-                f"{gost_chain_protocol}://{server_b.ip_address}:{transit_item.server_b_connect_port}"
-            ]
-            # Considerations for TLS/WSS if Server B uses custom certs / SNI:
-            # If server_b.ip_address is a hostname, GOST uses it for SNI.
-            # If Server B's cert is not trusted by system CAs, GOST might fail TLS handshake.
-            # Options: use ` insecure=true` in ChainNode URL query if self-signed cert on Server B.
-            # e.g., `relay+wss://{server_b.ip_address}:{transit_item.server_b_connect_port}?insecure=true`
-            # This is not currently in the UI but could be an advanced option.
+    Routes are grouped by the server they listen on (Server A, and with b_side also
+    Server B) so that each relay only loads the listeners for ports it actually owns.
+
+    Args:
+        transits: A list of Transits SQLAlchemy model objects.
+        servers_map: A dictionary mapping server IDs to Server SQLAlchemy model objects.
+        tunings, default_tuning, b_side: As for generate_gost_routes_by_server(). The
+                                         top-level keys of a shard come from its server's profile.
+
+    Returns:
+        A dictionary mapping each server ID to its GOST configuration dictionary.
+    """
+    tunings = tunings or {}
+    return {
+        server_a_id: assemble_gost_config(routes.values(), resolve_gost_tuning(
+            tunings, default_tuning, getattr(servers_map.get(server_a_id), 'tuning_profile_id', None)))
+        for server_a_id, routes in generate_gost_routes_by_server(transits, servers_map, tunings, default_tuning, b_side).items()
+    }
+
+_CANONICAL_JSON_KWARGS = {'sort_keys': True, 'separators': (',', ':')}
+_JSON_STYLES = {
+    'canonical': _CANONICAL_JSON_KWARGS,
+    'compact': {'separators': (',', ':')},
+    'pretty': {'indent': 4},
+}
+
+@functools.lru_cache(maxsize=None)
+def _config_affixes(debug, retries, style):
+    """Returns the JSON text of a config without routes, split around its empty Routes list."""
+    empty_config_json = json.dumps(assemble_gost_config([], GostTuning(debug=debug, retries=retries)),
+                                   **_JSON_STYLES[style])
+    prefix, suffix = empty_config_json.split('[]')
+    return prefix + '[', ']' + suffix
+# json.dumps(config, indent=4) puts every route two levels deep
+_PRETTY_ROUTE_INDENT = '\n' + ' ' * 8
+
+def _pretty_route_json(route) -> str:
+    """
+    Returns json.dumps(route, indent=4) as it appears inside a config's Routes list.
+
+    json.dumps() falls back to its pure-Python encoder when indenting, so routes made of
+    scalars and lists of scalars, which is every route ROUTE_BUILDERS makes, are laid out
+    here with the C encoder doing only the scalars.
+    """
+    members = []
+    for key, value in route.items():
+        if isinstance(value, list):
+            if any(isinstance(item, (dict, list)) for item in value):
+                break
+            items = ',\n                '.join(map(json.dumps, value))
+            value_json = f"[\n                {items}\n            ]" if value else "[]"
+        elif isinstance(value, dict):
+            break
         else:
-            print(f"Warning: Unknown or unsupported protocol '{transit_item.encryption_protocol}' for Transit ID {transit_item.id} ('{transit_item.name}'). Skipping.")
-            continue
-        
-        config["Routes"].append(current_route)
+            value_json = json.dumps(value)
+        members.append(f"{json.dumps(key)}: {value_json}")
+    else:
+        if not members:
+            return "{}"
+        return "{\n            " + ',\n            '.join(members) + "\n        }"
+    # Deeper nesting than a route built here: let json.dumps() indent it
+    return json.dumps(route, indent=4).replace('\n', _PRETTY_ROUTE_INDENT)
+
+def write_gost_config(routes, fp, compact=False, tuning=DEFAULT_GOST_TUNING):
+    """
+    Streams assemble_gost_config(routes, tuning) as JSON to a text file object, one route at a time.
+
+    The output is exactly what json.dump(config, fp, indent=4) writes (or, with compact=True,
+    the same without any whitespace), but the JSON of the whole config is never built as a
+    single string, so memory use does not grow with the size of the text.
+    """
+    if compact:
+        prefix, suffix = _config_affixes(tuning.debug, tuning.retries, 'compact')
+        fp.write(prefix)
+        for index, route in enumerate(routes):
+            if index:
+                fp.write(',')
+            fp.write(json.dumps(route, separators=(',', ':')))
+        fp.write(suffix)
+        return
+
+    prefix, suffix = _config_affixes(tuning.debug, tuning.retries, 'pretty')
+    fp.write(prefix)
+    wrote_route = False
+    for route in routes:
+        fp.write(',' if wrote_route else '')
+        fp.write(_PRETTY_ROUTE_INDENT)
+        fp.write(_pretty_route_json(route))
+        wrote_route = True
+    if wrote_route:
+        fp.write('\n' + ' ' * 4)
+    fp.write(suffix)
+
+def hash_gost_config(config) -> str:
+    """
+    Returns a stable SHA-256 content hash of a GOST config or route.
+    Keys are sorted so that the hash does not depend on dictionary ordering.
+    """
+    canonical_json = json.dumps(config, **_CANONICAL_JSON_KWARGS)
+    return hashlib.sha256(canonical_json.encode()).hexdigest()
+
+def hash_gost_routes(routes: dict, tuning=DEFAULT_GOST_TUNING):
+    """
+    Hashes the routes of a config shard and the config they assemble into in one pass.
 
-    return config
+    Every route is serialized once; the same text feeds both its own hash and an
+    incremental hash of the whole config, so the config never exists as one string.
+
+    Args:
+        routes: {transit ID: route}, in config order.
+        tuning: The GostTuning of the shard's top-level keys.
+
+    Returns:
+        (config_hash, {transit ID: route hash}), equal to hash_gost_config() of
+        assemble_gost_config(routes.values(), tuning) and of each route.
+    """
+    prefix, suffix = _config_affixes(tuning.debug, tuning.retries, 'canonical')
+    config_hasher = hashlib.sha256(prefix.encode())
+    route_hashes = {}
+    for index, (transit_id, route) in enumerate(routes.items()):
+        route_json = json.dumps(route, **_CANONICAL_JSON_KWARGS).encode()
+        route_hashes[transit_id] = hashlib.sha256(route_json).hexdigest()
+        if index:
+            config_hasher.update(b',')
+        config_hasher.update(route_json)
+    config_hasher.update(suffix.encode())
+    return config_hasher.hexdigest(), route_hashes
+
+def hash_gost_settings(tuning=DEFAULT_GOST_TUNING, gost_version='v2') -> str:
+    """
+    Returns the hash of a shard's top-level keys (Debug, Retries) and of the GOST version
+    it is written for, i.e. of everything in its config that is not a route and so can't
+    be applied route by route.
+    """
+    return hash_gost_config({**assemble_gost_config([], tuning), 'Version': gost_version})
+
+def diff_route_hashes(old_route_hashes: dict, new_route_hashes: dict) -> dict:
+    """
+    Computes a route-level diff between two {route key: route hash} mappings.
+
+    Returns:
+        A dictionary with 'added', 'removed' and 'changed' route key lists, sorted by transit.
+    """
+    # Keys mix transit IDs (Server A routes) with b_side_route_key() strings
+    sort_key = lambda key: (route_key_transit_id(key), str(key))
+    return {
+        'added': sorted((key for key in new_route_hashes if key not in old_route_hashes), key=sort_key),
+        'removed': sorted((key for key in old_route_hashes if key not in new_route_hashes), key=sort_key),
+        'changed': sorted((key for key in new_route_hashes
+                           if key in old_route_hashes and old_route_hashes[key] != new_route_hashes[key]), key=sort_key),
+    }
 
 if __name__ == '__main__':
     # Dummy data for testing
     class Server:
-        def __init__(self, id, name, ip_address):
+        def __init__(self, id, name, ip_address, ssh_port=22):
             self.id = id
             self.name = name
             self.ip_address = ip_address
+            self.ssh_port = ssh_port
 
     class Transit:
         def __init__(self, id, name, server_a_id, server_a_listen_port, 
@@ -187,3 +717,150 @@ if __name__ == '__main__':
     ]
     generated_json_config_missing_a = generate_gost_config(transits_missing_server_a, servers_data_map)
     print(json.dumps(generated_json_config_missing_a, indent=4))
+
+    print("\n--- Generating per-server config shards (Server A and Server B ends of the relays) ---")
+    transits_list.append(
+        Transit(9, "WS_Relay_From_C",
+                server_a_id=3, server_a_listen_port=8080,
+                server_b_id=2, server_b_connect_port=9096,
+                encryption_protocol="ws",
+                destination_ip="10.0.0.5", destination_port=80))
+    generated_shards = generate_gost_configs_by_server(transits_list, servers_data_map)
+    for shard_server_id, shard_config in generated_shards.items():
+        print(f"Server ID {shard_server_id}:")
+        print(json.dumps(shard_config, indent=4))
+
+    print("\n--- Route-level diff after changing one transit ---")
+    old_routes = generate_gost_routes_by_server(transits_list, servers_data_map)[1]
+    transits_list[0].server_b_connect_port = 9999
+    new_routes = generate_gost_routes_by_server(transits_list, servers_data_map)[1]
+    print(diff_route_hashes(
+        {transit_id: hash_gost_config(route) for transit_id, route in old_routes.items()},
+        {transit_id: hash_gost_config(route) for transit_id, route in new_routes.items()},
+    ))
+
+    print("\n--- Shard with listen port conflicts: only the conflicting transits are skipped ---")
+    conflicting_transits = transits_list + [
+        Transit(10, "Duplicate_Port_8080",
+                server_a_id=1, server_a_listen_port=8080,
+                server_b_id=2, server_b_connect_port=9094,
+                encryption_protocol="ws",
+                destination_ip="10.0.0.6", destination_port=80),
+        Transit(11, "SSH_Port_Clash",
+                server_a_id=1, server_a_listen_port=22,
+                server_b_id=2, server_b_connect_port=9095,
+                encryption_protocol="ws",
+                destination_ip="10.0.0.7", destination_port=80),
+    ]
+    print(sorted(generate_gost_routes_by_server(conflicting_transits, servers_data_map)[1]))
+
+    print("\n--- Shard of Server C with a production tuning profile ---")
+    class TuningProfile:
+        def __init__(self, id, name, debug=False, retries=3, timeout=None, ttl=None,
+                     keepalive=False, ping=None, multiplex=False, node_options=None):
+            self.id = id
+            self.name = name
+            self.debug = debug
+            self.retries = retries
+            self.timeout = timeout
+            self.ttl = ttl
+            self.keepalive = keepalive
+            self.ping = ping
+            self.multiplex = multiplex
+            self.node_options = node_options
+
+    production_tunings = compile_gost_tunings([
+        TuningProfile(1, "production", timeout=10, ttl=60, keepalive=True, ping=30, multiplex=True),
+    ])
+    servers_data_map[3].tuning_profile_id = 1
+    print(json.dumps(generate_gost_configs_by_server(transits_list, servers_data_map, production_tunings)[3], indent=4))
+
+    print("\n--- Relay with a weighted pool of Server B nodes ---")
+    class TransitBNode:
+        def __init__(self, server_id, connect_port, weight=1):
+            self.server_id = server_id
+            self.connect_port = connect_port
+            self.weight = weight
+
+    servers_data_map[4] = Server(4, "ServerD_VPS", "4.4.4.4")
+    pooled_transit = Transit(12, "Pooled_WSS_Relay",
+                             server_a_id=1, server_a_listen_port=8443,
+                             server_b_id=2, server_b_connect_port=9443,
+                             encryption_protocol="wss",
+                             destination_ip="10.0.0.8", destination_port=443)
+    pooled_transit.server_b_weight = 2
+    pooled_transit.b_nodes = [TransitBNode(4, 9443, weight=1)]
+    pooled_transit.lb_strategy = "round"
+    pooled_transit.max_fails = 3
+    pooled_transit.fail_timeout = 30
+    print(json.dumps(build_gost_route(pooled_transit, servers_data_map), indent=4))
+
+    print("\n--- Relay through a hop on Server C (A -> C -> B) ---")
+    class TransitHop:
+        def __init__(self, server_id, connect_port):
+            self.server_id = server_id
+            self.connect_port = connect_port
+
+    hop_transit = Transit(13, "WSS_Relay_Via_C",
+                          server_a_id=1, server_a_listen_port=8444,
+                          server_b_id=2, server_b_connect_port=9444,
+                          encryption_protocol="wss",
+                          destination_ip="10.0.0.9", destination_port=443)
+    hop_transit.hops = [TransitHop(3, 9445)]
+    for shard_server_id, shard_routes in generate_gost_routes_by_server([hop_transit], servers_data_map).items():
+        print(f"Server ID {shard_server_id}: {json.dumps(shard_routes)}")
+
+    if '--benchmark' in sys.argv:
+        # python gost_config_generator.py --benchmark [TRANSIT_COUNT]
+        import tempfile
+        import time
+        import tracemalloc
+
+        benchmark_args = sys.argv[sys.argv.index('--benchmark') + 1:]
+        transit_count = int(benchmark_args[0]) if benchmark_args else 100000
+        protocols = list(ROUTE_BUILDERS)
+        benchmark_servers = {server_id: Server(server_id, f"Server_{server_id}", f"10.1.{server_id // 256}.{server_id % 256}")
+                             for server_id in range(1, 101)}
+        benchmark_transits = [
+            Transit(transit_id, f"Transit_{transit_id}",
+                    server_a_id=transit_id % 50 + 1, server_a_listen_port=10000 + transit_id // 50,
+                    server_b_id=transit_id % 50 + 51, server_b_connect_port=20000 + transit_id // 50,
+                    encryption_protocol=protocols[transit_id % len(protocols)],
+                    destination_ip="10.2.0.1", destination_port=transit_id % 60000 + 1)
+            for transit_id in range(1, transit_count + 1)
+        ]
+
+        def write_shards(routes_by_server, compact):
+            with tempfile.TemporaryFile('w') as shard_file:
+                for routes in routes_by_server.values():
+                    write_gost_config(routes.values(), shard_file, compact=compact)
+                    hash_gost_routes(routes)
+                return shard_file.tell()
+
+        def dump_shards(routes_by_server):
+            # What applying did before: the whole shard as one string, hashed separately
+            with tempfile.TemporaryFile('w') as shard_file:
+                for routes in routes_by_server.values():
+                    config = assemble_gost_config(routes.values())
+                    shard_file.write(json.dumps(config, indent=4))
+                    hash_gost_config(config)
+                    for route in routes.values():
+                        hash_gost_config(route)
+                return shard_file.tell()
+
+        print(f"\n--- Benchmark: {transit_count} transits on {len(benchmark_servers) // 2} Server A shards ---")
+        start = time.perf_counter()
+        benchmark_routes = generate_gost_routes_by_server(benchmark_transits, benchmark_servers)
+        print(f"Route generation: {time.perf_counter() - start:.2f}s")
+
+        for label, run in (("json.dumps(indent=4) + separate hashes", lambda: dump_shards(benchmark_routes)),
+                           ("streamed, indented", lambda: write_shards(benchmark_routes, False)),
+                           ("streamed, compact", lambda: write_shards(benchmark_routes, True))):
+            start = time.perf_counter()
+            size = run()
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{label}: {elapsed:.2f}s, {size / 1e6:.1f}MB of JSON, peak memory {peak / 1e6:.1f}MB")
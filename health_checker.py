@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import update
+
+from extensions import db
+import models
+from deploy import run_in_parallel
+from latency_prober import probe_tcp_targets
+from credential_vault import vault
+from utils import test_ssh_connection
+
+
+def check_server_health():
+    """
+    Refreshes Servers.connection_status for the whole fleet.
+
+    Every server's SSH port is first checked for TCP reachability concurrently. If
+    HEALTH_CHECK_SSH is enabled, reachable servers then get an SSH authentication check
+    on a bounded thread pool, reusing pooled sessions where possible. The results are
+    written in one transaction with a bulk UPDATE; status_changed_at only moves for
+    servers whose status actually changed. Must run in an app context.
+
+    Statuses: 'Connected' (SSH login works), 'Reachable' (SSH port answers, login not
+    checked), 'Error' (SSH login failed), 'Disconnected' (SSH port unreachable).
+
+    Returns a dictionary mapping each status to the number of servers that have it.
+    """
+    servers = db.session.query(
+        models.Servers.id, models.Servers.ip_address, models.Servers.ssh_port,
+        models.Servers.ssh_username, models.Servers.ssh_password, models.Servers.ssh_key_path,
+        models.Servers.connection_status, models.Servers.updated_at
+    ).all()
+    if not servers:
+        return {}
+
+    reachability = asyncio.run(probe_tcp_targets(
+        {server.id: (server.ip_address, server.ssh_port) for server in servers},
+        concurrency=current_app.config['HEALTH_CHECK_CONCURRENCY'],
+        timeout=current_app.config['HEALTH_CHECK_TIMEOUT'],
+        jitter=0,
+    ))
+    new_statuses = {server.id: 'Reachable' if reachability[server.id] is not None else 'Disconnected'
+                    for server in servers}
+
+    if current_app.config['HEALTH_CHECK_SSH']:
+        # The checks run on other threads, without an app context
+        timeout = current_app.config['HEALTH_CHECK_TIMEOUT']
+        reachable_servers = [server for server in servers if new_statuses[server.id] == 'Reachable']
+        ssh_results = run_in_parallel(
+            lambda server: test_ssh_connection(
+                server.ip_address, server.ssh_port, server.ssh_username,
+                None if server.ssh_key_path else vault.decrypt(server.ssh_password),
+                reuse=True, timeout=timeout, key_filename=server.ssh_key_path),
+            reachable_servers,
+            max_workers=current_app.config['HEALTH_CHECK_SSH_WORKERS'],
+        )
+        for server, (success, _) in zip(reachable_servers, ssh_results):
+            new_statuses[server.id] = 'Connected' if success else 'Error'
+
+    now = datetime.utcnow()
+    rows = []
+    for server in servers:
+        row = {'id': server.id, 'status_checked_at': now,
+               # updated_at is passed through unchanged so that a health check doesn't count as an edit
+               'updated_at': server.updated_at}
+        if server.connection_status != new_statuses[server.id]:
+            row['connection_status'] = new_statuses[server.id]
+            row['status_changed_at'] = now
+        rows.append(row)
+
+    # Rows with different keys can't share one executemany, so unchanged and changed
+    # servers are written as two batches.
+    unchanged_rows = [row for row in rows if 'connection_status' not in row]
+    changed_rows = [row for row in rows if 'connection_status' in row]
+    for batch in (unchanged_rows, changed_rows):
+        if batch:
+            db.session.execute(update(models.Servers), batch)
+    db.session.commit()
+
+    status_counts = {}
+    for status in new_statuses.values():
+        status_counts[status] = status_counts.get(status, 0) + 1
+    return status_counts
@@ -0,0 +1,55 @@
+import json
+
+from flask import Blueprint, current_app, render_template, url_for, jsonify
+
+from extensions import db
+import models
+from jobs import job_to_dict
+from status_snapshot import json_default
+
+bp = Blueprint('jobs', __name__)
+
+
+@bp.route('/jobs/<int:job_id>')
+def job_status_page(job_id):
+    job = db.get_or_404(models.Jobs, job_id)
+    # Where to continue once the job has finished
+    next_urls = {
+        'add_server': url_for('servers.list_servers'),
+        'apply_gost_config': url_for('transits.list_transits'),
+    }
+    return render_template('job_status.html', job=job_to_dict(job), next_url=next_urls.get(job.job_type, url_for('main.hello_world')))
+
+
+@bp.route('/api/jobs/<int:job_id>')
+def api_job_status(job_id):
+    job = db.get_or_404(models.Jobs, job_id)
+    return jsonify(job_to_dict(job))
+
+
+@bp.route('/api/jobs/<int:job_id>/result')
+def api_job_result(job_id):
+    job = db.get_or_404(models.Jobs, job_id)
+    if job.status not in ('succeeded', 'failed'):
+        return jsonify({'id': job.id, 'status': job.status, 'error': 'Job has not finished yet.'}), 202
+    return jsonify({'id': job.id, 'status': job.status, 'result': json.loads(job.result) if job.result else None})
+
+
+@bp.route('/api/jobs/<int:job_id>/apply_history')
+def api_job_apply_history(job_id):
+    """Returns the per-shard outcomes an apply job recorded, for auditing status changes."""
+    db.get_or_404(models.Jobs, job_id)
+    rows = db.session.query(models.ApplyHistory).filter_by(job_id=job_id).order_by(models.ApplyHistory.id).all()
+    history = [{
+        'server_id': row.server_id,
+        'server_name': row.server_name,
+        'outcome': row.outcome,
+        'transit_count': row.transit_count,
+        'activated_count': row.activated_count,
+        'errored_count': row.errored_count,
+        'duration_ms': row.duration_ms,
+        'message': row.message,
+        'created_at': row.created_at,
+    } for row in rows]
+    body = json.dumps({'job_id': job_id, 'history': history}, default=json_default)
+    return current_app.response_class(body, mimetype='application/json')
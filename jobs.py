@@ -0,0 +1,103 @@
+import json
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from extensions import db
+import models
+
+# Slow work (SSH tests, config deploys) runs on this pool instead of the request worker.
+# Each web worker process has its own pool; the job rows in the database are shared.
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('JOB_WORKERS', '4')),
+                               thread_name_prefix='job')
+
+
+def submit_job(job_type, func, *args):
+    """
+    Persists a new job and schedules func(job_id, *args) on the job pool.
+
+    func must return (success: bool, result: dict). The result is stored as JSON; by
+    convention it holds a 'messages' list of [category, message] pairs for the UI.
+    Arguments are only kept in memory, so secrets such as passwords are never persisted.
+
+    Returns the ID of the new job.
+    """
+    job = models.Jobs(job_type=job_type, status='queued')
+    db.session.add(job)
+    db.session.commit()
+    # The job thread has no app context of its own, it gets one from the app object
+    _executor.submit(_run_job, current_app._get_current_object(), job.id, func, args)
+    return job.id
+
+
+def update_job_progress(job_id, progress, message=None):
+    """Records the progress (0-100) of a running job. Called from inside a job function."""
+    job = db.session.get(models.Jobs, job_id)
+    job.progress = max(0, min(100, int(progress)))
+    if message is not None:
+        job.message = message[:255]
+    db.session.commit()
+
+
+def _run_job(app, job_id, func, args):
+    """Runs a job function in its own app context and records its outcome."""
+    with app.app_context():
+        try:
+            job = db.session.get(models.Jobs, job_id)
+            job.status = 'running'
+            job.started_at = datetime.utcnow()
+            db.session.commit()
+
+            try:
+                success, result = func(job_id, *args)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error: Job {job_id} ({job.job_type}) failed: {e}")
+                traceback.print_exc()
+                success, result = False, {'messages': [['error', f"An unexpected error occurred: {str(e)}"]]}
+
+            job = db.session.get(models.Jobs, job_id)
+            job.status = 'succeeded' if success else 'failed'
+            job.progress = 100
+            messages = result.get('messages') or []
+            if messages:
+                job.message = str(messages[-1][1])[:255]
+            job.result = json.dumps(result)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error: Could not record the outcome of job {job_id}: {e}")
+        finally:
+            db.session.remove()
+
+
+def job_to_dict(job):
+    """Serializes a job row for the JSON API."""
+    return {
+        'id': job.id,
+        'job_type': job.job_type,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result': json.loads(job.result) if job.result else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def fail_interrupted_jobs():
+    """
+    Marks jobs left queued or running by a previous process as failed.
+    Only call this when no other process is running jobs (e.g. from init_db()).
+    """
+    interrupted = models.Jobs.query.filter(models.Jobs.status.in_(['queued', 'running'])).all()
+    for job in interrupted:
+        job.status = 'failed'
+        job.message = 'Interrupted by an application restart.'
+        job.finished_at = datetime.utcnow()
+    db.session.commit()
@@ -0,0 +1,153 @@
+import asyncio
+import math
+import random
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, update
+
+from extensions import db
+import models
+
+
+async def _probe_tcp_connect(host, port, semaphore, timeout, jitter):
+    """Returns the TCP connect time to host:port in milliseconds, or None on failure."""
+    # Spread the probes out so a large fleet is not hit in one burst
+    await asyncio.sleep(random.uniform(0, jitter))
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        latency_ms = (time.perf_counter() - start) * 1000
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return latency_ms
+
+
+async def probe_tcp_targets(targets: dict, concurrency=100, timeout=3.0, jitter=1.0) -> dict:
+    """
+    Measures the TCP connect time to many targets concurrently.
+
+    Args:
+        targets: A dictionary mapping any key to a (host, port) tuple.
+        concurrency: Maximum number of connection attempts in flight at once.
+        timeout: Seconds before a single connection attempt counts as failed.
+        jitter: Each probe starts after a random delay of up to this many seconds.
+
+    Returns:
+        A dictionary mapping each key to its latency in milliseconds, or None on failure.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    keys = list(targets)
+    latencies = await asyncio.gather(*(
+        _probe_tcp_connect(targets[key][0], targets[key][1], semaphore, timeout, jitter) for key in keys
+    ))
+    return dict(zip(keys, latencies))
+
+
+def percentile(values, pct):
+    """Returns the nearest-rank percentile (0-100) of a list of numbers, or None if it is empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def probe_transit_latencies():
+    """
+    Probes the Server A listen port of every configured transit and stores the results.
+
+    Every sample is appended to the per-transit history, Transits.latency_ms is set to the
+    latest value and the p50/p95 are recomputed from the last LATENCY_WINDOW_SAMPLES successful
+    samples within LATENCY_WINDOW_SECONDS. All writes happen in one transaction with bulk
+    statements. Must run in an app context.
+
+    Returns the number of transits probed.
+    """
+    rows = db.session.query(
+        models.Transits.id, models.Transits.server_a_listen_port, models.Transits.updated_at,
+        models.Servers.ip_address
+    ).join(models.Servers, models.Transits.server_a_id == models.Servers.id).filter(
+        models.Transits.status != 'inactive'
+    ).all()
+    if not rows:
+        return 0
+
+    targets = {row.id: (row.ip_address, row.server_a_listen_port) for row in rows}
+    latencies = asyncio.run(probe_tcp_targets(
+        targets,
+        concurrency=current_app.config['LATENCY_PROBE_CONCURRENCY'],
+        timeout=current_app.config['LATENCY_PROBE_TIMEOUT'],
+        jitter=current_app.config['LATENCY_PROBE_JITTER'],
+    ))
+
+    now = datetime.utcnow()
+    db.session.execute(insert(models.TransitLatencySamples), [
+        {'transit_id': transit_id, 'latency_ms': latency_ms, 'measured_at': now}
+        for transit_id, latency_ms in latencies.items()
+    ])
+
+    # Rolling window for the percentiles, fetched for all transits in one query. Only the last
+    # LATENCY_WINDOW_SAMPLES rows of each transit leave the database, however long the window is.
+    window_start = now - timedelta(seconds=current_app.config['LATENCY_WINDOW_SECONDS'])
+    samples = models.TransitLatencySamples
+    recent = db.session.query(
+        samples.transit_id, samples.latency_ms,
+        func.row_number().over(partition_by=samples.transit_id,
+                               order_by=(samples.measured_at.desc(), samples.id.desc())).label('recency'),
+    ).filter(
+        samples.measured_at >= window_start,
+        samples.latency_ms.isnot(None),
+    ).subquery()
+    window_samples = {}
+    for transit_id, latency_ms in db.session.query(recent.c.transit_id, recent.c.latency_ms).filter(
+        recent.c.recency <= current_app.config['LATENCY_WINDOW_SAMPLES']
+    ):
+        window_samples.setdefault(transit_id, []).append(latency_ms)
+
+    # updated_at is passed through unchanged so that probing doesn't count as an edit
+    db.session.execute(update(models.Transits), [
+        {
+            'id': row.id,
+            'latency_ms': latencies[row.id],
+            'latency_p50_ms': percentile(window_samples.get(row.id), 50),
+            'latency_p95_ms': percentile(window_samples.get(row.id), 95),
+            'latency_checked_at': now,
+            'updated_at': row.updated_at,
+        }
+        for row in rows
+    ])
+
+    history_start = now - timedelta(seconds=current_app.config['LATENCY_HISTORY_SECONDS'])
+    db.session.execute(delete(models.TransitLatencySamples).where(
+        models.TransitLatencySamples.measured_at < history_start
+    ))
+    db.session.commit()
+    return len(rows)
+
+
+if __name__ == '__main__':
+    # Probe a local listener and a closed port to show the concurrency and the percentiles
+    async def _demo():
+        server = await asyncio.start_server(lambda reader, writer: writer.close(), '127.0.0.1', 0)
+        open_port = server.sockets[0].getsockname()[1]
+        targets = {f"open-{i}": ('127.0.0.1', open_port) for i in range(200)}
+        targets['closed'] = ('127.0.0.1', 1)
+        start = time.perf_counter()
+        results = await probe_tcp_targets(targets, concurrency=50, timeout=1.0, jitter=0.2)
+        elapsed = time.perf_counter() - start
+        server.close()
+        return results, elapsed
+
+    demo_results, demo_elapsed = asyncio.run(_demo())
+    open_latencies = [v for k, v in demo_results.items() if k != 'closed']
+    print(f"Probed {len(demo_results)} targets in {demo_elapsed:.2f}s")
+    print(f"p50={percentile(open_latencies, 50):.3f}ms p95={percentile(open_latencies, 95):.3f}ms "
+          f"closed port -> {demo_results['closed']}")
@@ -0,0 +1,189 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from flask import current_app, request, url_for, jsonify
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import aliased
+
+from extensions import db
+import models
+from status_snapshot import SERVER_FIELDS, TRANSIT_FIELDS, json_default
+
+MAX_PAGE_SIZE = 500
+
+# Only non-nullable columns can be sorted on: keyset conditions don't work with NULLs
+SERVER_SORTS = ('name', 'id', 'ip_address', 'ssh_port', 'created_at')
+TRANSIT_SORTS = ('name', 'id', 'server_a_listen_port', 'created_at')
+
+
+def encode_cursor(sort_value, row_id):
+    """Encodes the position after a row as an opaque, URL-safe cursor string."""
+    raw = json.dumps([sort_value, row_id], default=json_default, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort_column):
+    """Returns the (sort_value, row_id) encoded by encode_cursor(). Raises ValueError if it is invalid."""
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if sort_value is not None and sort_column.type.python_type is datetime:
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(row_id)
+    except (binascii.Error, TypeError, ValueError) as e: # json.JSONDecodeError is a ValueError
+        raise ValueError(f"Invalid cursor: {str(e)}")
+
+
+def keyset_page(query, sort_column, id_column, descending=False, cursor=None, limit=50):
+    """
+    Fetches one page of a query ordered by (sort_column, id_column) using keyset pagination.
+
+    Instead of an OFFSET, which makes the database skip over every earlier row, the
+    page starts right after the (sort value, id) of the previous page's last row, so
+    every page costs the same with an index on sort_column.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    if cursor:
+        last_value, last_id = decode_cursor(cursor, sort_column)
+        after = (lambda column, value: column < value) if descending else (lambda column, value: column > value)
+        if sort_column is id_column:
+            query = query.filter(after(id_column, last_id))
+        else:
+            query = query.filter(or_(after(sort_column, last_value),
+                                     and_(sort_column == last_value, after(id_column, last_id))))
+
+    order = [sort_column] if sort_column is id_column else [sort_column, id_column]
+    query = query.order_by(*[column.desc() if descending else column.asc() for column in order])
+    # One extra row tells whether there is a next page
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last_row = rows[-1]._mapping
+    return rows, encode_cursor(last_row[sort_column.key], last_row[id_column.key])
+
+
+def _parse_sort(args, allowed):
+    sort = args.get('sort') or allowed[0]
+    field = sort.lstrip('-')
+    if field not in allowed:
+        raise ValueError(f"Cannot sort by '{field}'. Choose one of: {', '.join(allowed)}.")
+    return field, sort.startswith('-')
+
+
+def _parse_int(args, name, minimum=None, maximum=None):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be a number.")
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise ValueError(f"'{name}' must be between {minimum} and {maximum}.")
+    return value
+
+
+def _parse_limit(args):
+    limit = _parse_int(args, 'limit', 1, MAX_PAGE_SIZE)
+    return limit or current_app.config['LIST_PAGE_SIZE']
+
+
+def list_servers_page(args):
+    """
+    Returns one page of servers as dictionaries, filtered and sorted by request arguments.
+
+    Supported arguments: status, port_min, port_max (SSH port), sort (a field from
+    SERVER_SORTS, prefixed with '-' for descending), limit and cursor.
+
+    Returns {'items': [...], 'next_cursor': str or None}. Raises ValueError for invalid arguments.
+    """
+    sort_field, descending = _parse_sort(args, SERVER_SORTS)
+    limit = _parse_limit(args)
+    port_min = _parse_int(args, 'port_min', 1, 65535)
+    port_max = _parse_int(args, 'port_max', 1, 65535)
+
+    query = db.session.query(*[getattr(models.Servers, field) for field in SERVER_FIELDS])
+    if args.get('status'):
+        query = query.filter(models.Servers.connection_status == args['status'])
+    if port_min is not None:
+        query = query.filter(models.Servers.ssh_port >= port_min)
+    if port_max is not None:
+        query = query.filter(models.Servers.ssh_port <= port_max)
+
+    rows, next_cursor = keyset_page(query, getattr(models.Servers, sort_field), models.Servers.id,
+                                    descending=descending, cursor=args.get('cursor'), limit=limit)
+    return {'items': [dict(row._mapping) for row in rows], 'next_cursor': next_cursor}
+
+
+def list_transits_page(args):
+    """
+    Returns one page of transits as dictionaries, filtered and sorted by request arguments.
+
+    Supported arguments: status, protocol, server_id (matches Server A or Server B),
+    port_min, port_max (Server A listen port), sort (a field from TRANSIT_SORTS, prefixed
+    with '-' for descending), limit and cursor. Like in the status snapshot, every transit
+    carries server_a/server_b as {'id', 'name'} dictionaries.
+
+    Returns {'items': [...], 'next_cursor': str or None}. Raises ValueError for invalid arguments.
+    """
+    sort_field, descending = _parse_sort(args, TRANSIT_SORTS)
+    limit = _parse_limit(args)
+    server_id = _parse_int(args, 'server_id')
+    port_min = _parse_int(args, 'port_min', 1, 65535)
+    port_max = _parse_int(args, 'port_max', 1, 65535)
+
+    server_a = aliased(models.Servers)
+    server_b = aliased(models.Servers)
+    # Server names are joined in, so a page costs a single query
+    query = db.session.query(
+        *[getattr(models.Transits, field) for field in TRANSIT_FIELDS],
+        server_a.name.label('server_a_name'),
+        server_b.name.label('server_b_name'),
+    ).outerjoin(server_a, models.Transits.server_a_id == server_a.id).outerjoin(
+        server_b, models.Transits.server_b_id == server_b.id
+    )
+    if args.get('status'):
+        query = query.filter(models.Transits.status == args['status'])
+    if args.get('protocol'):
+        query = query.filter(models.Transits.encryption_protocol == args['protocol'])
+    if server_id is not None:
+        query = query.filter(or_(models.Transits.server_a_id == server_id,
+                                 models.Transits.server_b_id == server_id))
+    if port_min is not None:
+        query = query.filter(models.Transits.server_a_listen_port >= port_min)
+    if port_max is not None:
+        query = query.filter(models.Transits.server_a_listen_port <= port_max)
+
+    rows, next_cursor = keyset_page(query, getattr(models.Transits, sort_field), models.Transits.id,
+                                    descending=descending, cursor=args.get('cursor'), limit=limit)
+    items = []
+    for row in rows:
+        transit = dict(row._mapping)
+        server_a_name = transit.pop('server_a_name')
+        server_b_name = transit.pop('server_b_name')
+        transit['server_a'] = {'id': transit['server_a_id'], 'name': server_a_name} if server_a_name is not None else None
+        transit['server_b'] = {'id': transit['server_b_id'], 'name': server_b_name} if server_b_name is not None else None
+        items.append(transit)
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+def page_urls(endpoint, page):
+    """Returns the URLs of the first and the next page with the current filters (next is None on the last page)."""
+    args = request.args.to_dict()
+    args.pop('cursor', None)
+    first_url = url_for(endpoint, **args)
+    if not page['next_cursor']:
+        return first_url, None
+    return first_url, url_for(endpoint, cursor=page['next_cursor'], **args)
+
+
+def list_page_response(list_page):
+    """Runs a list_*_page() function on the request arguments and returns the page as JSON."""
+    try:
+        page = list_page(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return current_app.response_class(json.dumps(page, default=json_default), mimetype='application/json')
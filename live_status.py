@@ -0,0 +1,383 @@
+import json
+import secrets
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from flask import current_app, request, url_for
+from sqlalchemy import event, or_
+from sqlalchemy.orm import Session
+
+from extensions import db
+import models
+import app_metrics
+from status_snapshot import json_default
+
+# Fields pushed per row; the first one of each tuple is the row ID
+TRANSIT_LIVE_FIELDS = ('id', 'status', 'latency_ms', 'latency_p50_ms', 'latency_p95_ms')
+SERVER_LIVE_FIELDS = ('id', 'connection_status', 'status_checked_at', 'status_changed_at')
+JOB_LIVE_FIELDS = ('id', 'job_type', 'status', 'progress', 'message')
+_UNFINISHED_JOB_STATUSES = ('queued', 'running')
+# Timestamps written by the database (second resolution) or by another host's clock are
+# caught by re-reading this much before the previous pass; unchanged rows are then skipped.
+_CHANGE_WINDOW_OVERLAP = timedelta(seconds=2)
+
+
+class ChangeBus:
+    """
+    An in-process publish/subscribe bus of row changes, for the live status stream.
+
+    Every published event gets the next sequence number and is kept in a ring buffer of the
+    last `history` events, so a subscriber that reconnects with the last sequence number it
+    saw gets what it missed. Subscribers don't have queues of their own: they wait on one
+    condition and read the buffer, so an idle subscriber costs nothing but its thread.
+
+    Sequence numbers only mean something to the bus that gave them out, so event IDs are
+    "<token>-<seq>" with a random token per bus. An ID from another process (e.g. another
+    web worker behind the same load balancer) or from before a restart doesn't parse here.
+    """
+
+    def __init__(self, history=256):
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=history) # (seq, kind, rows, JSON of rows)
+        self._seq = 0
+        self.token = secrets.token_hex(8)
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def event_id(self, seq):
+        return f"{self.token}-{seq}"
+
+    def parse_event_id(self, event_id):
+        """Returns the sequence number of one of this bus' event IDs, or None for any other ID."""
+        token, _, seq = (event_id or '').rpartition('-')
+        if token != self.token or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def publish(self, kind, rows):
+        """Publishes a list of row dictionaries as one event."""
+        payload = json.dumps(rows, default=json_default, separators=(',', ':'))
+        with self._condition:
+            self._seq += 1
+            self._events.append((self._seq, kind, rows, payload))
+            self._condition.notify_all()
+        app_metrics.live_status_events.labels(kind=kind).inc()
+
+    def clear(self):
+        """Drops the buffered events, so nobody is sent a partial replay of them."""
+        with self._condition:
+            self._events.clear()
+
+    def events_after(self, seq, timeout):
+        """
+        Returns the events after `seq`, waiting up to `timeout` seconds for the first one
+        (an empty list if none came). Returns None if they can't be replayed, because they
+        were dropped from the buffer or `seq` is ahead of this bus.
+        """
+        with self._condition:
+            if seq > self._seq:
+                return None
+            self._condition.wait_for(lambda: self._seq > seq, timeout)
+            if self._seq == seq:
+                return []
+            if not self._events or self._events[0][0] > seq + 1:
+                return None
+            return [event for event in self._events if event[0] > seq]
+
+
+class LiveStatusFeed:
+    """
+    Feeds the change bus with the transit, server and job changes that the status pages show.
+
+    A detector thread reads only the rows changed since its previous pass (by their
+    updated_at, latency_checked_at or status_checked_at, or still running for jobs),
+    compares them with the last values it saw and publishes the differences. It runs right
+    after every commit in this process and every `poll_interval` seconds otherwise, which
+    picks up writes from other processes such as `flask probe-latency` or other web workers.
+
+    The thread is started by the status pages and stops once no stream has been open for
+    `idle_timeout` seconds, so it costs nothing while nobody is watching.
+    """
+
+    def __init__(self, bus, idle_timeout=60):
+        self.bus = bus
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._ready = threading.Event() # Set once the first pass has loaded the current values
+        self._thread = None
+        self._subscribers = 0
+        self._idle_since = time.monotonic()
+        self._known = {'transits': {}, 'servers': {}, 'jobs': {}} # kind -> {id: row}
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, wait=True):
+        """
+        Starts the detector if needed and returns the event ID to stream from. Needs an app context.
+
+        With wait=False it doesn't wait for the detector's first pass, which loads every row,
+        and returns None while that is still running; a stream from None starts with a sync.
+        """
+        with self._lock:
+            self._idle_since = time.monotonic()
+            if self._thread is None:
+                # Events from a previous run may have missed changes while it was stopped
+                self.bus.clear()
+                self._known = {'transits': {}, 'servers': {}, 'jobs': {}}
+                self._ready.clear()
+                self._thread = threading.Thread(target=self._run, args=(current_app._get_current_object(),),
+                                                name='live-status', daemon=True)
+                self._thread.start()
+        if not wait:
+            return self.bus.event_id(self.bus.seq) if self._ready.is_set() else None
+        # The first pass only loads the current values, after it every change is published
+        self._ready.wait(timeout=10)
+        return self.bus.event_id(self.bus.seq)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self, app):
+        since = None
+        poll_interval = app.config['LIVE_STATUS_POLL_INTERVAL']
+        while True:
+            with self._lock:
+                if not self._subscribers and time.monotonic() - self._idle_since > self.idle_timeout:
+                    self._thread = None
+                    return
+            self._wake.clear()
+            started = datetime.utcnow()
+            try:
+                with app.app_context():
+                    self._detect(since)
+                since = started - _CHANGE_WINDOW_OVERLAP
+            except Exception as e:
+                print(f"Warning: Detecting status changes for the live status stream failed: {e}")
+            self._ready.set()
+            self._wake.wait(poll_interval)
+
+    def _detect(self, since):
+        """Publishes the rows that changed since `since` (loads every row if it is None)."""
+        transits = db.session.query(*[getattr(models.Transits, field) for field in TRANSIT_LIVE_FIELDS])
+        servers = db.session.query(*[getattr(models.Servers, field) for field in SERVER_LIVE_FIELDS])
+        if since is not None:
+            transits = transits.filter(or_(models.Transits.updated_at >= since,
+                                           models.Transits.latency_checked_at >= since))
+            servers = servers.filter(or_(models.Servers.updated_at >= since,
+                                         models.Servers.status_checked_at >= since))
+        # Running jobs, plus the ones that were running last time, to see them finish
+        unfinished_ids = [job_id for job_id, job in self._known['jobs'].items()
+                          if job['status'] in _UNFINISHED_JOB_STATUSES]
+        jobs = db.session.query(*[getattr(models.Jobs, field) for field in JOB_LIVE_FIELDS]).filter(
+            or_(models.Jobs.status.in_(_UNFINISHED_JOB_STATUSES), models.Jobs.id.in_(unfinished_ids)))
+
+        for kind, query, fields in (('transits', transits, TRANSIT_LIVE_FIELDS),
+                                    ('servers', servers, SERVER_LIVE_FIELDS),
+                                    ('jobs', jobs, JOB_LIVE_FIELDS)):
+            results = query.all()
+            changed = []
+            with self._lock:
+                known = self._known[kind]
+                for values in results:
+                    row = dict(zip(fields, values))
+                    if kind == 'transits':
+                        # Shown with one decimal, finer changes aren't worth a push
+                        for field in TRANSIT_LIVE_FIELDS[2:]:
+                            if row[field] is not None:
+                                row[field] = round(row[field], 1)
+                    previous = known.get(row['id'])
+                    if previous == row:
+                        continue
+                    known[row['id']] = row
+                    if previous is None and since is None:
+                        continue
+                    # Only the changed fields, plus the ID (and for jobs everything, it's small)
+                    changed.append(row if previous is None or kind == 'jobs' else
+                                   {field: value for field, value in row.items()
+                                    if field == 'id' or previous.get(field) != value})
+                if kind == 'jobs':
+                    # A finished job has been published for the last time
+                    for job in changed:
+                        if job['status'] not in _UNFINISHED_JOB_STATUSES:
+                            del known[job['id']]
+            if changed:
+                self.bus.publish(kind, changed)
+
+    def current_state(self, transit_ids=None, server_ids=None):
+        """Returns the last seen rows, optionally only the given transits and servers."""
+        with self._lock:
+            return {
+                'transits': _select(self._known['transits'], transit_ids),
+                'servers': _select(self._known['servers'], server_ids),
+                'jobs': [job for job in self._known['jobs'].values() if job['status'] in _UNFINISHED_JOB_STATUSES],
+            }
+
+    def stream(self, since, transit_ids=None, server_ids=None, max_seconds=5, heartbeat=15):
+        """
+        Yields the changes as Server-Sent Events: 'transits', 'servers' and 'jobs' events with
+        a list of changed rows each. `since` is the last event ID the client saw. If the changes
+        after it can't be replayed, because it is None or comes from another bus, or they left
+        the buffer, a 'sync' event with the current state comes first. Ends after
+        `max_seconds`; the browser then reconnects with the last event ID.
+        """
+        with self._lock:
+            self._subscribers += 1
+            app_metrics.live_status_streams.set(self._subscribers)
+        try:
+            # Tells the browser how many milliseconds to wait before reconnecting
+            yield 'retry: 1000\n\n'
+            deadline = time.monotonic() + max_seconds
+            seq = self.bus.parse_event_id(since)
+            if seq is None:
+                seq = -1 # Older than any buffered event, so the stream starts with a sync
+            while time.monotonic() < deadline:
+                events = self.bus.events_after(seq, timeout=min(heartbeat, max(0, deadline - time.monotonic())))
+                if events is None:
+                    # Take the sequence number first: changes after it may be sent twice, but none is lost
+                    seq = self.bus.seq
+                    state = json.dumps(self.current_state(transit_ids, server_ids), default=json_default,
+                                       separators=(',', ':'))
+                    yield f'id: {self.bus.event_id(seq)}\nevent: sync\ndata: {state}\n\n'
+                    continue
+                if not events:
+                    # A comment keeps proxies from closing the idle connection
+                    yield ': keepalive\n\n'
+                    continue
+                for event_seq, kind, rows, payload in events:
+                    seq = event_seq
+                    wanted = {'transits': transit_ids, 'servers': server_ids}.get(kind)
+                    if wanted is not None:
+                        rows = [row for row in rows if row['id'] in wanted]
+                        if not rows:
+                            continue
+                        payload = json.dumps(rows, default=json_default, separators=(',', ':'))
+                    yield f'id: {self.bus.event_id(event_seq)}\nevent: {kind}\ndata: {payload}\n\n'
+            if seq >= 0:
+                # An ID without data moves the browser's Last-Event-ID past the events that were
+                # filtered out, so the reconnect doesn't replay them
+                yield f'id: {self.bus.event_id(seq)}\n\n'
+        finally:
+            with self._lock:
+                self._subscribers -= 1
+                self._idle_since = time.monotonic()
+                app_metrics.live_status_streams.set(self._subscribers)
+
+
+def live_status_client(**stream_filters):
+    """
+    Returns the options of startLiveStatus() (static/live_status.js) for a status page.
+
+    The page streams from /api/status/stream, filtered by stream_filters, if this web server
+    handles requests on threads. A stream would block a single-threaded worker (gunicorn's
+    sync workers, uWSGI without threads) for LIVE_STATUS_STREAM_SECONDS, so there, and with
+    LIVE_STATUS_STREAM_SECONDS=0, the page polls /api/status with its ETag instead. Doesn't
+    wait for the detector's first pass, so the page renders right away.
+    """
+    config = current_app.config
+    options = {
+        'stream_url': None,
+        'poll_url': url_for('status.api_status'),
+        'poll_interval_ms': int(config['LIVE_STATUS_POLL_INTERVAL'] * 1000),
+    }
+    if config['LIVE_STATUS_STREAM_SECONDS'] > 0 and request.environ.get('wsgi.multithread'):
+        options['stream_url'] = url_for('status.status_stream', since=feed.start(wait=False), **stream_filters)
+    return options
+
+
+def _select(rows_by_id, ids):
+    if ids is None:
+        return list(rows_by_id.values())
+    return [rows_by_id[row_id] for row_id in ids if row_id in rows_by_id]
+
+
+def parse_id_list(value):
+    """
+    Parses a comma-separated list of row IDs (e.g. ?transit_ids=1,2,3). Returns None if not
+    given (all rows) and an empty set for an empty value (no rows).
+    """
+    if value is None:
+        return None
+    try:
+        return {int(part) for part in value.split(',') if part.strip()}
+    except ValueError:
+        raise ValueError('IDs must be comma-separated numbers.')
+
+
+# One bus and detector per process, shared by every open stream
+feed = LiveStatusFeed(ChangeBus())
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_after_commit(session):
+    # Every commit in this process may have changed a status, a latency or a job's progress
+    if feed.running:
+        feed.wake()
+
+
+if __name__ == '__main__':
+    # 10,000 transits in a temporary SQLite database: 20 dashboards reloading /status against
+    # a detector pass without changes, and 100 status changes pushed to 20 open streams.
+    import os
+    import tempfile
+
+    from app import create_app
+
+    demo_dir = tempfile.mkdtemp()
+    demo_app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(demo_dir, 'demo.db')}",
+                           'LIVE_STATUS_POLL_INTERVAL': 3600})
+    with demo_app.app_context():
+        db.create_all()
+        db.session.add_all([models.Servers(name=name, ip_address=ip, ssh_port=22, ssh_username='root', ssh_password='')
+                            for name, ip in (('a', '10.0.0.1'), ('b', '10.0.0.2'))])
+        db.session.commit()
+        db.session.execute(models.Transits.__table__.insert(), [
+            {'name': f"transit-{i}", 'server_a_id': 1, 'server_a_listen_port': 10000 + i, 'server_b_id': 2,
+             'server_b_connect_port': 443, 'encryption_protocol': 'wss', 'destination_ip': '10.1.0.1',
+             'destination_port': 80, 'status': 'pending', 'server_b_weight': 1, 'lb_strategy': 'round',
+             'updated_at': datetime.utcnow()} for i in range(10000)])
+        db.session.commit()
+
+    client = demo_app.test_client()
+    started = time.perf_counter()
+    for _i in range(20):
+        client.get('/status', headers={'Cache-Control': 'no-cache'})
+    print(f"20 x GET /status (10,000 rows)       {(time.perf_counter() - started) * 1000:8.1f}ms")
+
+    with demo_app.app_context():
+        feed.start()
+        time.sleep(3) # Past the overlap window of the rows inserted above
+        since = datetime.utcnow() - _CHANGE_WINDOW_OVERLAP
+        started = time.perf_counter()
+        feed._detect(since)
+        print(f"Detector pass, nothing changed       {(time.perf_counter() - started) * 1000:8.1f}ms")
+
+        streams = [feed.stream(feed.bus.event_id(feed.bus.seq), max_seconds=5, heartbeat=5) for _i in range(20)]
+        for stream in streams:
+            next(stream) # The retry line; the stream now waits for events
+        received = []
+
+        def _read(stream):
+            received.append(len(next(stream)))
+
+        readers = [threading.Thread(target=_read, args=(stream,)) for stream in streams]
+        for reader in readers:
+            reader.start()
+        time.sleep(0.1)
+        # The commit wakes the detector thread, which publishes the changes
+        started = time.perf_counter()
+        db.session.execute(models.Transits.__table__.update().where(models.Transits.id <= 100).values(
+            status='active', updated_at=datetime.utcnow()))
+        db.session.commit()
+        for reader in readers:
+            reader.join()
+        print(f"Commit of 100 changes to 20 streams  {(time.perf_counter() - started) * 1000:8.1f}ms "
+              f"({received[0]} bytes per stream)")
+        for stream in streams:
+            stream.close()
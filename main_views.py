@@ -0,0 +1,52 @@
+from flask import Blueprint, current_app, request, jsonify, stream_with_context
+
+bp = Blueprint('main', __name__)
+
+
+@bp.route('/')
+def hello_world():
+    return 'Hello, World! Navigation: <a href="/add_server">Add Server</a> | <a href="/list_servers">List Servers</a> | <a href="/add_transit">Add Transit</a> | <a href="/list_transits">List Transits</a> | <a href="/tuning_profiles">Tuning Profiles</a> | <a href="/status">System Status</a>'
+
+
+@bp.route('/api/import/<kind>', methods=['POST'])
+def api_import(kind):
+    """
+    Imports servers or transits from the request body or an uploaded `file`.
+    The format comes from ?format=, the file name or the Content-Type. ?skip_invalid=1 inserts
+    the valid records even if some are invalid; ?dry_run=1 only validates.
+    """
+    # Imported here so web workers don't load bulk_io on startup (see commands.py)
+    from bulk_io import FORMATS, KINDS, guess_format, parse_records, import_records
+
+    if kind not in KINDS:
+        return jsonify({'error': f"Unknown kind '{kind}'."}), 404
+    upload = request.files.get('file')
+    fmt = request.args.get('format') or guess_format(filename=upload.filename if upload else None,
+                                                     content_type=request.content_type)
+    if not fmt:
+        return jsonify({'error': f"Cannot tell the format, pass ?format= ({', '.join(FORMATS)})."}), 400
+    content = upload.read().decode('utf-8-sig') if upload else request.get_data(as_text=True)
+    try:
+        records = parse_records(content, fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    report = import_records(kind, records,
+                            skip_invalid=request.args.get('skip_invalid') in ('1', 'true'),
+                            dry_run=request.args.get('dry_run') in ('1', 'true'))
+    # 422 when invalid records kept the import from happening
+    return jsonify(report), 422 if report['errors'] and not report['inserted'] else 200
+
+
+@bp.route('/api/export/<kind>')
+def api_export(kind):
+    from bulk_io import export_records
+
+    fmt = request.args.get('format', 'csv')
+    try:
+        chunks = export_records(kind, fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    mimetypes = {'csv': 'text/csv', 'json': 'application/json', 'yaml': 'application/yaml'}
+    response = current_app.response_class(stream_with_context(chunks), mimetype=mimetypes[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{fmt}'
+    return response
@@ -0,0 +1,325 @@
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, update
+
+from extensions import db
+import models
+from deploy import run_in_parallel
+
+# Stored bucket lengths in seconds, finest first
+RESOLUTIONS = {'1m': 60, '1h': 3600, '1d': 86400}
+
+# GOST v3 exporter series (labels host, service) -> the counter they feed
+_COUNTER_METRICS = {
+    'gost_service_transfer_input_bytes_total': 'bytes_in',
+    'gost_service_transfer_output_bytes_total': 'bytes_out',
+    'gost_service_handler_errors_total': 'errors',
+}
+_GAUGE_METRICS = {
+    'gost_service_requests_in_flight': 'connections',
+}
+# Services of the Server A end of a transit, as named by gost_api.route_to_gost_api_objects() in
+# GOST v3 shards and through the web API alike. Server B ends ("transit-5-b9090-relay") and relay
+# hops carry the same traffic again and are not counted.
+_SERVICE_NAME = re.compile(r'^transit-(\d+)-(?:tcp|udp)$')
+
+_SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)')
+_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+_EPOCH = datetime(1970, 1, 1)
+
+_top_cache_lock = threading.Lock()
+_top_cache = {} # (limit, window_seconds) -> (built_at, rows)
+# Scrapes run about once a minute, so a fresher top-N would rarely differ
+_TOP_CACHE_SECONDS = 30
+
+
+def parse_prometheus_text(text):
+    """
+    Parses the Prometheus text exposition format.
+
+    Yields (metric name, labels dictionary, value) for every sample. Comments, HELP/TYPE
+    lines and samples with an unparsable value are skipped.
+    """
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        match = _SAMPLE_LINE.match(line)
+        if not match:
+            continue
+        name, raw_labels, raw_value = match.groups()
+        try:
+            value = float(raw_value)
+        except ValueError:
+            continue
+        labels = {key: re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), val)
+                  for key, val in _LABEL.findall(raw_labels or '')}
+        yield name, labels, value
+
+
+def service_totals_from_samples(samples):
+    """
+    Collects the GOST series of the Server A services of the transits.
+
+    Returns {service name: {'transit_id', 'bytes_in', 'bytes_out', 'errors', 'connections'}}
+    for every such service in the samples.
+    """
+    totals = {}
+    for name, labels, value in samples:
+        field = _COUNTER_METRICS.get(name) or _GAUGE_METRICS.get(name)
+        if field is None:
+            continue
+        service = labels.get('service', '')
+        match = _SERVICE_NAME.match(service)
+        if not match:
+            continue
+        service_totals = totals.setdefault(service, {'transit_id': int(match.group(1)), 'bytes_in': 0,
+                                                     'bytes_out': 0, 'errors': 0, 'connections': 0})
+        service_totals[field] += int(value)
+    return totals
+
+
+def scrape_gost_metrics(url, timeout=5):
+    """
+    Fetches the metrics of one GOST exporter.
+
+    Returns:
+        (success: bool, per-service totals (see service_totals_from_samples()) or error message)
+    """
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            text = response.read().decode('utf-8', errors='replace')
+    except urllib.error.HTTPError as e:
+        return False, f"GOST metrics at {url} returned HTTP {e.code}."
+    except OSError as e: # Includes urllib.error.URLError and socket timeouts
+        return False, f"GOST metrics at {url} are unreachable: {str(e)}"
+    return True, service_totals_from_samples(parse_prometheus_text(text))
+
+
+def bucket_start(moment, resolution):
+    """Returns the start of the bucket of the given length (seconds) that contains moment."""
+    offset = (moment - _EPOCH).total_seconds() % resolution
+    return (moment - timedelta(seconds=offset)).replace(microsecond=0)
+
+
+def _counter_delta(total, previous):
+    # A counter that went down was reset by a GOST restart and counted up from zero since
+    return total - previous if total >= previous else total
+
+
+def _add_to_buckets(deltas, now):
+    """Adds per-transit deltas to the current bucket of every resolution with bulk statements."""
+    for resolution in RESOLUTIONS.values():
+        start = bucket_start(now, resolution)
+        existing = {row.transit_id: row for row in db.session.query(
+            models.TransitMetrics.id, models.TransitMetrics.transit_id, models.TransitMetrics.bytes_in,
+            models.TransitMetrics.bytes_out, models.TransitMetrics.errors,
+            models.TransitMetrics.connections_max, models.TransitMetrics.connections_sum,
+            models.TransitMetrics.samples,
+        ).filter(models.TransitMetrics.resolution == resolution, models.TransitMetrics.bucket_start == start)}
+
+        new_rows, changed_rows = [], []
+        for transit_id, delta in deltas.items():
+            row = existing.get(transit_id)
+            if row is None:
+                new_rows.append({
+                    'transit_id': transit_id, 'resolution': resolution, 'bucket_start': start,
+                    'bytes_in': delta['bytes_in'], 'bytes_out': delta['bytes_out'], 'errors': delta['errors'],
+                    'connections_max': delta['connections'], 'connections_sum': delta['connections'], 'samples': 1,
+                })
+            else:
+                changed_rows.append({
+                    'id': row.id,
+                    'bytes_in': row.bytes_in + delta['bytes_in'],
+                    'bytes_out': row.bytes_out + delta['bytes_out'],
+                    'errors': row.errors + delta['errors'],
+                    'connections_max': max(row.connections_max, delta['connections']),
+                    'connections_sum': row.connections_sum + delta['connections'],
+                    'samples': row.samples + 1,
+                })
+        if new_rows:
+            db.session.execute(insert(models.TransitMetrics), new_rows)
+        if changed_rows:
+            db.session.execute(update(models.TransitMetrics), changed_rows)
+
+
+def prune_transit_metrics(now=None):
+    """Deletes the buckets of every resolution that are older than its retention. Returns the number deleted."""
+    now = now or datetime.utcnow()
+    deleted = 0
+    for name, resolution in RESOLUTIONS.items():
+        cutoff = now - timedelta(seconds=current_app.config[f'METRICS_RETENTION_{name.upper()}'])
+        result = db.session.execute(delete(models.TransitMetrics).where(
+            models.TransitMetrics.resolution == resolution,
+            models.TransitMetrics.bucket_start < cutoff,
+        ))
+        deleted += result.rowcount or 0
+    return deleted
+
+
+def collect_transit_metrics():
+    """
+    Scrapes the GOST exporter of every Server A and stores per-transit traffic.
+
+    GOST's counters (bytes in/out, errors) are turned into deltas against the totals of
+    the previous scrape, kept per service in ServiceMetricCursors, and summed per transit;
+    active connections are a gauge and recorded as maximum and sum per bucket. Every
+    scrape is added to the current 1m, 1h and 1d bucket at once, so the rollups never
+    have to be recomputed, and buckets past their METRICS_RETENTION_* are pruned. The
+    first scrape of a service only primes its cursor. All writes happen in one
+    transaction. Must run in an app context, and only one collector may run at a time.
+
+    Only GOST v3 has an exporter, and only v3 shards name their services (GOST_VERSION).
+
+    Returns (number of servers scraped, number of transits recorded, list of error messages).
+    """
+    if current_app.config['GOST_VERSION'] != 'v3':
+        return 0, 0, ["GOST v2 has no metrics exporter. Traffic metrics need GOST_VERSION=v3."]
+
+    servers = db.session.query(models.Servers.id, models.Servers.name, models.Servers.ip_address).filter(
+        models.Servers.id.in_(db.session.query(models.Transits.server_a_id).filter(
+            models.Transits.status != 'inactive'))
+    ).all()
+    if not servers:
+        return 0, 0, []
+
+    url_template = current_app.config['GOST_METRICS_URL_TEMPLATE']
+    timeout = current_app.config['METRICS_SCRAPE_TIMEOUT']
+    results = run_in_parallel(
+        lambda server: scrape_gost_metrics(url_template.format(ip_address=server.ip_address, server_id=server.id),
+                                           timeout=timeout),
+        servers,
+        max_workers=current_app.config['METRICS_SCRAPE_WORKERS'],
+    )
+    totals, errors = {}, [] # (server ID, service) -> totals
+    for server, (success, result) in zip(servers, results):
+        if success:
+            totals.update(((server.id, service), values) for service, values in result.items())
+        else:
+            errors.append(f"Server '{server.name}': {result}")
+
+    # Services of deleted transits may linger in GOST until the next apply
+    transit_ids = {values['transit_id'] for values in totals.values()}
+    known_ids = {transit_id for (transit_id,) in db.session.query(models.Transits.id).filter(
+        models.Transits.id.in_(transit_ids))} if transit_ids else set()
+    totals = {key: values for key, values in totals.items() if values['transit_id'] in known_ids}
+
+    now = datetime.utcnow()
+    scraped_server_ids = {server_id for server_id, _service in totals}
+    cursors = {(cursor.server_id, cursor.service): cursor for cursor in db.session.query(
+        models.ServiceMetricCursors.server_id, models.ServiceMetricCursors.service,
+        models.ServiceMetricCursors.bytes_in_total, models.ServiceMetricCursors.bytes_out_total,
+        models.ServiceMetricCursors.errors_total,
+    ).filter(models.ServiceMetricCursors.server_id.in_(scraped_server_ids))} if totals else {}
+
+    deltas, new_cursors, changed_cursors = {}, [], []
+    for (server_id, service), values in totals.items():
+        cursor_row = {'server_id': server_id, 'service': service, 'transit_id': values['transit_id'],
+                      'bytes_in_total': values['bytes_in'], 'bytes_out_total': values['bytes_out'],
+                      'errors_total': values['errors'], 'scraped_at': now}
+        cursor = cursors.get((server_id, service))
+        if cursor is None:
+            new_cursors.append(cursor_row)
+            continue
+        changed_cursors.append(cursor_row)
+        delta = deltas.setdefault(values['transit_id'], {'bytes_in': 0, 'bytes_out': 0, 'errors': 0, 'connections': 0})
+        delta['bytes_in'] += _counter_delta(values['bytes_in'], cursor.bytes_in_total)
+        delta['bytes_out'] += _counter_delta(values['bytes_out'], cursor.bytes_out_total)
+        delta['errors'] += _counter_delta(values['errors'], cursor.errors_total)
+        delta['connections'] += values['connections']
+    if new_cursors:
+        db.session.execute(insert(models.ServiceMetricCursors), new_cursors)
+    if changed_cursors:
+        db.session.execute(update(models.ServiceMetricCursors), changed_cursors)
+    if deltas:
+        _add_to_buckets(deltas, now)
+    prune_transit_metrics(now)
+    db.session.commit()
+    return len(servers), len(deltas), errors
+
+
+def _resolution_for_window(window_seconds):
+    """Returns the finest resolution whose retention still covers the window."""
+    for name, resolution in RESOLUTIONS.items():
+        if current_app.config[f'METRICS_RETENTION_{name.upper()}'] >= window_seconds:
+            return resolution
+    return RESOLUTIONS['1d']
+
+
+def top_transits_by_traffic(limit=10, window_seconds=3600):
+    """
+    Returns the transits that moved the most bytes over the last window_seconds, busiest first.
+
+    Each entry is a dictionary with transit_id, name, bytes_in, bytes_out, errors,
+    connections_max and connections_avg. Results are cached briefly since every
+    /status request asks for them. Must run in an app context.
+    """
+    cache_key = (limit, window_seconds)
+    with _top_cache_lock:
+        cached = _top_cache.get(cache_key)
+        if cached is not None and time.monotonic() - cached[0] < _TOP_CACHE_SECONDS:
+            return cached[1]
+
+    resolution = _resolution_for_window(window_seconds)
+    since = bucket_start(datetime.utcnow() - timedelta(seconds=window_seconds), resolution)
+    total_bytes = func.sum(models.TransitMetrics.bytes_in + models.TransitMetrics.bytes_out)
+    rows = db.session.query(
+        models.TransitMetrics.transit_id, models.Transits.name,
+        func.sum(models.TransitMetrics.bytes_in).label('bytes_in'),
+        func.sum(models.TransitMetrics.bytes_out).label('bytes_out'),
+        func.sum(models.TransitMetrics.errors).label('errors'),
+        func.max(models.TransitMetrics.connections_max).label('connections_max'),
+        func.sum(models.TransitMetrics.connections_sum).label('connections_sum'),
+        func.sum(models.TransitMetrics.samples).label('samples'),
+    ).join(models.Transits, models.TransitMetrics.transit_id == models.Transits.id).filter(
+        models.TransitMetrics.resolution == resolution,
+        models.TransitMetrics.bucket_start >= since,
+    ).group_by(models.TransitMetrics.transit_id, models.Transits.name).order_by(
+        total_bytes.desc(), models.TransitMetrics.transit_id
+    ).limit(limit).all()
+
+    top = [{
+        'transit_id': row.transit_id,
+        'name': row.name,
+        'bytes_in': int(row.bytes_in),
+        'bytes_out': int(row.bytes_out),
+        'errors': int(row.errors),
+        'connections_max': row.connections_max,
+        'connections_avg': row.connections_sum / row.samples if row.samples else 0.0,
+    } for row in rows]
+    with _top_cache_lock:
+        _top_cache[cache_key] = (time.monotonic(), top)
+    return top
+
+
+def transit_metric_series(transit_id, resolution_name):
+    """
+    Returns the stored buckets of one transit at one resolution ('1m', '1h' or '1d'), oldest
+    first, as dictionaries. Raises ValueError for an unknown resolution.
+    """
+    if resolution_name not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution '{resolution_name}'. Choose one of: {', '.join(RESOLUTIONS)}.")
+    rows = db.session.query(
+        models.TransitMetrics.bucket_start, models.TransitMetrics.bytes_in, models.TransitMetrics.bytes_out,
+        models.TransitMetrics.errors, models.TransitMetrics.connections_max,
+        models.TransitMetrics.connections_sum, models.TransitMetrics.samples,
+    ).filter(
+        models.TransitMetrics.transit_id == transit_id,
+        models.TransitMetrics.resolution == RESOLUTIONS[resolution_name],
+    ).order_by(models.TransitMetrics.bucket_start)
+    return [{
+        'bucket_start': row.bucket_start,
+        'bytes_in': row.bytes_in,
+        'bytes_out': row.bytes_out,
+        'errors': row.errors,
+        'connections_max': row.connections_max,
+        'connections_avg': row.connections_sum / row.samples if row.samples else 0.0,
+    } for row in rows]
+
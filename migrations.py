@@ -0,0 +1,238 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+from extensions import db
+import models
+
+_versions = sa.Table(
+    'schema_migrations', sa.MetaData(),
+    sa.Column('version', sa.String(100), primary_key=True),
+    sa.Column('applied_at', sa.DateTime, nullable=False),
+)
+
+
+class Operations:
+    """
+    Schema changes for a migration, in the spirit of Alembic's `op`.
+
+    Every operation first checks whether its change is already in place, so migrations
+    also bring databases up to date that db.create_all() partly created (it adds new
+    tables but never new columns, indexes or constraints to existing ones).
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.dialect = connection.dialect
+
+    def _inspector(self):
+        # A fresh inspector each time: its reflection cache would miss earlier operations
+        return sa.inspect(self.connection)
+
+    def has_table(self, table_name):
+        return self._inspector().has_table(table_name)
+
+    def has_column(self, table_name, column_name):
+        return any(column['name'] == column_name for column in self._inspector().get_columns(table_name))
+
+    def has_index(self, table_name, index_name):
+        inspector = self._inspector()
+        names = {index['name'] for index in inspector.get_indexes(table_name)}
+        names.update(constraint['name'] for constraint in inspector.get_unique_constraints(table_name))
+        return index_name in names
+
+    def create_table(self, table):
+        """Creates a table from its model definition, with its indexes and constraints."""
+        if not self.has_table(table.name):
+            table.create(self.connection)
+
+    def add_column(self, table_name, column):
+        """
+        Adds a column. A NOT NULL column needs a server_default for the existing rows.
+        A ForeignKey on the column is emitted inline, which SQLite and PostgreSQL both accept.
+        """
+        if self.has_column(table_name, column.name):
+            return
+        sa.Table(table_name, sa.MetaData(), column) # CreateColumn needs the column to belong to a table
+        column_ddl = str(CreateColumn(column).compile(dialect=self.dialect))
+        for foreign_key in column.foreign_keys:
+            referred_table, referred_column = foreign_key.target_fullname.split('.')
+            column_ddl += f" REFERENCES {referred_table} ({referred_column})"
+        self.connection.execute(sa.text(f"ALTER TABLE {table_name} ADD COLUMN {column_ddl}"))
+
+    def execute(self, sql, parameters=None):
+        """Runs a data statement, e.g. a backfill before a column becomes NOT NULL."""
+        self.connection.execute(sa.text(sql), parameters or {})
+
+    def set_not_null(self, table_name, column_name):
+        """
+        Makes an existing column NOT NULL; its NULLs have to be filled in first. SQLite can't
+        alter a column, so there the table is rebuilt from its reflected definition, keeping
+        its data, constraints and indexes (foreign keys are not enforced during the copy).
+        """
+        table = sa.Table(table_name, sa.MetaData(), autoload_with=self.connection)
+        if not table.c[column_name].nullable:
+            return
+        if self.dialect.name != 'sqlite':
+            self.connection.execute(sa.text(f"ALTER TABLE {table_name} ALTER COLUMN {column_name} SET NOT NULL"))
+            return
+        # Into the same metadata, which also holds the reflected tables its foreign keys refer to
+        rebuilt = table.to_metadata(table.metadata, name=f"_rebuild_{table_name}")
+        rebuilt.c[column_name].nullable = False
+        # The table only, its indexes are recreated under their names once the old table is gone
+        self.connection.execute(CreateTable(rebuilt))
+        column_list = ', '.join(column.name for column in table.columns)
+        self.connection.execute(sa.text(
+            f"INSERT INTO {rebuilt.name} ({column_list}) SELECT {column_list} FROM {table_name}"))
+        self.connection.execute(sa.text(f"DROP TABLE {table_name}"))
+        self.connection.execute(sa.text(f"ALTER TABLE {rebuilt.name} RENAME TO {table_name}"))
+        for index in table.indexes:
+            index.create(self.connection)
+
+    def create_index(self, index_name, table_name, column_names, unique=False):
+        if not self.has_index(table_name, index_name):
+            unique_sql = 'UNIQUE ' if unique else ''
+            self.connection.execute(sa.text(
+                f"CREATE {unique_sql}INDEX {index_name} ON {table_name} ({', '.join(column_names)})"))
+
+    def create_unique_constraint(self, constraint_name, table_name, column_names):
+        """SQLite can't add constraints to a table, a unique index enforces the same there."""
+        if self.dialect.name == 'sqlite':
+            self.create_index(constraint_name, table_name, column_names, unique=True)
+        elif not self.has_index(table_name, constraint_name):
+            self.connection.execute(sa.text(
+                f"ALTER TABLE {table_name} ADD CONSTRAINT {constraint_name} UNIQUE ({', '.join(column_names)})"))
+
+
+def _0001_applied_configs(op):
+    op.create_table(models.AppliedConfigs.__table__)
+
+
+def _0002_jobs(op):
+    op.create_table(models.Jobs.__table__)
+
+
+def _0003_latency_history(op):
+    op.add_column('transits', sa.Column('latency_p50_ms', sa.Float, nullable=True))
+    op.add_column('transits', sa.Column('latency_p95_ms', sa.Float, nullable=True))
+    op.add_column('transits', sa.Column('latency_checked_at', sa.DateTime, nullable=True))
+    op.create_table(models.TransitLatencySamples.__table__)
+
+
+def _0004_server_health(op):
+    op.add_column('servers', sa.Column('status_checked_at', sa.DateTime, nullable=True))
+    op.add_column('servers', sa.Column('status_changed_at', sa.DateTime, nullable=True))
+
+
+def _0005_list_indexes(op):
+    op.create_index('ix_transits_server_a_id', 'transits', ['server_a_id'])
+    op.create_index('ix_transits_server_b_id', 'transits', ['server_b_id'])
+    op.create_index('ix_transits_status', 'transits', ['status'])
+
+
+def _0006_unique_listen_port(op):
+    op.create_unique_constraint('uq_transits_server_a_listen_port', 'transits', ['server_a_id', 'server_a_listen_port'])
+
+
+def _0007_tuning_profiles(op):
+    op.create_table(models.TuningProfiles.__table__)
+    op.add_column('servers', sa.Column('tuning_profile_id', sa.Integer, sa.ForeignKey('tuning_profiles.id'), nullable=True))
+    op.add_column('transits', sa.Column('tuning_profile_id', sa.Integer, sa.ForeignKey('tuning_profiles.id'), nullable=True))
+
+
+def _0008_server_b_node_groups(op):
+    op.add_column('transits', sa.Column('server_b_weight', sa.Integer, nullable=False, server_default='1'))
+    op.add_column('transits', sa.Column('lb_strategy', sa.String(20), nullable=False, server_default='round'))
+    op.add_column('transits', sa.Column('max_fails', sa.Integer, nullable=True))
+    op.add_column('transits', sa.Column('fail_timeout', sa.Integer, nullable=True))
+    op.create_table(models.TransitBNodes.__table__)
+
+
+def _0009_transit_metrics(op):
+    op.create_table(models.TransitMetrics.__table__)
+    op.create_table(models.ServiceMetricCursors.__table__)
+
+
+def _0010_sort_indexes(op):
+    # Sorting the lists by created_at needs it on every row. Rows from before it was filled in
+    # get their last update time, which is the closest known value.
+    for table_name in ('servers', 'transits'):
+        op.execute(f"UPDATE {table_name} SET created_at = COALESCE(updated_at, :now) WHERE created_at IS NULL",
+                   {'now': datetime.utcnow()})
+        op.set_not_null(table_name, 'created_at')
+    # Keyset pagination (listings.py) only costs the same on every page with an index on the sort column
+    op.create_index('ix_servers_ssh_port', 'servers', ['ssh_port'])
+    op.create_index('ix_servers_created_at', 'servers', ['created_at'])
+    op.create_index('ix_transits_server_a_listen_port', 'transits', ['server_a_listen_port'])
+    op.create_index('ix_transits_created_at', 'transits', ['created_at'])
+
+
+def _0011_apply_history(op):
+    op.create_table(models.ApplyHistory.__table__)
+
+
+def _0012_ssh_key_auth(op):
+    op.add_column('servers', sa.Column('ssh_key_path', sa.String(255), nullable=True))
+
+
+def _0013_route_optimizer(op):
+    op.create_table(models.TransitHops.__table__)
+    op.create_table(models.RouteLinks.__table__)
+
+
+# In order. Never edit or remove a migration that was released, add a new one instead.
+MIGRATIONS = [
+    ('0001_applied_configs', _0001_applied_configs),
+    ('0002_jobs', _0002_jobs),
+    ('0003_latency_history', _0003_latency_history),
+    ('0004_server_health', _0004_server_health),
+    ('0005_list_indexes', _0005_list_indexes),
+    ('0006_unique_listen_port', _0006_unique_listen_port),
+    ('0007_tuning_profiles', _0007_tuning_profiles),
+    ('0008_server_b_node_groups', _0008_server_b_node_groups),
+    ('0009_transit_metrics', _0009_transit_metrics),
+    ('0010_sort_indexes', _0010_sort_indexes),
+    ('0011_apply_history', _0011_apply_history),
+    ('0012_ssh_key_auth', _0012_ssh_key_auth),
+    ('0013_route_optimizer', _0013_route_optimizer),
+]
+
+
+def applied_migrations():
+    """Returns the versions recorded in schema_migrations. Must run in an app context."""
+    if not sa.inspect(db.engine).has_table(_versions.name):
+        return set()
+    with db.engine.connect() as connection:
+        return {version for (version,) in connection.execute(sa.select(_versions.c.version))}
+
+
+def upgrade_database():
+    """
+    Brings the database schema up to date. Must run in an app context.
+
+    An empty database gets every table from the models at once and all migrations
+    recorded as applied. Otherwise each pending migration runs in its own transaction
+    and is recorded with it. Since every operation checks first, a migration that failed
+    halfway (SQLite doesn't roll back DDL through the Python driver) can be fixed and
+    simply run again. Tables without a migration are created at the end.
+
+    Returns the versions that were applied.
+    """
+    fresh = not sa.inspect(db.engine).has_table(models.Servers.__tablename__)
+    _versions.create(db.engine, checkfirst=True)
+    done = applied_migrations()
+    pending = [(version, upgrade) for version, upgrade in MIGRATIONS if version not in done]
+
+    if fresh:
+        db.create_all()
+    applied = []
+    for version, upgrade in pending:
+        with db.engine.begin() as connection:
+            if not fresh:
+                upgrade(Operations(connection))
+            connection.execute(_versions.insert().values(version=version, applied_at=datetime.utcnow()))
+        applied.append(version)
+    if not fresh:
+        db.create_all()
+    return applied
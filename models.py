@@ -1,4 +1,4 @@
-from app import db
+from extensions import db
 from datetime import datetime
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import relationship
@@ -10,11 +10,17 @@ class Servers(db.Model):
     name = db.Column(db.String(100), nullable=False, unique=True)
     ip_address = db.Column(db.String(45), nullable=False, unique=True) # IPv4 or IPv6
     ssh_username = db.Column(db.String(100), nullable=False)
-    ssh_password = db.Column(db.String(255), nullable=False) # Will be encrypted
-    ssh_port = db.Column(db.Integer, nullable=False, default=22)
+    ssh_password = db.Column(db.String(255), nullable=False) # Encrypted by credential_vault, empty with an SSH key
+    # Private key file on this host to log in with instead of the password (None: password login)
+    ssh_key_path = db.Column(db.String(255), nullable=True)
+    ssh_port = db.Column(db.Integer, nullable=False, default=22, index=True) # Indexed for sorting the list
     connection_status = db.Column(db.String(50), default='pending') # e.g., pending, connected, disconnected, error
+    status_checked_at = db.Column(db.DateTime, nullable=True) # Last health check
+    status_changed_at = db.Column(db.DateTime, nullable=True) # Last time the health check changed connection_status
+    # Tuning of the server's GOST config shard and the default for its transits (None: GOST_DEFAULT_TUNING_PROFILE)
+    tuning_profile_id = db.Column(db.Integer, ForeignKey('tuning_profiles.id'), nullable=True)
     
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True) # Indexed for sorting the list
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
@@ -28,29 +34,231 @@ class Servers(db.Model):
 
 class Transits(db.Model):
     __tablename__ = 'transits'
+    __table_args__ = (
+        # GOST on Server A can only bind each listen port once
+        db.UniqueConstraint('server_a_id', 'server_a_listen_port', name='uq_transits_server_a_listen_port'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, unique=True)
     
-    server_a_id = db.Column(db.Integer, ForeignKey('servers.id'), nullable=False)
-    server_a_listen_port = db.Column(db.Integer, nullable=False)
+    server_a_id = db.Column(db.Integer, ForeignKey('servers.id'), nullable=False, index=True)
+    server_a_listen_port = db.Column(db.Integer, nullable=False, index=True) # Indexed for sorting the list
     
-    server_b_id = db.Column(db.Integer, ForeignKey('servers.id'), nullable=False)
+    server_b_id = db.Column(db.Integer, ForeignKey('servers.id'), nullable=False, index=True)
     server_b_connect_port = db.Column(db.Integer, nullable=False) # Port on Server B that Server A's transit connects to
+    server_b_weight = db.Column(db.Integer, nullable=False, default=1) # Share of Server B in the node group (see b_nodes)
+    # Load balancing over Server B and the b_nodes, only used if there are b_nodes
+    lb_strategy = db.Column(db.String(20), nullable=False, default='round') # GOST strategy: round, random or fifo
+    max_fails = db.Column(db.Integer, nullable=True) # Failed connections before a node is skipped (None: GOST default)
+    fail_timeout = db.Column(db.Integer, nullable=True) # Seconds a failed node is skipped (None: GOST default)
     
     encryption_protocol = db.Column(db.String(50), default='ssh') # e.g., ssh, wireguard, openvpn
     destination_ip = db.Column(db.String(45), nullable=False) # The final destination IP the user wants to reach through server B
     destination_port = db.Column(db.Integer, nullable=False) # The final destination port
     
-    status = db.Column(db.String(50), default='pending') # e.g., pending, active, inactive, error
-    latency_ms = db.Column(db.Float, nullable=True) # Latency in milliseconds
+    status = db.Column(db.String(50), default='pending', index=True) # e.g., pending, active, inactive, error
+    latency_ms = db.Column(db.Float, nullable=True) # Latency in milliseconds (latest probe)
+    latency_p50_ms = db.Column(db.Float, nullable=True) # Median latency over the probe window
+    latency_p95_ms = db.Column(db.Float, nullable=True) # 95th percentile latency over the probe window
+    latency_checked_at = db.Column(db.DateTime, nullable=True)
+    tuning_profile_id = db.Column(db.Integer, ForeignKey('tuning_profiles.id'), nullable=True) # None: Server A's profile
     
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True) # Indexed for sorting the list
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
     server_a = relationship("Servers", foreign_keys=[server_a_id], back_populates="transits_a")
     server_b = relationship("Servers", foreign_keys=[server_b_id], back_populates="transits_b")
+    # Additional Server B nodes that share the load with server_b
+    b_nodes = relationship("TransitBNodes", back_populates="transit", order_by="TransitBNodes.id",
+                           cascade="all, delete-orphan", lazy=True)
+    # Relay servers between Server A and Server B, in the order the traffic passes them
+    hops = relationship("TransitHops", back_populates="transit", order_by="TransitHops.position",
+                        cascade="all, delete-orphan", lazy=True)
 
     def __repr__(self):
         return f'<Transit {self.name}>'
+
+class TransitBNodes(db.Model):
+    __tablename__ = 'transit_b_nodes'
+    __table_args__ = (
+        db.UniqueConstraint('transit_id', 'server_id', 'connect_port', name='uq_transit_b_nodes_server_port'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    transit_id = db.Column(db.Integer, ForeignKey('transits.id'), nullable=False, index=True)
+    server_id = db.Column(db.Integer, ForeignKey('servers.id'), nullable=False, index=True)
+    connect_port = db.Column(db.Integer, nullable=False) # Port on this server that Server A connects to
+    weight = db.Column(db.Integer, nullable=False, default=1) # Share of this node in the transit's node group
+
+    transit = relationship("Transits", back_populates="b_nodes")
+    server = relationship("Servers")
+
+    def __repr__(self):
+        return f'<TransitBNode transit_id={self.transit_id} server_id={self.server_id}>'
+
+class TransitHops(db.Model):
+    __tablename__ = 'transit_hops'
+    __table_args__ = (
+        db.UniqueConstraint('transit_id', 'position', name='uq_transit_hops_position'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    transit_id = db.Column(db.Integer, ForeignKey('transits.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False) # 0 is the hop Server A connects to
+    server_id = db.Column(db.Integer, ForeignKey('servers.id'), nullable=False, index=True)
+    connect_port = db.Column(db.Integer, nullable=False) # Port of the relay listener on this server
+
+    transit = relationship("Transits", back_populates="hops")
+    server = relationship("Servers")
+
+    def __repr__(self):
+        return f'<TransitHop transit_id={self.transit_id} position={self.position} server_id={self.server_id}>'
+
+class RouteLinks(db.Model):
+    __tablename__ = 'route_links'
+    __table_args__ = (
+        db.Index('ix_route_links_source_target', 'source_server_id', 'target_server_id'),
+    )
+
+    # A measured link from a server to another server (target_server_id) or to a transit
+    # destination (destination_ip/destination_port), see route_optimizer.py
+    id = db.Column(db.Integer, primary_key=True)
+    source_server_id = db.Column(db.Integer, ForeignKey('servers.id'), nullable=False)
+    target_server_id = db.Column(db.Integer, ForeignKey('servers.id'), nullable=True, index=True)
+    destination_ip = db.Column(db.String(45), nullable=True)
+    destination_port = db.Column(db.Integer, nullable=True)
+    latency_ms = db.Column(db.Float, nullable=True) # Median TCP connect time, None if every attempt failed
+    loss = db.Column(db.Float, nullable=False, default=0) # Share of failed attempts, 0-1
+    measured_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        target = self.target_server_id if self.target_server_id is not None else f'{self.destination_ip}:{self.destination_port}'
+        return f'<RouteLink {self.source_server_id} -> {target} {self.latency_ms}>'
+
+class TuningProfiles(db.Model):
+    __tablename__ = 'tuning_profiles'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+    debug = db.Column(db.Boolean, nullable=False, default=False) # GOST debug logging, per config shard
+    retries = db.Column(db.Integer, nullable=False, default=3) # Attempts to reach Server B before a connection fails
+    timeout = db.Column(db.Integer, nullable=True) # Seconds to connect and handshake with Server B (None: GOST default)
+    ttl = db.Column(db.Integer, nullable=True) # Seconds an idle UDP session is kept (None: GOST default)
+    keepalive = db.Column(db.Boolean, nullable=False, default=False) # TCP keepalive on the connection to Server B
+    ping = db.Column(db.Integer, nullable=True) # Seconds between heartbeats to Server B (None: off)
+    multiplex = db.Column(db.Boolean, nullable=False, default=False) # Relay over mws/mwss/mtls instead of ws/wss/tls
+    node_options = db.Column(db.String(255), nullable=True) # Extra GOST node parameters, e.g. "nodelay=true"
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<TuningProfile {self.name}>'
+
+class AppliedConfigs(db.Model):
+    __tablename__ = 'applied_configs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    server_id = db.Column(db.Integer, ForeignKey('servers.id'), nullable=False, unique=True) # Server A of the config shard
+    config_hash = db.Column(db.String(64), nullable=False) # SHA-256 of the last successfully applied config
+    route_hashes = db.Column(db.Text, nullable=False, default='{}') # JSON object: transit ID -> route hash
+    settings_hash = db.Column(db.String(64), nullable=True) # SHA-256 of the config's top-level keys (Debug, Retries)
+
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AppliedConfig server_id={self.server_id}>'
+
+class Jobs(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False) # e.g., add_server, apply_gost_config
+    status = db.Column(db.String(50), nullable=False, default='queued') # queued, running, succeeded, failed
+    progress = db.Column(db.Integer, nullable=False, default=0) # Percent complete, 0-100
+    message = db.Column(db.String(255), nullable=True) # Short human-readable progress or error message
+    result = db.Column(db.Text, nullable=True) # JSON object, set when the job finishes
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.job_type} {self.status}>'
+
+class ApplyHistory(db.Model):
+    __tablename__ = 'apply_history'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, ForeignKey('jobs.id'), nullable=False, index=True) # The apply_gost_config job
+    # Server of the config shard, None for the transits the generator left out. No foreign key,
+    # so the history outlives deleted servers.
+    server_id = db.Column(db.Integer, nullable=True)
+    server_name = db.Column(db.String(100), nullable=True)
+    outcome = db.Column(db.String(20), nullable=False) # applied, unchanged, write_failed, reload_failed, skipped
+    transit_count = db.Column(db.Integer, nullable=False, default=0) # Transits in the shard
+    activated_count = db.Column(db.Integer, nullable=False, default=0) # Transits that changed to active
+    errored_count = db.Column(db.Integer, nullable=False, default=0) # Transits that changed to error
+    duration_ms = db.Column(db.Float, nullable=False, default=0) # Writing and reloading the shard
+    message = db.Column(db.String(255), nullable=True) # Error or reload message
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<ApplyHistory job_id={self.job_id} server_id={self.server_id} {self.outcome}>'
+
+class TransitLatencySamples(db.Model):
+    __tablename__ = 'transit_latency_samples'
+    __table_args__ = (
+        # The last samples of each transit, for the rolling p50/p95
+        db.Index('ix_transit_latency_samples_transit_measured', 'transit_id', 'measured_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    transit_id = db.Column(db.Integer, ForeignKey('transits.id'), nullable=False, index=True)
+    latency_ms = db.Column(db.Float, nullable=True) # None if the probe failed
+    measured_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<TransitLatencySample transit_id={self.transit_id} {self.latency_ms}>'
+
+class TransitMetrics(db.Model):
+    __tablename__ = 'transit_metrics'
+    __table_args__ = (
+        # One row per transit and bucket; also serves the per-transit series lookups
+        db.UniqueConstraint('transit_id', 'resolution', 'bucket_start', name='uq_transit_metrics_bucket'),
+        # Top-N and pruning scan one resolution over a time range
+        db.Index('ix_transit_metrics_resolution_bucket', 'resolution', 'bucket_start'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    transit_id = db.Column(db.Integer, ForeignKey('transits.id'), nullable=False)
+    resolution = db.Column(db.Integer, nullable=False) # Bucket length in seconds: 60, 3600 or 86400
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    bytes_in = db.Column(db.BigInteger, nullable=False, default=0) # Received from clients on Server A
+    bytes_out = db.Column(db.BigInteger, nullable=False, default=0) # Sent back to clients on Server A
+    errors = db.Column(db.Integer, nullable=False, default=0) # Failed connections (GOST handler errors)
+    connections_max = db.Column(db.Integer, nullable=False, default=0) # Most active connections in one scrape
+    connections_sum = db.Column(db.BigInteger, nullable=False, default=0) # Active connections summed over the scrapes
+    samples = db.Column(db.Integer, nullable=False, default=0) # Scrapes in the bucket, for the average
+
+    def __repr__(self):
+        return f'<TransitMetric transit_id={self.transit_id} {self.resolution}s {self.bucket_start}>'
+
+class ServiceMetricCursors(db.Model):
+    __tablename__ = 'service_metric_cursors'
+
+    # The counters of one GOST service as of the last scrape, to turn them into per-bucket deltas.
+    # Kept per service, since a restart that resets one of a transit's counters may not reset the other.
+    server_id = db.Column(db.Integer, ForeignKey('servers.id'), primary_key=True, autoincrement=False)
+    service = db.Column(db.String(100), primary_key=True) # e.g. 'transit-5-tcp'
+    transit_id = db.Column(db.Integer, ForeignKey('transits.id'), nullable=False)
+    bytes_in_total = db.Column(db.BigInteger, nullable=False)
+    bytes_out_total = db.Column(db.BigInteger, nullable=False)
+    errors_total = db.Column(db.BigInteger, nullable=False)
+    scraped_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<ServiceMetricCursor server_id={self.server_id} {self.service}>'
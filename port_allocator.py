@@ -0,0 +1,109 @@
+import re
+
+PORT_MIN = 1
+PORT_MAX = 65535
+
+# Matches a bitmap byte that still has at least one free port
+_NOT_FULL_BYTE = re.compile(rb'[^\xff]')
+
+
+class PortIndex:
+    """
+    The used listen ports of every server, kept as one bitmap per server.
+
+    A bitmap takes 8 KiB no matter how many ports are used, lookups are a single bit
+    test, and finding the next free port skips full stretches of the bitmap with a
+    C-level regex search instead of testing ports one by one.
+    """
+
+    def __init__(self):
+        self._bitmaps = {} # server ID -> bytearray with one bit per port
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Builds an index from (server ID, port) pairs, e.g. the rows of a query."""
+        index = cls()
+        for server_id, port in rows:
+            index.add(server_id, port)
+        return index
+
+    def _bitmap(self, server_id):
+        bitmap = self._bitmaps.get(server_id)
+        if bitmap is None:
+            bitmap = self._bitmaps[server_id] = bytearray((PORT_MAX + 1 + 7) // 8)
+        return bitmap
+
+    def is_used(self, server_id, port):
+        bitmap = self._bitmaps.get(server_id)
+        return bitmap is not None and bool(bitmap[port >> 3] & (1 << (port & 7)))
+
+    def add(self, server_id, port):
+        """Marks a port as used. Returns False if it already was."""
+        bitmap = self._bitmap(server_id)
+        mask = 1 << (port & 7)
+        if bitmap[port >> 3] & mask:
+            return False
+        bitmap[port >> 3] |= mask
+        return True
+
+    def discard(self, server_id, port):
+        """Marks a port as free again."""
+        bitmap = self._bitmaps.get(server_id)
+        if bitmap is not None:
+            bitmap[port >> 3] &= ~(1 << (port & 7)) & 0xFF
+
+    def allocate(self, server_id, start=PORT_MIN, end=PORT_MAX):
+        """
+        Marks the lowest free port in [start, end] as used and returns it.
+        Returns None if every port in the range is taken.
+        """
+        if not PORT_MIN <= start <= end <= PORT_MAX:
+            raise ValueError(f"Invalid port range {start}-{end}.")
+        bitmap = self._bitmap(server_id)
+        byte_index = start >> 3
+        last_byte_index = end >> 3
+        while byte_index <= last_byte_index:
+            match = _NOT_FULL_BYTE.search(bitmap, byte_index, last_byte_index + 1)
+            if match is None:
+                return None
+            byte_index = match.start()
+            byte = bitmap[byte_index]
+            for bit in range(8):
+                port = (byte_index << 3) | bit
+                if start <= port <= end and not byte & (1 << bit):
+                    bitmap[byte_index] = byte | (1 << bit)
+                    return port
+            # The free bits of this byte were outside the range
+            byte_index += 1
+        return None
+
+
+def parse_port_range(value):
+    """Parses a 'START-END' port range. Raises ValueError if it is invalid."""
+    try:
+        start, end = (int(part) for part in value.split('-', 1))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid port range '{value}', expected START-END.")
+    if not PORT_MIN <= start <= end <= PORT_MAX:
+        raise ValueError(f"Invalid port range '{value}', ports must be between {PORT_MIN} and {PORT_MAX}.")
+    return start, end
+
+
+if __name__ == '__main__':
+    # Allocate 10k ports on one host and time the allocations on a nearly full range
+    import time
+
+    index = PortIndex()
+    start = time.perf_counter()
+    allocated = [index.allocate(1, 10000, 60000) for _ in range(10000)]
+    elapsed = time.perf_counter() - start
+    print(f"Allocated {len(allocated)} ports ({allocated[0]}-{allocated[-1]}) in {elapsed * 1000:.1f}ms")
+
+    index.discard(1, 15000)
+    start = time.perf_counter()
+    print(f"Reused freed port: {index.allocate(1, 10000, 60000)} "
+          f"in {(time.perf_counter() - start) * 1e6:.0f}us")
+    start = time.perf_counter()
+    print(f"Next free port after 10k used ones: {index.allocate(1, 10000, 60000)} "
+          f"in {(time.perf_counter() - start) * 1e6:.0f}us")
+    print(f"Full range: {index.allocate(1, 10000, 10007)}")
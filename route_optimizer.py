@@ -0,0 +1,443 @@
+import heapq
+import json
+import math
+import shlex
+import socket # For socket.error
+import statistics
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import selectinload
+
+from extensions import db
+import models
+from credential_vault import vault
+from deploy import run_in_parallel
+from gost_config_generator import RELAY_CHAIN_PROTOCOLS
+from port_allocator import parse_port_range
+from ssh_pool import ssh_pool
+
+# Run with python3 on every server by probe_route_links(). Reads {"targets": [[host, port], ...],
+# "samples": N, "timeout": S} from stdin and prints one list of connect times (ms, or null for a
+# failed attempt) per target. Only the standard library, so any server with python3 can run it.
+_REMOTE_PROBE = r'''
+import json, socket, sys, time
+from concurrent.futures import ThreadPoolExecutor
+request = json.load(sys.stdin)
+def probe(target):
+    samples = []
+    for _ in range(request["samples"]):
+        started = time.perf_counter()
+        try:
+            socket.create_connection((target[0], target[1]), request["timeout"]).close()
+            samples.append((time.perf_counter() - started) * 1000)
+        except OSError:
+            samples.append(None)
+    return samples
+with ThreadPoolExecutor(64) as pool:
+    print(json.dumps(list(pool.map(probe, request["targets"]))))
+'''
+_REMOTE_PROBE_COMMAND = f"python3 -c {shlex.quote(_REMOTE_PROBE)}"
+# Targets one server probes at the same time, see _REMOTE_PROBE
+_REMOTE_PROBE_THREADS = 64
+
+# Servers that failed their last health check are never picked as a relay
+_UNHEALTHY_STATUSES = ('Disconnected', 'Error')
+
+
+def _run_remote_probe(server, targets, samples, timeout):
+    """
+    Runs _REMOTE_PROBE on a server over a pooled SSH session. Runs on the probe thread pool,
+    without an app context. Returns (True, list of samples per target) or (False, error_message).
+    """
+    import paramiko # Loaded on first use, see ssh_pool
+
+    # Every attempt can take the full timeout, plus the SSH round trips
+    budget = timeout * samples * -(-len(targets) // _REMOTE_PROBE_THREADS) + 2 * timeout
+    try:
+        with ssh_pool.connection(server.ip_address, server.ssh_port, server.ssh_username,
+                                 None if server.ssh_key_path else vault.decrypt(server.ssh_password),
+                                 timeout=timeout, key_filename=server.ssh_key_path) as client:
+            stdin, stdout, stderr = client.exec_command(_REMOTE_PROBE_COMMAND, timeout=budget)
+            stdin.write(json.dumps({'targets': targets, 'samples': samples, 'timeout': timeout}))
+            stdin.channel.shutdown_write()
+            if not stdout.channel.status_event.wait(budget):
+                stdout.channel.close()
+                return False, f"Link probe timed out on {server.ip_address}."
+            exit_status = stdout.channel.recv_exit_status()
+            output = stdout.read().decode(errors='replace')
+            if exit_status != 0:
+                error_output = stderr.read().decode(errors='replace').strip()
+                return False, f"Link probe failed on {server.ip_address} (exit {exit_status}): {error_output}"
+    except paramiko.AuthenticationException:
+        return False, "Authentication failed (wrong username, password or SSH key)."
+    except paramiko.SSHException as e:
+        return False, f"SSH error: {str(e)}"
+    except (socket.error, IOError) as e:
+        return False, f"Network error: {str(e)}"
+    try:
+        results = json.loads(output)
+    except ValueError:
+        return False, f"Link probe on {server.ip_address} returned invalid output."
+    if len(results) != len(targets):
+        return False, f"Link probe on {server.ip_address} returned {len(results)} results for {len(targets)} targets."
+    return True, results
+
+
+def summarize_samples(samples):
+    """Returns (median latency in ms or None, loss 0-1) of one target's connect times."""
+    latencies = [latency for latency in samples if latency is not None]
+    loss = 1 - len(latencies) / len(samples) if samples else 1.0
+    return (statistics.median(latencies) if latencies else None), loss
+
+
+def probe_route_links():
+    """
+    Measures the links of the route graph from every server and stores them in RouteLinks.
+
+    Each server connects over TCP to every other server's SSH port and to the destination of
+    every relay transit, ROUTE_PROBE_SAMPLES times each, through a small python3 script run
+    over SSH. A link's latency is the median connect time (one round trip), its loss the share
+    of failed attempts. A server's previous links are replaced in one statement each. Servers
+    that can't be reached keep their old links, which age out after ROUTE_LINK_MAX_AGE.
+    Must run in an app context.
+
+    Returns (number of servers probed, number of links stored, error messages).
+    """
+    servers = db.session.query(
+        models.Servers.id, models.Servers.name, models.Servers.ip_address, models.Servers.ssh_port,
+        models.Servers.ssh_username, models.Servers.ssh_password, models.Servers.ssh_key_path
+    ).all()
+    if not servers:
+        return 0, 0, []
+    destinations = sorted(db.session.query(models.Transits.destination_ip, models.Transits.destination_port).filter(
+        models.Transits.encryption_protocol.in_(list(RELAY_CHAIN_PROTOCOLS))).distinct())
+
+    samples = current_app.config['ROUTE_PROBE_SAMPLES']
+    timeout = current_app.config['ROUTE_PROBE_TIMEOUT']
+
+    def targets_of(server):
+        return ([[other.ip_address, other.ssh_port] for other in servers if other.id != server.id] +
+                [[destination_ip, destination_port] for destination_ip, destination_port in destinations])
+
+    results = run_in_parallel(lambda server: _run_remote_probe(server, targets_of(server), samples, timeout),
+                              servers, max_workers=current_app.config['ROUTE_PROBE_WORKERS'])
+
+    now = datetime.utcnow()
+    probed_ids, rows, errors = [], [], []
+    for server, (success, result) in zip(servers, results):
+        if not success:
+            errors.append(f"Server '{server.name}': {result}")
+            continue
+        probed_ids.append(server.id)
+        targets = [{'target_server_id': other.id} for other in servers if other.id != server.id]
+        targets.extend({'destination_ip': destination_ip, 'destination_port': destination_port}
+                       for destination_ip, destination_port in destinations)
+        for target, target_samples in zip(targets, result):
+            latency_ms, loss = summarize_samples(target_samples)
+            rows.append({'source_server_id': server.id, 'target_server_id': None, 'destination_ip': None,
+                         'destination_port': None, **target, 'latency_ms': latency_ms, 'loss': loss,
+                         'measured_at': now})
+    if probed_ids:
+        db.session.execute(delete(models.RouteLinks).where(models.RouteLinks.source_server_id.in_(probed_ids)))
+        if rows:
+            db.session.execute(insert(models.RouteLinks), rows)
+        db.session.commit()
+    return len(probed_ids), len(rows), errors
+
+
+def link_cost(latency_ms, loss, loss_penalty_ms):
+    """
+    Returns the cost of a link in milliseconds, or None if it is unusable. Loss is charged
+    with loss_penalty_ms per 100% lost, e.g. 10 ms for 1% loss with the default 1000.
+    """
+    if latency_ms is None or loss >= 1:
+        return None
+    return latency_ms + loss * loss_penalty_ms
+
+
+class RouteGraph:
+    """
+    The measured route graph: link costs between servers and from servers to destinations.
+
+    Connect times are round trips, so a link measured in one direction is also used for the
+    other one when that wasn't measured. Servers that failed their last health check have
+    no links, so they are never picked. A graph is meant for one optimizer run, since it
+    caches the searches made on it.
+    """
+
+    def __init__(self, server_links=None, destination_links=None):
+        self.server_links = server_links or {} # server ID -> {server ID: cost}
+        self.destination_links = destination_links or {} # (destination IP, port) -> {server ID: cost}
+        self._trees = {} # (Server A ID, max_hops) -> shortest_paths()
+
+    @classmethod
+    def load(cls):
+        """Builds the graph from the RouteLinks younger than ROUTE_LINK_MAX_AGE. Must run in an app context."""
+        loss_penalty_ms = current_app.config['ROUTE_LOSS_PENALTY_MS']
+        measured_after = datetime.utcnow() - timedelta(seconds=current_app.config['ROUTE_LINK_MAX_AGE'])
+        unhealthy = {server_id for (server_id,) in db.session.query(models.Servers.id).filter(
+            models.Servers.connection_status.in_(_UNHEALTHY_STATUSES))}
+        graph = cls()
+        reverse_links = []
+        for link in db.session.query(
+            models.RouteLinks.source_server_id, models.RouteLinks.target_server_id, models.RouteLinks.destination_ip,
+            models.RouteLinks.destination_port, models.RouteLinks.latency_ms, models.RouteLinks.loss
+        ).filter(models.RouteLinks.measured_at >= measured_after):
+            cost = link_cost(link.latency_ms, link.loss, loss_penalty_ms)
+            if cost is None or link.source_server_id in unhealthy or link.target_server_id in unhealthy:
+                continue
+            if link.target_server_id is None:
+                graph.destination_links.setdefault((link.destination_ip, link.destination_port), {})[link.source_server_id] = cost
+            else:
+                graph.server_links.setdefault(link.source_server_id, {})[link.target_server_id] = cost
+                reverse_links.append((link.target_server_id, link.source_server_id, cost))
+        for source_id, target_id, cost in reverse_links:
+            graph.server_links.setdefault(source_id, {}).setdefault(target_id, cost)
+        return graph
+
+    def shortest_paths(self, server_a_id, max_hops):
+        """
+        Dijkstra from Server A over the server graph, limited to paths of at most max_hops + 1
+        servers after Server A (the relay hops and Server B). Returns {server ID: (cost, path)},
+        path being the servers after Server A up to and including that server. Cached per
+        Server A and max_hops, so that all the destinations of a Server A share one search.
+        """
+        cache_key = (server_a_id, max_hops)
+        tree = self._trees.get(cache_key)
+        if tree is not None:
+            return tree
+        tree = {}
+        max_depth = max_hops + 1
+        unreached = max_depth + 1
+        # A server reached again over more servers is only worth expanding if it has hops left
+        # that its cheaper paths didn't have, i.e. if it was only settled at a greater depth
+        settled_depth = {server_a_id: 0}
+        queued_costs = {} # (server ID, depth) -> lowest cost queued so far
+        queue = [(0.0, 0, server_a_id, ())]
+        while queue:
+            cost, depth, server_id, path = heapq.heappop(queue)
+            if depth:
+                if settled_depth.get(server_id, unreached) <= depth:
+                    continue
+                settled_depth[server_id] = depth
+                tree.setdefault(server_id, (cost, path))
+            if depth == max_depth:
+                continue
+            next_depth = depth + 1
+            for next_id, link in self.server_links.get(server_id, {}).items():
+                if settled_depth.get(next_id, unreached) <= next_depth or next_id in path:
+                    continue
+                next_cost = cost + link
+                if next_cost < queued_costs.get((next_id, next_depth), math.inf):
+                    queued_costs[(next_id, next_depth)] = next_cost
+                    heapq.heappush(queue, (next_cost, next_depth, next_id, path + (next_id,)))
+        self._trees[cache_key] = tree
+        return tree
+
+    def best_chain(self, server_a_id, destination_ip, destination_port, max_hops=1):
+        """
+        Returns (cost in ms, [relay hop IDs..., Server B ID]) of the cheapest chain from
+        Server A to a destination with at most max_hops relay hops, or None if no measured
+        chain exists. Any server with a link to the destination can be Server B.
+        """
+        exits = self.destination_links.get((destination_ip, destination_port))
+        if not exits:
+            return None
+        tree = self.shortest_paths(server_a_id, max_hops)
+        best = None
+        for server_b_id, exit_cost in exits.items():
+            reached = tree.get(server_b_id)
+            if reached is not None and (best is None or reached[0] + exit_cost < best[0]):
+                best = (reached[0] + exit_cost, list(reached[1]))
+        return best
+
+    def chain_cost(self, server_a_id, chain, destination_ip, destination_port):
+        """Returns the cost of a given chain (relay hop IDs..., Server B ID), or None if a link is unknown."""
+        cost = 0.0
+        for source_id, target_id in zip([server_a_id] + chain[:-1], chain):
+            link = self.server_links.get(source_id, {}).get(target_id)
+            if link is None:
+                return None
+            cost += link
+        exit_cost = self.destination_links.get((destination_ip, destination_port), {}).get(chain[-1])
+        return None if exit_cost is None else cost + exit_cost
+
+
+def suggest_route(server_a_id, destination_ip, destination_port, graph=None):
+    """
+    Returns the best measured chain for a new transit as a dictionary with server_b_id,
+    hop_server_ids and cost_ms, or None if the destination wasn't measured yet. Must run in
+    an app context.
+    """
+    graph = graph or RouteGraph.load()
+    best = graph.best_chain(server_a_id, destination_ip, destination_port, current_app.config['ROUTE_MAX_HOPS'])
+    if best is None:
+        return None
+    cost, chain = best
+    return {'server_b_id': chain[-1], 'hop_server_ids': chain[:-1], 'cost_ms': round(cost, 1)}
+
+
+def is_worth_switching(current_cost, best_cost):
+    """Only a clear gain switches a route, so that measurement noise doesn't make it flap."""
+    if current_cost is None:
+        return True
+    gain = current_cost - best_cost
+    return (gain >= current_app.config['ROUTE_SWITCH_MIN_GAIN_MS'] and
+            gain >= current_cost * current_app.config['ROUTE_SWITCH_MIN_GAIN'])
+
+
+def plan_route_changes(graph=None):
+    """
+    Compares the chain of every relay transit with the best measured one.
+
+    Transits with additional Server B nodes are left alone: their node group was put
+    together by hand for load balancing. Must run in an app context.
+
+    Returns a list of dictionaries, one per transit whose best chain is clearly better than
+    its current one (see ROUTE_SWITCH_MIN_GAIN), with the transit, its current chain and
+    cost (None if a link of it wasn't measured) and the new chain and cost.
+    """
+    graph = graph or RouteGraph.load()
+    max_hops = current_app.config['ROUTE_MAX_HOPS']
+    transits = models.Transits.query.options(
+        selectinload(models.Transits.b_nodes), selectinload(models.Transits.hops)
+    ).filter(
+        models.Transits.encryption_protocol.in_(list(RELAY_CHAIN_PROTOCOLS)),
+        models.Transits.status != 'inactive',
+    ).order_by(models.Transits.id).all()
+
+    changes = []
+    for transit in transits:
+        if transit.b_nodes:
+            continue
+        best = graph.best_chain(transit.server_a_id, transit.destination_ip, transit.destination_port, max_hops)
+        if best is None:
+            continue
+        best_cost, best_chain = best
+        current_chain = [hop.server_id for hop in transit.hops] + [transit.server_b_id]
+        if best_chain == current_chain:
+            continue
+        current_cost = graph.chain_cost(transit.server_a_id, current_chain, transit.destination_ip,
+                                        transit.destination_port)
+        if is_worth_switching(current_cost, best_cost):
+            changes.append({
+                'transit': transit,
+                'current_chain': current_chain,
+                'current_cost_ms': None if current_cost is None else round(current_cost, 1),
+                'chain': best_chain,
+                'cost_ms': round(best_cost, 1),
+            })
+    return changes
+
+
+def apply_route_changes(changes):
+    """
+    Moves transits to their new chains: Server B is replaced, the relay hops are rebuilt and
+    the transit goes back to 'pending', so the next GOST config apply regenerates its
+    ChainNodes and listeners. Server B keeps its connect port if it is free on the new
+    server; new relay hops get the lowest free port in PORT_ALLOCATION_RANGE. All changes
+    are committed in one transaction. Must run in an app context.
+
+    Returns (applied changes, error messages for the transits that were left as they are).
+    """
+    from server_views import load_port_index
+
+    allocation_start, allocation_end = parse_port_range(current_app.config['PORT_ALLOCATION_RANGE'])
+    port_indexes = {}
+
+    def port_index_of(server_id):
+        if server_id not in port_indexes:
+            port_indexes[server_id] = load_port_index(db.session.get(models.Servers, server_id))
+        return port_indexes[server_id]
+
+    applied, errors = [], []
+    for change in changes:
+        transit = change['transit']
+        # The transit's own listeners are about to move, so their ports count as free
+        own_ports = [(hop.server_id, hop.connect_port) for hop in transit.hops]
+        own_ports.append((transit.server_b_id, transit.server_b_connect_port))
+        for server_id, port in own_ports:
+            port_index_of(server_id).discard(server_id, port)
+
+        *hop_server_ids, server_b_id = change['chain']
+        server_b_port = transit.server_b_connect_port
+        if not port_index_of(server_b_id).add(server_b_id, server_b_port):
+            server_b_port = port_index_of(server_b_id).allocate(server_b_id, allocation_start, allocation_end)
+        hop_ports = [port_index_of(server_id).allocate(server_id, allocation_start, allocation_end)
+                     for server_id in hop_server_ids]
+        if server_b_port is None or None in hop_ports:
+            errors.append(f"Transit '{transit.name}': no free port left in {allocation_start}-{allocation_end} "
+                          f"on a server of its new chain.")
+            for server_id, port in zip(change['chain'], hop_ports + [server_b_port]):
+                if port is not None:
+                    port_index_of(server_id).discard(server_id, port)
+            for server_id, port in own_ports:
+                port_index_of(server_id).add(server_id, port)
+            continue
+
+        if transit.hops:
+            # The old hops have to be deleted before new ones can take their positions
+            transit.hops = []
+            db.session.flush()
+        transit.server_b_id = server_b_id
+        transit.server_b_connect_port = server_b_port
+        transit.hops = [models.TransitHops(position=position, server_id=server_id, connect_port=port)
+                        for position, (server_id, port) in enumerate(zip(hop_server_ids, hop_ports))]
+        transit.status = 'pending'
+        applied.append(change)
+    if applied:
+        db.session.commit()
+    return applied, errors
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    # A synthetic fleet: servers in a few regions, cheap links within a region, a long-haul
+    # link between regions that depends on the pair, and destinations reachable from one
+    # region each. Dijkstra finds chains through a relay that beat every direct Server B.
+    random.seed(1)
+    region_count, servers_per_region = 6, 50
+    region_of = {server_id: server_id % region_count for server_id in range(1, region_count * servers_per_region + 1)}
+    region_distance = {(a, b): 0 if a == b else random.uniform(40, 250)
+                       for a in range(region_count) for b in range(region_count)}
+    region_distance = {(a, b): min(cost, region_distance[(b, a)]) for (a, b), cost in region_distance.items()}
+    # Poor peering between some regions, which relays through a third region get around
+    for a, b in ((0, 3), (1, 4), (2, 5)):
+        region_distance[(a, b)] = region_distance[(b, a)] = 320
+
+    demo_graph = RouteGraph()
+    for source_id in region_of:
+        demo_graph.server_links[source_id] = {
+            target_id: link_cost(region_distance[(region_of[source_id], region_of[target_id])] + random.uniform(1, 10),
+                                 random.choice((0, 0, 0, 0.01, 0.05)), 1000)
+            for target_id in region_of if target_id != source_id
+        }
+    destinations = [(f"203.0.113.{i}", 443) for i in range(1, 201)]
+    for i, destination in enumerate(destinations):
+        # Only the servers in its own region get through to a destination (e.g. an allowlist)
+        demo_graph.destination_links[destination] = {
+            server_id: random.uniform(1, 20) for server_id in region_of if region_of[server_id] == i % region_count
+        }
+
+    server_a_ids = list(region_of)
+    for max_hops in (0, 1, 2):
+        demo_graph._trees.clear()
+        started = time.perf_counter()
+        chains = [demo_graph.best_chain(server_a_id, *destination, max_hops=max_hops)
+                  for server_a_id in server_a_ids for destination in destinations[:20]]
+        elapsed = time.perf_counter() - started
+        mean_cost = statistics.mean(cost for cost, _chain in chains)
+        relayed = sum(1 for _cost, chain in chains if len(chain) > 1)
+        print(f"max_hops={max_hops}: {len(chains)} chains from {len(server_a_ids)} Server A in {elapsed:.2f}s, "
+              f"mean cost {mean_cost:.1f}ms, {relayed} through relay hops")
+
+    # Server 6 is in region 0, the destination in region 3: the regions with poor peering
+    server_a_id, destination = 6, destinations[3]
+    direct_cost, direct_chain = demo_graph.best_chain(server_a_id, *destination, max_hops=0)
+    cost, chain = demo_graph.best_chain(server_a_id, *destination, max_hops=1)
+    print(f"Server {server_a_id} -> {destination[0]}: best Server B {direct_chain} {direct_cost:.1f}ms, "
+          f"best chain {chain} {cost:.1f}ms")
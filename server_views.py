@@ -0,0 +1,240 @@
+import os
+
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, jsonify
+from flask_babel import gettext as _
+
+from extensions import db
+import models
+from credential_vault import vault
+from gost_config_generator import RELAY_CHAIN_PROTOCOLS, parse_node_options
+from jobs import submit_job, update_job_progress
+from listings import list_servers_page, SERVER_SORTS, page_urls, list_page_response
+from port_allocator import PortIndex, parse_port_range
+from utils import test_ssh_connection
+
+bp = Blueprint('servers', __name__)
+
+
+@bp.route('/add_server', methods=['GET', 'POST'])
+def add_server():
+    if request.method == 'POST':
+        server_name = request.form.get('server_name')
+        ip_address = request.form.get('ip_address')
+        ssh_username = request.form.get('ssh_username')
+        ssh_password = request.form.get('ssh_password') # Raw password from form
+        ssh_key_path = (request.form.get('ssh_key_path') or '').strip() or None # Optional, replaces the password
+        tuning_profile_id = request.form.get('tuning_profile_id') or None # Optional
+        try:
+            ssh_port = int(request.form.get('ssh_port', '22'))
+        except ValueError:
+            flash(_('SSH Port must be a number.'), 'error')
+            return redirect(url_for('servers.add_server'))
+
+        if not all([server_name, ip_address, ssh_username, ssh_password or ssh_key_path]): # ssh_port has a default
+            flash(_('All fields (Server Name, IP, Username, Password or SSH key) are required!'), 'error')
+            return redirect(url_for('servers.add_server'))
+        if ssh_key_path and not os.path.isfile(ssh_key_path):
+            flash(_("SSH key file '%(path)s' does not exist on this host.", path=ssh_key_path), 'error')
+            return redirect(url_for('servers.add_server'))
+        
+        # Check for duplicate server name or IP
+        existing_server_name = models.Servers.query.filter_by(name=server_name).first()
+        if existing_server_name:
+            flash(_("Server name '%(server_name)s' already exists.", server_name=server_name), 'error')
+            return redirect(url_for('servers.add_server'))
+        
+        existing_server_ip = models.Servers.query.filter_by(ip_address=ip_address).first()
+        if existing_server_ip:
+            flash(_("IP address '%(ip_address)s' already exists for server '%(server_name)s'.", ip_address=ip_address, server_name=existing_server_ip.name), 'error')
+            return redirect(url_for('servers.add_server'))
+
+        if tuning_profile_id:
+            try:
+                tuning_profile = db.session.get(models.TuningProfiles, int(tuning_profile_id))
+            except ValueError: # Not a number, so not the ID of any profile
+                tuning_profile = None
+            if tuning_profile is None:
+                flash(_("Selected tuning profile (ID: %(profile_id)s) does not exist.", profile_id=tuning_profile_id), 'error')
+                # Re-rendered rather than redirected, so the form keeps what was entered
+                return render_template('add_server.html', tuning_profiles=tuning_profiles_for_dropdown())
+            tuning_profile_id = tuning_profile.id
+
+        # The SSH test can take up to its full timeout, so it runs as a background job
+        job_id = submit_job('add_server', _add_server_job, server_name, ip_address, ssh_username, ssh_password, ssh_port,
+                            tuning_profile_id, ssh_key_path)
+        return redirect(url_for('jobs.job_status_page', job_id=job_id))
+
+    return render_template('add_server.html', tuning_profiles=tuning_profiles_for_dropdown())
+
+
+def _add_server_job(job_id, server_name, ip_address, ssh_username, ssh_password, ssh_port, tuning_profile_id=None,
+                    ssh_key_path=None):
+    """Background job: tests the SSH connection and saves the server if it succeeds."""
+    update_job_progress(job_id, 10, f"Testing SSH connection to {ip_address}:{ssh_port}")
+
+    # Test SSH connection
+    # We use the raw password for the test; with an SSH key the password isn't used at all
+    if ssh_key_path:
+        ssh_password = None
+    conn_test_success, conn_test_msg = test_ssh_connection(ip_address, ssh_port, ssh_username, ssh_password,
+                                                           key_filename=ssh_key_path)
+
+    if not conn_test_success:
+        # Do not save if SSH connection test fails
+        return False, {'messages': [['error', _("Could not connect to server '%(server_name)s': %(conn_test_msg)s", server_name=server_name, conn_test_msg=conn_test_msg)]]}
+
+    encrypted_password = vault.encrypt(ssh_password) or '' # Nothing to store with an SSH key
+
+    new_server = models.Servers(
+        name=server_name,
+        ip_address=ip_address,
+        ssh_username=ssh_username,
+        ssh_password=encrypted_password,
+        ssh_key_path=ssh_key_path,
+        ssh_port=ssh_port,
+        tuning_profile_id=tuning_profile_id,
+        connection_status='Connected'
+    )
+    try:
+        db.session.add(new_server)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return False, {'messages': [['error', _("Error saving server to database: %(error)s", error=str(e))]]}
+    return True, {'messages': [['success', _("Server '%(server_name)s' added successfully and connection verified!", server_name=server_name)]],
+                  'server_id': new_server.id}
+
+
+@bp.route('/list_servers')
+def list_servers():
+    try:
+        page = list_servers_page(request.args)
+    except ValueError as e:
+        flash(_('Invalid list filter: %(error)s', error=str(e)), 'error')
+        return redirect(url_for('servers.list_servers'))
+    first_url, next_url = page_urls('servers.list_servers', page)
+    return render_template('list_servers.html', servers=page['items'], filters=request.args,
+                           sorts=SERVER_SORTS, first_url=first_url, next_url=next_url)
+
+
+@bp.route('/api/servers')
+def api_servers():
+    return list_page_response(list_servers_page)
+
+
+def load_port_index(server):
+    """
+    Returns a PortIndex of the listen ports in use on one server: its SSH port, the listen
+    ports of transits entering at it and, with GOST_B_SIDE_CONFIGS, the connect ports its
+    relay listeners serve as a Server B node or a relay hop.
+    """
+    port_index = PortIndex.from_rows(db.session.query(
+        models.Transits.server_a_id, models.Transits.server_a_listen_port
+    ).filter(models.Transits.server_a_id == server.id))
+    port_index.add(server.id, server.ssh_port)
+    if current_app.config['GOST_B_SIDE_CONFIGS']:
+        relay_protocols = list(RELAY_CHAIN_PROTOCOLS)
+        for (port,) in db.session.query(models.Transits.server_b_connect_port).filter(
+                models.Transits.server_b_id == server.id,
+                models.Transits.encryption_protocol.in_(relay_protocols)):
+            port_index.add(server.id, port)
+        for (port,) in db.session.query(models.TransitBNodes.connect_port).join(models.Transits).filter(
+                models.TransitBNodes.server_id == server.id,
+                models.Transits.encryption_protocol.in_(relay_protocols)):
+            port_index.add(server.id, port)
+        for (port,) in db.session.query(models.TransitHops.connect_port).join(models.Transits).filter(
+                models.TransitHops.server_id == server.id,
+                models.Transits.encryption_protocol.in_(relay_protocols)):
+            port_index.add(server.id, port)
+    return port_index
+
+
+@bp.route('/api/servers/<int:server_id>/free_ports')
+def api_free_ports(server_id):
+    """
+    Returns the lowest free listen ports of a Server A. ?count= (default 1, at most 1000) and
+    ?range=START-END (default PORT_ALLOCATION_RANGE) narrow it down. The ports are not reserved.
+    """
+    server = db.session.get(models.Servers, server_id)
+    if server is None:
+        return jsonify({'error': f"Server {server_id} does not exist."}), 404
+    try:
+        start, end = parse_port_range(request.args.get('range') or current_app.config['PORT_ALLOCATION_RANGE'])
+        count = int(request.args.get('count', '1'))
+        if not 1 <= count <= 1000:
+            raise ValueError("'count' must be between 1 and 1000.")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    port_index = load_port_index(server)
+    ports = []
+    for _i in range(count):
+        port = port_index.allocate(server.id, start, end)
+        if port is None:
+            break
+        ports.append(port)
+    return jsonify({'server_id': server.id, 'ports': ports})
+
+
+def tuning_profiles_for_dropdown():
+    return models.TuningProfiles.query.order_by(models.TuningProfiles.name).all()
+
+
+@bp.route('/tuning_profiles', methods=['GET', 'POST'])
+def tuning_profiles():
+    """Lists the GOST tuning profiles and adds new ones."""
+    if request.method == 'POST':
+        profile_name = request.form.get('profile_name')
+        if not profile_name:
+            flash(_('Profile name is required!'), 'error')
+            return render_template('tuning_profiles.html', profiles=tuning_profiles_for_dropdown(), current_data=request.form)
+        if models.TuningProfiles.query.filter_by(name=profile_name).first():
+            flash(_("Tuning profile '%(profile_name)s' already exists.", profile_name=profile_name), 'error')
+            return render_template('tuning_profiles.html', profiles=tuning_profiles_for_dropdown(), current_data=request.form)
+
+        # Retries may be 0; timeouts and intervals are optional and at least 1 second
+        numbers = {}
+        number_fields = {
+            'retries': (_("Retries"), 0),
+            'timeout': (_("Timeout"), 1),
+            'ttl': (_("UDP Session TTL"), 1),
+            'ping': (_("Heartbeat Interval"), 1),
+        }
+        for field, (label, minimum) in number_fields.items():
+            value = request.form.get(field)
+            if not value:
+                numbers[field] = 0 if field == 'retries' else None
+                continue
+            try:
+                numbers[field] = int(value)
+            except ValueError:
+                numbers[field] = None
+            if numbers[field] is None or not minimum <= numbers[field] <= 86400:
+                flash(_("%(field)s must be a number between %(minimum)s and 86400.", field=label, minimum=minimum), 'error')
+                return render_template('tuning_profiles.html', profiles=tuning_profiles_for_dropdown(), current_data=request.form)
+
+        node_options = (request.form.get('node_options') or '').strip() or None
+        try:
+            parse_node_options(node_options)
+        except ValueError as e:
+            flash(_("Invalid node options: %(error)s", error=str(e)), 'error')
+            return render_template('tuning_profiles.html', profiles=tuning_profiles_for_dropdown(), current_data=request.form)
+
+        new_profile = models.TuningProfiles(
+            name=profile_name,
+            debug=bool(request.form.get('debug')),
+            keepalive=bool(request.form.get('keepalive')),
+            multiplex=bool(request.form.get('multiplex')),
+            node_options=node_options,
+            **numbers
+        )
+        try:
+            db.session.add(new_profile)
+            db.session.commit()
+            flash(_("Tuning profile '%(profile_name)s' added successfully.", profile_name=profile_name), 'success')
+            return redirect(url_for('servers.tuning_profiles'))
+        except Exception as e:
+            db.session.rollback()
+            flash(_("Error saving tuning profile to database: %(error)s", error=str(e)), 'error')
+            return render_template('tuning_profiles.html', profiles=tuning_profiles_for_dropdown(), current_data=request.form)
+
+    return render_template('tuning_profiles.html', profiles=tuning_profiles_for_dropdown(), current_data=None)
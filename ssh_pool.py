@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class SSHConnectionPool:
+    """
+    A thread-safe cache of authenticated SSH connections keyed by (ip, port, username).
+
+    Reusing a connection skips the TCP handshake, key exchange and authentication that
+    every new paramiko.SSHClient has to go through. Idle connections are kept alive with
+    SSH keepalives, closed after `idle_timeout` seconds, and health-checked before reuse.
+    At most `max_per_host` connections to the same key are open at the same time.
+    """
+
+    def __init__(self, max_per_host=2, idle_timeout=300, keepalive_interval=30):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self._lock = threading.Lock()
+        self._idle = {} # key -> list of (client, last_used)
+        self._slots = {} # key -> BoundedSemaphore limiting open connections per key
+
+    @contextmanager
+    def connection(self, ip, port, username, password, timeout=10, reuse=True, key_filename=None):
+        """
+        Yields an authenticated paramiko.SSHClient for the given server.
+
+        If the block raises, the connection is assumed to be broken and closed instead of
+        being returned to the pool. Connection errors are raised exactly like
+        paramiko.SSHClient.connect() raises them.
+
+        Args:
+            timeout: Seconds to wait for a free slot and for each connect step.
+            reuse: If False, a fresh connection is always opened (e.g. to verify new
+                   credentials); it is still returned to the pool afterwards.
+            key_filename: Private key file to authenticate with instead of the password.
+        """
+        import paramiko # Loaded on the first connection, not when the app starts
+
+        key = (ip, int(port), username)
+        with self._lock:
+            slots = self._slots.setdefault(key, threading.BoundedSemaphore(self.max_per_host))
+        if not slots.acquire(timeout=timeout):
+            raise paramiko.SSHException(f"Timed out waiting for a free SSH connection slot to {ip}:{port}.")
+
+        client = None
+        try:
+            if reuse:
+                client = self._take_idle(key)
+            if client is None:
+                client = self._connect(ip, int(port), username, password, timeout, key_filename)
+            try:
+                yield client
+            except BaseException:
+                client.close()
+                client = None
+                raise
+            self._put_idle(key, client)
+            client = None
+        finally:
+            if client is not None:
+                client.close()
+            slots.release()
+
+    def _connect(self, ip, port, username, password, timeout, key_filename=None):
+        import paramiko
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy()) # Automatically add host keys
+        try:
+            client.connect(ip, port=port, username=username, password=password, key_filename=key_filename,
+                           timeout=timeout, banner_timeout=timeout, auth_timeout=timeout)
+        except BaseException:
+            client.close()
+            raise
+        if self.keepalive_interval:
+            client.get_transport().set_keepalive(self.keepalive_interval)
+        return client
+
+    def _take_idle(self, key):
+        """Pops the most recently used healthy idle connection for key, closing broken ones."""
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    return None
+                client, last_used = idle.pop()
+            if time.monotonic() - last_used < self.idle_timeout and self._is_healthy(client):
+                return client
+            client.close()
+
+    def _put_idle(self, key, client):
+        with self._lock:
+            self._idle.setdefault(key, []).append((client, time.monotonic()))
+        self.evict_idle()
+
+    @staticmethod
+    def _is_healthy(client):
+        """Checks that the transport is still up by sending an SSH ignore message."""
+        import paramiko
+
+        transport = client.get_transport()
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        try:
+            transport.send_ignore()
+        except (paramiko.SSHException, OSError, EOFError):
+            return False
+        return True
+
+    def evict_idle(self):
+        """Closes every idle connection that has not been used for idle_timeout seconds."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, idle in self._idle.items():
+                keep = []
+                for client, last_used in idle:
+                    if now - last_used >= self.idle_timeout:
+                        expired.append(client)
+                    else:
+                        keep.append((client, last_used))
+                self._idle[key] = keep
+        for client in expired:
+            client.close()
+
+    def close_all(self):
+        """Closes every idle connection. Connections that are in use are closed on release."""
+        with self._lock:
+            idle_clients = [client for idle in self._idle.values() for client, _ in idle]
+            self._idle = {}
+        for client in idle_clients:
+            client.close()
+
+
+# Shared by deploys, connection tests and status checks so they all reuse the same sessions
+ssh_pool = SSHConnectionPool(
+    max_per_host=int(os.environ.get('SSH_POOL_MAX_PER_HOST', '2')),
+    idle_timeout=float(os.environ.get('SSH_POOL_IDLE_TIMEOUT', '300')),
+    keepalive_interval=int(os.environ.get('SSH_POOL_KEEPALIVE_INTERVAL', '30')),
+)
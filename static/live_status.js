@@ -0,0 +1,114 @@
+// Patches status tables in place from the live status stream (Server-Sent Events, see live_status.py).
+// Rows have the ID "transit-<id>" or "server-<id>"; cells and spans to update have a data-field
+// attribute, and data-status-class if their CSS class follows the value (status-<value>).
+// options come from live_status_client(): without a stream_url the page polls poll_url instead.
+function startLiveStatus(options, jobsContainerId) {
+    const runningJobs = {};
+
+    function formatValue(field, value) {
+        if (value === null || value === undefined) {
+            return 'N/A';
+        }
+        if (field.startsWith('latency_')) {
+            return Number(value).toFixed(1);
+        }
+        if (field.endsWith('_at')) {
+            return String(value).replace('T', ' ').slice(0, 19); // Like strftime('%Y-%m-%d %H:%M:%S')
+        }
+        return String(value);
+    }
+
+    function patchRow(prefix, row) {
+        const tableRow = document.getElementById(prefix + row.id);
+        if (!tableRow) {
+            return; // Not on this page
+        }
+        Object.keys(row).forEach(function(field) {
+            tableRow.querySelectorAll('[data-field="' + field + '"]').forEach(function(cell) {
+                cell.textContent = formatValue(field, row[field]);
+                if (cell.hasAttribute('data-status-class')) {
+                    cell.className = 'status-' + (row[field] ? String(row[field]).toLowerCase() : 'unknown');
+                }
+            });
+        });
+    }
+
+    function showJobs() {
+        const container = jobsContainerId && document.getElementById(jobsContainerId);
+        if (!container) {
+            return;
+        }
+        container.textContent = '';
+        Object.keys(runningJobs).forEach(function(id) {
+            const job = runningJobs[id];
+            const line = document.createElement('p');
+            const status = document.createElement('span');
+            status.className = 'status-' + job.status;
+            status.textContent = job.status + ' ' + job.progress + '%';
+            line.appendChild(document.createTextNode(job.job_type + ' #' + job.id + ': '));
+            line.appendChild(status);
+            if (job.message) {
+                line.appendChild(document.createTextNode(' ' + job.message));
+            }
+            container.appendChild(line);
+        });
+    }
+
+    function updateJobs(jobs) {
+        jobs.forEach(function(job) {
+            if (job.status === 'queued' || job.status === 'running') {
+                runningJobs[job.id] = job;
+            } else {
+                delete runningJobs[job.id];
+            }
+        });
+        showJobs();
+    }
+
+    // Revalidates the status snapshot with its ETag; a 304 comes back as the cached response
+    function poll(lastEtag) {
+        fetch(options.poll_url, {cache: 'no-cache', headers: {'Accept': 'application/json'}})
+            .then(function(response) {
+                const etag = response.headers.get('ETag');
+                if (!response.ok || etag === lastEtag) {
+                    return lastEtag;
+                }
+                return response.json().then(function(snapshot) {
+                    snapshot.transits.forEach(function(row) { patchRow('transit-', row); });
+                    snapshot.servers.forEach(function(row) { patchRow('server-', row); });
+                    return etag;
+                });
+            })
+            .catch(function() { return lastEtag; }) // Tried again on the next poll
+            .then(function(etag) {
+                setTimeout(function() { poll(etag); }, options.poll_interval_ms);
+            });
+    }
+
+    if (!options.stream_url || !window.EventSource) {
+        if (window.fetch) {
+            setTimeout(function() { poll(null); }, options.poll_interval_ms);
+        }
+        return; // Without either the page still works, it just doesn't update by itself
+    }
+
+    // Each stream is short; the browser reconnects with the ID of the last event it got
+    const source = new EventSource(options.stream_url);
+    source.addEventListener('transits', function(event) {
+        JSON.parse(event.data).forEach(function(row) { patchRow('transit-', row); });
+    });
+    source.addEventListener('servers', function(event) {
+        JSON.parse(event.data).forEach(function(row) { patchRow('server-', row); });
+    });
+    source.addEventListener('jobs', function(event) {
+        updateJobs(JSON.parse(event.data));
+    });
+    // Sent instead of the missed changes when they can't be replayed
+    source.addEventListener('sync', function(event) {
+        const state = JSON.parse(event.data);
+        state.transits.forEach(function(row) { patchRow('transit-', row); });
+        state.servers.forEach(function(row) { patchRow('server-', row); });
+        Object.keys(runningJobs).forEach(function(id) { delete runningJobs[id]; });
+        updateJobs(state.jobs);
+    });
+}
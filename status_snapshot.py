@@ -0,0 +1,123 @@
+import hashlib
+import itertools
+import json
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from extensions import db
+import models
+
+SERVER_FIELDS = ('id', 'name', 'ip_address', 'ssh_port', 'connection_status', 'status_checked_at',
+                 'status_changed_at', 'tuning_profile_id', 'created_at', 'updated_at')
+TRANSIT_FIELDS = ('id', 'name', 'server_a_id', 'server_a_listen_port', 'server_b_id',
+                  'server_b_connect_port', 'encryption_protocol', 'destination_ip', 'destination_port',
+                  'status', 'latency_ms', 'latency_p50_ms', 'latency_p95_ms', 'latency_checked_at',
+                  'tuning_profile_id', 'created_at', 'updated_at')
+_WATCHED_MODELS = (models.Servers, models.Transits)
+
+_build_lock = threading.Lock() # Only one request rebuilds the snapshot at a time
+_version_lock = threading.Lock()
+_version = 0 # Bumped whenever a commit touched servers or transits
+_cached = None
+
+
+def json_default(value):
+    # Timestamps are the only non-JSON values in the snapshot
+    return value.isoformat()
+
+
+def build_status_snapshot():
+    """
+    Loads every server and transit with one query each and returns them as plain dictionaries.
+
+    Transits carry server_a/server_b as {'id', 'name'} dictionaries, so templates written
+    for the ORM objects render the snapshot unchanged. The snapshot also holds its JSON
+    encoding (`json`) and an ETag derived from it (`etag`). Must run in an app context.
+    """
+    server_columns = [getattr(models.Servers, field) for field in SERVER_FIELDS]
+    servers = [dict(zip(SERVER_FIELDS, row))
+               for row in db.session.query(*server_columns).order_by(models.Servers.name)]
+    servers_by_id = {server['id']: {'id': server['id'], 'name': server['name']} for server in servers}
+
+    transit_columns = [getattr(models.Transits, field) for field in TRANSIT_FIELDS]
+    transits = []
+    for row in db.session.query(*transit_columns).order_by(models.Transits.name):
+        transit = dict(zip(TRANSIT_FIELDS, row))
+        transit['server_a'] = servers_by_id.get(transit['server_a_id'])
+        transit['server_b'] = servers_by_id.get(transit['server_b_id'])
+        transits.append(transit)
+
+    body = json.dumps({'servers': servers, 'transits': transits}, default=json_default,
+                      separators=(',', ':')).encode()
+    return {
+        'servers': servers,
+        'transits': transits,
+        'json': body,
+        'etag': hashlib.sha256(body).hexdigest(),
+    }
+
+
+def get_status_snapshot():
+    """
+    Returns the cached status snapshot, rebuilding it if a commit touched servers or
+    transits since it was built, or if it is older than STATUS_SNAPSHOT_TTL seconds.
+
+    Commits in this process invalidate the snapshot right away. The TTL only bounds how
+    long changes written by other processes (e.g. `flask probe-latency`) take to show up.
+    """
+    global _cached
+    with _build_lock:
+        cached = _cached
+        if (cached is not None and cached['version'] == _version
+                and time.monotonic() - cached['built_at'] < current_app.config['STATUS_SNAPSHOT_TTL']):
+            return cached
+        # Read the version before building: a commit during the build then forces the next rebuild
+        version = _version
+        snapshot = build_status_snapshot()
+        snapshot['version'] = version
+        snapshot['built_at'] = time.monotonic()
+        _cached = snapshot
+        return snapshot
+
+
+def invalidate_status_snapshot():
+    """Marks the cached status snapshot as stale."""
+    global _version
+    with _version_lock:
+        _version += 1
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_flushed_changes(session, flush_context):
+    # new/dirty/deleted still show the pre-flush state here
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, _WATCHED_MODELS):
+            session.info['status_snapshot_stale'] = True
+            return
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _note_bulk_changes(orm_execute_state):
+    # Bulk insert()/update()/delete() statements bypass the flush
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, _WATCHED_MODELS):
+        orm_execute_state.session.info['status_snapshot_stale'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    # Invalidating only once the data is committed keeps a concurrent rebuild from
+    # caching the old rows for the new version
+    if session.info.pop('status_snapshot_stale', False):
+        invalidate_status_snapshot()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_changes(session):
+    session.info.pop('status_snapshot_stale', None)
@@ -0,0 +1,62 @@
+from flask import Blueprint, current_app, render_template, request, jsonify
+
+import app_metrics
+from live_status import feed, live_status_client, parse_id_list
+from status_snapshot import get_status_snapshot
+
+# The status pages and the Prometheus metrics endpoint
+bp = Blueprint('status', __name__)
+
+
+@bp.route('/metrics')
+def metrics():
+    """
+    Prometheus metrics (request latencies, SSH tests, systemctl, config generation, applies) of
+    this process, or of every process with PROMETHEUS_MULTIPROC_DIR (see app_metrics.py).
+    """
+    return current_app.response_class(app_metrics.render(), content_type=app_metrics.CONTENT_TYPE)
+
+
+@bp.route('/status')
+def status_page():
+    snapshot = get_status_snapshot()
+    from metrics_collector import top_transits_by_traffic # Not loaded by web workers that never show it
+    top_transits = top_transits_by_traffic(current_app.config['METRICS_TOP_N'], current_app.config['METRICS_TOP_WINDOW'])
+    return render_template('status_display.html', servers=snapshot['servers'], transits=snapshot['transits'],
+                           top_transits=top_transits, top_window_minutes=current_app.config['METRICS_TOP_WINDOW'] // 60,
+                           live_status=live_status_client())
+
+
+@bp.route('/api/status')
+def api_status():
+    snapshot = get_status_snapshot()
+    response = current_app.response_class(snapshot['json'], mimetype='application/json')
+    response.set_etag(snapshot['etag'])
+    response.cache_control.no_cache = True # Clients may cache it but have to revalidate every time
+    # Turns the response into a 304 if the client's If-None-Match still matches
+    return response.make_conditional(request)
+
+
+@bp.route('/api/status/stream')
+def status_stream():
+    """
+    Server-Sent Events with the status and latency changes of transits and servers and the
+    progress of running jobs (see live_status.py). ?transit_ids= and ?server_ids= limit the
+    rows to comma-separated IDs (empty: none), ?since= is the event ID the page was rendered at.
+    """
+    try:
+        transit_ids = parse_id_list(request.args.get('transit_ids'))
+        server_ids = parse_id_list(request.args.get('server_ids'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # The browser sends the ID of the last event it got when it reconnects. IDs from another
+    # process or an earlier run (see ChangeBus) get a full sync instead.
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    feed.start()
+    # Not stream_with_context(): the stream needs neither the request nor a database session
+    response = current_app.response_class(
+        feed.stream(since, transit_ids, server_ids, max_seconds=current_app.config['LIVE_STATUS_STREAM_SECONDS']),
+        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Keeps nginx from buffering the events
+    return response
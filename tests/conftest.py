@@ -0,0 +1,41 @@
+import os
+import sys
+import threading
+from http.server import HTTPServer
+
+import pytest
+
+# The app's modules live in the repository root, which is not a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def serve_http():
+    """Starts an HTTPServer with the given handler class on localhost and returns its base URL."""
+    servers = []
+
+    def serve(handler_class):
+        server = HTTPServer(('127.0.0.1', 0), handler_class)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on a fresh SQLite database in a temporary directory, with an app context pushed."""
+    from app import create_app, init_db
+
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'GOST_CONFIG_DIR': str(tmp_path / 'gost_configs'),
+    }, instance_path=str(tmp_path / 'instance'))
+    init_db(app)
+    with app.app_context():
+        yield app
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_metrics_endpoint_exports_request_metrics(app):
+    client = app.test_client()
+    client.get('/api/status')
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=')
+    body = response.get_data(as_text=True)
+    assert 'easygost_http_request_duration_seconds_count{method="GET",route="/api/status",status="200"}' in body
+    assert 'easygost_db_queries_total ' in body
+    # Only the app's own registry, not prometheus_client's default process collectors
+    assert 'process_cpu_seconds_total' not in body
+
+
+def _run_with_multiproc_dir(multiproc_dir, code):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(multiproc_dir))
+    return subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT, env=env, check=True,
+                          capture_output=True, text=True).stdout
+
+
+def test_multiprocess_mode_merges_every_process(tmp_path):
+    for result in ('applied', 'applied', 'reload_failed'):
+        _run_with_multiproc_dir(tmp_path, f"import app_metrics; app_metrics.apply_shards.labels(result={result!r}).inc()")
+
+    body = _run_with_multiproc_dir(tmp_path, "import app_metrics; print(app_metrics.render().decode())")
+
+    assert 'easygost_apply_shards_total{result="applied"} 2.0' in body
+    assert 'easygost_apply_shards_total{result="reload_failed"} 1.0' in body
@@ -0,0 +1,85 @@
+import pytest
+
+from extensions import db
+import models
+from bulk_io import import_records, parse_records
+
+
+@pytest.fixture
+def servers(app):
+    """Servers 'a' (SSH on 22) and 'b', and a relay transit from a:8080 to b:9090."""
+    db.session.add_all([
+        models.Servers(id=1, name='a', ip_address='10.0.0.1', ssh_username='root', ssh_password=''),
+        models.Servers(id=2, name='b', ip_address='10.0.0.2', ssh_username='root', ssh_password=''),
+        models.Transits(name='existing', server_a_id=1, server_a_listen_port=8080, server_b_id=2,
+                        server_b_connect_port=9090, encryption_protocol='ws', destination_ip='1.1.1.1',
+                        destination_port=80),
+    ])
+    db.session.commit()
+
+
+def _transit(name, **fields):
+    return {'name': name, 'server_a': 'a', 'server_b': 'b', 'server_b_connect_port': 9100,
+            'encryption_protocol': 'tcp', 'destination_ip': '1.1.1.1', 'destination_port': 443, **fields}
+
+
+def test_invalid_server_records_are_reported_per_row_and_block_the_import(app):
+    records = parse_records("name,ip_address,ssh_port,ssh_username,ssh_password\n"
+                            "ok,10.0.0.9,22,root,pw\n"
+                            "bad,not-an-ip,70000,root,pw\n"
+                            ",10.0.0.9,,,\n", 'csv')
+
+    report = import_records('servers', records)
+
+    assert (report['total'], report['valid'], report['inserted']) == (3, 1, 0)
+    assert report['errors'] == [
+        {'row': 2, 'name': 'bad', 'errors': ["'ssh_port' must be between 1 and 65535.",
+                                             "'not-an-ip' is not a valid IP address."]},
+        {'row': 3, 'name': None, 'errors': ["'name' is required.", "'ssh_username' is required.",
+                                            "'ssh_password' is required.", "IP address '10.0.0.9' already exists."]},
+    ]
+    assert models.Servers.query.count() == 0
+
+    report = import_records('servers', records, skip_invalid=True)
+
+    assert report['inserted'] == 1
+    assert models.Servers.query.filter_by(name='ok').one().connection_status == 'pending'
+
+
+def test_port_conflicts_with_the_database_and_within_the_import(servers):
+    records = [
+        _transit('taken', server_a_listen_port=8080),
+        _transit('ssh', server_a_listen_port=22),
+        _transit('first', server_a_listen_port=8081),
+        _transit('second', server_a_listen_port=8081),
+        _transit('relay', server_a_listen_port=8082, server_b_connect_port=9090, encryption_protocol='ws'),
+        _transit('same', server_a_listen_port=8083, server_b='a'),
+        _transit('unknown', server_a_listen_port=8084, server_b='c', encryption_protocol='quic'),
+    ]
+
+    report = import_records('transits', records, dry_run=True)
+
+    assert report['inserted'] == 0
+    assert [(error['name'], error['errors']) for error in report['errors']] == [
+        ('taken', ["Port 8080 is already in use on Server A."]),
+        ('ssh', ["Port 22 is already in use on Server A."]),
+        ('second', ["Port 8081 is already in use on Server A."]),
+        ('relay', ["Port 9090 is already in use on Server B."]),
+        ('same', ["Server A and Server B cannot be the same server."]),
+        ('unknown', ["Server 'c' ('server_b') does not exist.",
+                     "Unsupported protocol 'quic'. Choose one of: ws, wss, relay+tls, tcp, udp."]),
+    ]
+    assert report['valid'] == 1
+
+
+def test_missing_listen_ports_are_allocated_after_the_explicit_ones(servers, app):
+    app.config['PORT_ALLOCATION_RANGE'] = '8080-8082'
+
+    report = import_records('transits', [_transit('auto1'), _transit('fixed', server_a_listen_port=8081),
+                                         _transit('auto2')], skip_invalid=True)
+
+    assert report['allocated_ports'] == [{'row': 1, 'name': 'auto1', 'port': 8082}]
+    assert report['errors'] == [{'row': 3, 'name': 'auto2', 'errors': ["No free port left on Server A in 8080-8082."]}]
+    assert report['inserted'] == 2
+    ports = dict(db.session.query(models.Transits.name, models.Transits.server_a_listen_port))
+    assert (ports['auto1'], ports['fixed']) == (8082, 8081)
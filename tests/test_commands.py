@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+
+import bulk_io
+import commands
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Like commands._STARTUP_PROBE, but with the database and instance folder under tmp_path
+_CREATE_APP = '''
+import json, sys
+from app import create_app, init_db
+app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + sys.argv[1] + '/probe.db'}, instance_path=sys.argv[1])
+'''
+_PROBE = _CREATE_APP + '''
+for path in ('/', '/list_servers', '/list_transits'):
+    assert app.test_client().get(path).status_code == 200, path
+print(json.dumps(sorted(sys.modules)))
+'''
+
+
+def _run(code, tmp_path):
+    return subprocess.run([sys.executable, '-c', code, str(tmp_path)], cwd=REPO_ROOT, check=True,
+                          capture_output=True, text=True)
+
+
+def test_web_worker_does_not_load_the_cli_only_modules(tmp_path):
+    # The database is migrated beforehand, as `flask db-upgrade` would
+    _run(_CREATE_APP + 'init_db(app)', tmp_path)
+
+    result = _run(_PROBE, tmp_path)
+
+    modules = json.loads(result.stdout.strip().splitlines()[-1])
+    assert [name for name in commands.STARTUP_UNLOADED_MODULES if name in modules] == []
+
+
+def test_bulk_option_choices_match_bulk_io():
+    assert commands.BULK_KINDS == bulk_io.KINDS
+    assert commands.BULK_FORMATS == bulk_io.FORMATS
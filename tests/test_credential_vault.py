@@ -0,0 +1,38 @@
+from datetime import datetime
+
+from cryptography.fernet import Fernet
+
+from extensions import db
+import models
+from credential_vault import rotate_server_passwords, vault
+
+EDITED_AT = datetime(2024, 1, 1, 12, 0)
+
+
+def test_rotation_re_encrypts_with_the_active_key_and_keeps_updated_at(app):
+    old_key, new_key, lost_key = (Fernet.generate_key().decode() for _ in range(3))
+    vault.configure([('old', old_key)])
+    passwords = {1: vault.encrypt('pw1'), 2: vault.encrypt('pw2'),
+                 3: Fernet(old_key).encrypt(b'pw3').decode(), # Written before key IDs existed
+                 4: 'lost:' + Fernet(lost_key).encrypt(b'pw4').decode()}
+    vault.configure([('new', new_key), ('old', old_key)])
+    passwords[5] = vault.encrypt('pw5') # Already on the active key
+    db.session.add_all([
+        models.Servers(id=server_id, name=f"s{server_id}", ip_address=f"10.0.0.{server_id}", ssh_username='root',
+                       ssh_password=ciphertext, updated_at=EDITED_AT)
+        for server_id, ciphertext in passwords.items()
+    ])
+    db.session.commit()
+
+    assert rotate_server_passwords(batch_size=2) == (3, [4])
+
+    db.session.expire_all()
+    servers = {server.id: server for server in models.Servers.query}
+    assert {server_id: vault.key_id_of(server.ssh_password) for server_id, server in servers.items()} == {
+        1: 'new', 2: 'new', 3: 'new', 4: 'lost', 5: 'new'}
+    assert servers[5].ssh_password == passwords[5]
+    assert [vault.decrypt(servers[server_id].ssh_password) for server_id in (1, 2, 3, 5)] == ['pw1', 'pw2', 'pw3', 'pw5']
+    assert {server.updated_at for server in servers.values()} == {EDITED_AT}
+
+    # Nothing is left to rotate, the unreadable password still fails
+    assert rotate_server_passwords() == (0, [4])
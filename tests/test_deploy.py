@@ -0,0 +1,298 @@
+import os
+import socket
+import threading
+import time
+from functools import partial
+
+import paramiko
+import pytest
+
+from credential_vault import vault
+from deploy import run_in_parallel, upload_gost_config
+from gost_apply import _reload_gost_shard
+from ssh_pool import ssh_pool
+
+USERNAME = 'root'
+PASSWORD = 'secret'
+
+
+class StubServer(paramiko.ServerInterface):
+    """Accepts one password and runs exec requests through the owning StubSSHHost."""
+
+    def __init__(self, host):
+        self.host = host
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (USERNAME, PASSWORD):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        command = command.decode()
+        self.host.commands.append(command)
+        exit_status, stderr, delay = self.host.command_results.get(command, (0, '', 0))
+
+        def run():
+            # Give the server time to acknowledge the exec request before the channel closes
+            time.sleep(0.1 + delay)
+            if channel.closed:
+                return
+            if stderr:
+                channel.sendall_stderr(stderr.encode())
+            channel.send_exit_status(exit_status)
+            channel.close()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+
+class StubSFTPServer(paramiko.SFTPServerInterface):
+    """Maps remote absolute paths onto a local root directory."""
+
+    def __init__(self, server, *args, root, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+
+    def _local(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self._local(path), flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        handle = paramiko.SFTPHandle(flags)
+        handle.readfile = handle.writefile = os.fdopen(fd, 'r+b' if flags & os.O_RDWR else ('wb' if flags & os.O_WRONLY else 'rb'))
+        return handle
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self._local(oldpath), self._local(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class StubSSHHost:
+    """An SSH/SFTP server on localhost whose files live under root and whose commands are recorded."""
+
+    def __init__(self, host_key, root, silent=False):
+        self.host_key = host_key
+        self.root = root
+        self.silent = silent # Accept TCP connections but never speak SSH
+        self.commands = []
+        self.command_results = {} # command -> (exit status, stderr, delay in seconds)
+        self._sock = socket.socket()
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(16)
+        self.port = self._sock.getsockname()[1]
+        self._connections = []
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            self._connections.append(conn)
+            if self.silent:
+                continue
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, StubSFTPServer, root=self.root)
+            self._connections.append(transport)
+            try:
+                transport.start_server(server=StubServer(self))
+            except (paramiko.SSHException, EOFError, OSError):
+                pass
+
+    def close(self):
+        self._sock.close()
+        for connection in self._connections:
+            connection.close()
+
+
+@pytest.fixture(scope='module')
+def host_key():
+    return paramiko.RSAKey.generate(2048)
+
+
+@pytest.fixture
+def ssh_hosts(host_key, tmp_path):
+    """Starts stub SSH hosts on demand; ssh_hosts(silent=False) returns a new StubSSHHost."""
+    hosts = []
+
+    def start(silent=False):
+        root = tmp_path / f"host{len(hosts)}"
+        (root / 'etc').mkdir(parents=True)
+        host = StubSSHHost(host_key, str(root), silent=silent)
+        hosts.append(host)
+        return host
+
+    yield start
+    ssh_pool.close_all()
+    for host in hosts:
+        host.close()
+
+
+@pytest.fixture
+def local_config(tmp_path):
+    path = tmp_path / 'gost.json'
+    path.write_text('{"ServeNodes": ["tcp://:8080"]}')
+    return str(path)
+
+
+def _upload(host, local_config, password=PASSWORD, reload_command=None, timeout=5):
+    return upload_gost_config('127.0.0.1', host.port, USERNAME, password, local_config,
+                              '/etc/gost/config.json', reload_command=reload_command, timeout=timeout)
+
+
+def _remote_file(host, path):
+    with open(os.path.join(host.root, path.lstrip('/'))) as remote_file:
+        return remote_file.read()
+
+
+def test_upload_renames_into_place_and_runs_the_reload_command(ssh_hosts, local_config):
+    host = ssh_hosts()
+
+    success, message = _upload(host, local_config, reload_command='systemctl restart gost')
+
+    assert success, message
+    assert _remote_file(host, '/etc/gost/config.json') == '{"ServeNodes": ["tcp://:8080"]}'
+    assert not os.path.exists(os.path.join(host.root, 'etc/gost/config.json.tmp'))
+    assert host.commands == ['systemctl restart gost']
+    assert message == "Uploaded config to 127.0.0.1:/etc/gost/config.json and ran 'systemctl restart gost'."
+
+
+def test_upload_without_reload_command_runs_nothing(ssh_hosts, local_config):
+    host = ssh_hosts()
+
+    assert _upload(host, local_config) == (True, "Uploaded config to 127.0.0.1:/etc/gost/config.json.")
+    assert host.commands == []
+
+
+def test_failing_reload_command_reports_its_exit_status_and_stderr(ssh_hosts, local_config):
+    host = ssh_hosts()
+    host.command_results['systemctl restart gost'] = (3, 'gost.service not found\n', 0)
+
+    success, message = _upload(host, local_config, reload_command='systemctl restart gost')
+
+    assert not success
+    assert message == "Reload command 'systemctl restart gost' failed on 127.0.0.1 (exit 3): gost.service not found"
+
+
+def test_reload_command_that_hangs_times_out(ssh_hosts, local_config):
+    host = ssh_hosts()
+    host.command_results['systemctl restart gost'] = (0, '', 30)
+
+    start = time.monotonic()
+    success, message = _upload(host, local_config, reload_command='systemctl restart gost', timeout=1)
+
+    assert not success
+    assert message == "Reload command 'systemctl restart gost' timed out on 127.0.0.1."
+    assert time.monotonic() - start < 5
+
+
+def test_host_that_never_answers_times_out(ssh_hosts, local_config):
+    host = ssh_hosts(silent=True)
+
+    start = time.monotonic()
+    success, message = _upload(host, local_config, timeout=1)
+
+    assert not success
+    assert message.startswith('SSH error:')
+    assert time.monotonic() - start < 5
+
+
+def test_wrong_password_is_reported(ssh_hosts, local_config):
+    host = ssh_hosts()
+
+    assert _upload(host, local_config, password='wrong') == (
+        False, "Authentication failed (wrong username, password or SSH key).")
+
+
+def test_failing_hosts_do_not_affect_the_others(ssh_hosts, local_config):
+    good, bad_reload, silent, good_too = ssh_hosts(), ssh_hosts(), ssh_hosts(silent=True), ssh_hosts()
+    bad_reload.command_results['reload'] = (1, 'boom', 0)
+    hosts = [good, bad_reload, silent, good_too]
+
+    results = run_in_parallel(lambda host: _upload(host, local_config, reload_command='reload', timeout=2), hosts)
+
+    assert [success for success, _message in results] == [True, False, False, True]
+    assert results[1][1].endswith('(exit 1): boom')
+    for host in (good, good_too):
+        assert _remote_file(host, '/etc/gost/config.json') == '{"ServeNodes": ["tcp://:8080"]}'
+        assert host.commands == ['reload']
+
+
+def test_timeouts_run_concurrently(ssh_hosts, local_config):
+    hosts = [ssh_hosts(silent=True) for _ in range(4)]
+
+    start = time.monotonic()
+    results = run_in_parallel(lambda host: _upload(host, local_config, timeout=1), hosts, max_workers=4)
+
+    assert [success for success, _message in results] == [False] * 4
+    # One timeout for the whole fan-out, not one per host
+    assert time.monotonic() - start < 3
+
+
+def test_run_in_parallel_keeps_order_and_isolates_exceptions():
+    def func(item):
+        if item == 2:
+            raise RuntimeError('host exploded')
+        time.sleep(0.05 * (5 - item))
+        return True, f"done {item}"
+
+    assert run_in_parallel(func, range(5)) == [
+        (True, 'done 0'), (True, 'done 1'), (False, 'An unexpected error occurred: host exploded'),
+        (True, 'done 3'), (True, 'done 4')]
+    assert run_in_parallel(func, []) == []
+
+
+def _remote_plan(server_id, host, config_path):
+    """A changed shard as gost_apply hands it to the reload pool, for a server on the given stub host."""
+    ssh = None if host is None else {'ip_address': '127.0.0.1', 'ssh_port': host.port, 'ssh_username': USERNAME,
+                                     'ssh_password': vault.encrypt(PASSWORD), 'ssh_key_path': None}
+    return {'server_id': server_id, 'server_name': f"relay{server_id}", 'ssh': ssh, 'config_path': config_path,
+            'applied_config': None, 'settings_changed': False, 'diff': {'added': [], 'changed': [], 'removed': []}}
+
+
+def test_apply_deploys_each_shard_to_its_own_server(app, ssh_hosts, tmp_path):
+    app.config.update(GOST_DEPLOY_MODE='ssh', GOST_REMOTE_RELOAD_COMMAND='systemctl restart gost', GOST_DEPLOY_TIMEOUT=5)
+    hosts = [ssh_hosts(), ssh_hosts()]
+    plans = []
+    for server_id, host in enumerate(hosts, start=1):
+        shard = tmp_path / f"server_{server_id}.json"
+        shard.write_text(f'{{"shard": {server_id}}}')
+        plans.append(_remote_plan(server_id, host, str(shard)))
+    plans.append(_remote_plan(3, None, str(tmp_path / 'server_3.json'))) # Deleted since the apply was planned
+
+    results = run_in_parallel(partial(_reload_gost_shard, config=app.config), plans)
+
+    assert [success for success, _message in results] == [True, True, False]
+    assert results[2][1] == "Server 3 no longer exists."
+    for server_id, host in enumerate(hosts, start=1):
+        assert _remote_file(host, '/etc/gost/config.json') == f'{{"shard": {server_id}}}'
+        assert host.commands == ['systemctl restart gost']
@@ -0,0 +1,187 @@
+import json
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+import pytest
+
+from gost_api import apply_route_diff_via_gost_api, assemble_gost_v3_config, route_to_gost_api_objects
+import gost_apply
+
+ROUTES_V1 = {
+    1: {"Retries": 0, "ServeNodes": ["tcp://:8080", "udp://:8080"], "ChainNodes": ["relay+ws://2.2.2.2:9090"]},
+    2: {"Retries": 0, "ServeNodes": ["tcp://:8081/192.168.1.100:443", "udp://:8081/192.168.1.100:443"]},
+}
+ROUTES_V2 = {
+    1: {"Retries": 0, "ServeNodes": ["tcp://:8080", "udp://:8080"], "ChainNodes": ["relay+tls://2.2.2.2:9092"]},
+    3: {"Retries": 3, "ServeNodes": ["tcp://:8082", "udp://:8082"], "ChainNodes": ["relay+wss://2.2.2.2:9091"]},
+}
+
+
+@pytest.fixture
+def fake_api(serve_http):
+    """A fake GOST v3 web API that keeps its objects in memory and records every call."""
+    api = SimpleNamespace(state={'services': {}, 'chains': {}}, calls=[], fail_on=set())
+
+    class FakeGostApiHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, msg="OK"):
+            body = json.dumps({"msg": msg}).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            kind = self.path.strip('/').split('/')[1]
+            obj = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            api.calls.append(('POST', kind, obj['name']))
+            if obj['name'] in api.fail_on:
+                return self._reply(500, "internal error")
+            if obj['name'] in api.state[kind]:
+                return self._reply(400, "object duplicated")
+            if kind == 'services' and obj['handler'].get('chain', '') not in ('', *api.state['chains']):
+                return self._reply(400, "chain not found")
+            api.state[kind][obj['name']] = obj
+            self._reply(200)
+
+        def do_DELETE(self):
+            _, kind, name = self.path.strip('/').split('/')
+            api.calls.append(('DELETE', kind, name))
+            if api.state[kind].pop(name, None) is None:
+                return self._reply(404, "object not found")
+            self._reply(200)
+
+        def log_message(self, format, *args):
+            pass
+
+    api.url = serve_http(FakeGostApiHandler)
+    return api
+
+
+def _apply(api, routes, added=(), changed=(), removed=()):
+    return apply_route_diff_via_gost_api(api.url, routes, {'added': list(added), 'changed': list(changed),
+                                                           'removed': list(removed)})
+
+
+def test_added_transits_are_created_chain_first(fake_api):
+    success, message = _apply(fake_api, ROUTES_V1, added=[1, 2])
+
+    assert success, message
+    assert fake_api.calls == [
+        ('POST', 'chains', 'transit-1-chain'),
+        ('POST', 'services', 'transit-1-tcp'),
+        ('POST', 'services', 'transit-1-udp'),
+        ('POST', 'services', 'transit-2-tcp'),
+        ('POST', 'services', 'transit-2-udp'),
+    ]
+    assert fake_api.state['services']['transit-2-tcp']['forwarder'] == {
+        "nodes": [{"name": "target-0", "addr": "192.168.1.100:443"}]}
+    assert fake_api.state['chains']['transit-1-chain']['hops'][0]['nodes'][0]['addr'] == '2.2.2.2:9090'
+
+
+def test_changed_transits_are_recreated_and_removed_ones_deleted(fake_api):
+    _apply(fake_api, ROUTES_V1, added=[1, 2])
+    fake_api.calls.clear()
+
+    success, message = _apply(fake_api, ROUTES_V2, added=[3], changed=[1], removed=[2])
+
+    assert success, message
+    deletes = [call for call in fake_api.calls if call[0] == 'DELETE']
+    creates = [call for call in fake_api.calls if call[0] == 'POST']
+    # Everything is deleted before anything is created, services before the chain they use
+    assert fake_api.calls == deletes + creates
+    assert [name for _method, _kind, name in deletes] == [
+        'transit-2-tcp', 'transit-2-udp', 'transit-2-relay', 'transit-2-chain',
+        'transit-1-tcp', 'transit-1-udp', 'transit-1-relay', 'transit-1-chain',
+    ]
+    assert creates == [
+        ('POST', 'chains', 'transit-1-chain'),
+        ('POST', 'services', 'transit-1-tcp'),
+        ('POST', 'services', 'transit-1-udp'),
+        ('POST', 'chains', 'transit-3-chain'),
+        ('POST', 'services', 'transit-3-tcp'),
+        ('POST', 'services', 'transit-3-udp'),
+    ]
+    assert sorted(fake_api.state['services']) == ['transit-1-tcp', 'transit-1-udp', 'transit-3-tcp', 'transit-3-udp']
+    assert sorted(fake_api.state['chains']) == ['transit-1-chain', 'transit-3-chain']
+    assert fake_api.state['chains']['transit-1-chain']['hops'][0]['nodes'][0]['dialer']['type'] == 'tls'
+    assert fake_api.state['services']['transit-3-tcp']['handler']['retries'] == 3
+
+
+def test_failed_call_stops_the_apply(fake_api):
+    fake_api.fail_on.add('transit-1-udp')
+
+    success, message = _apply(fake_api, ROUTES_V1, added=[1, 2])
+
+    assert not success
+    assert 'services/transit-1-udp' in message and 'HTTP 500' in message
+    assert ('POST', 'services', 'transit-2-tcp') not in fake_api.calls
+
+
+def test_unreachable_api():
+    success, message = apply_route_diff_via_gost_api('http://127.0.0.1:1', ROUTES_V1,
+                                                     {'added': [1], 'changed': [], 'removed': []}, timeout=2)
+
+    assert not success
+    assert 'unreachable' in message
+
+
+def test_v3_config_holds_what_the_api_creates(fake_api):
+    _apply(fake_api, ROUTES_V2, added=[1, 3])
+
+    config = assemble_gost_v3_config(ROUTES_V2, debug=False)
+
+    assert {service['name']: service for service in config['services']} == fake_api.state['services']
+    assert {chain['name']: chain for chain in config['chains']} == fake_api.state['chains']
+    assert config['log'] == {'level': 'info'}
+
+
+def test_b_side_and_hop_routes():
+    services, chains = route_to_gost_api_objects('5-b9090', {"Retries": 0, "ServeNodes": ["relay+wss://:9090/10.0.0.1:80"]})
+    assert chains == []
+    assert services == [{"name": "transit-5-b9090-relay", "addr": ":9090", "handler": {"type": "relay"},
+                         "listener": {"type": "wss"}, "forwarder": {"nodes": [{"name": "target-0", "addr": "10.0.0.1:80"}]}}]
+
+    services, _chains = route_to_gost_api_objects(
+        '5-h9091', {"Retries": 0, "ServeNodes": ["relay+ws://:9091?whitelist=tcp,udp:2.2.2.2:9090"]})
+    # v3 has no whitelist: the hop's port has to be firewalled instead
+    assert 'metadata' not in services[0]['listener']
+
+
+def _reload(api, monkeypatch, applied_config=object(), settings_changed=False):
+    """Runs gost_apply's reload of a local shard on the API backend, recording systemctl restarts."""
+    restarts = []
+    monkeypatch.setattr(gost_apply, 'restart_gost_service', lambda name: restarts.append(name) or (True, 'restarted'))
+    config = {'GOST_SERVICE_TEMPLATE': 'gost-{server_id}.service', 'GOST_RELOAD_BACKEND': 'api',
+              'GOST_DEPLOY_MODE': 'local', 'GOST_VERSION': 'v3', 'GOST_API_URL_TEMPLATE': api.url,
+              'GOST_API_USERNAME': None, 'GOST_API_PASSWORD': None, 'GOST_DEPLOY_TIMEOUT': 2}
+    plan = {'server_id': 7, 'server_name': 'relay', 'ssh': {'ip_address': '127.0.0.1'}, 'routes': ROUTES_V1,
+            'diff': {'added': [1, 2], 'changed': [], 'removed': []}, 'applied_config': applied_config,
+            'settings_changed': settings_changed}
+    return gost_apply._reload_gost_shard(plan, config), restarts
+
+
+def test_reload_goes_through_the_api_without_a_restart(fake_api, monkeypatch):
+    (success, message), restarts = _reload(fake_api, monkeypatch)
+
+    assert success, message
+    assert restarts == []
+    assert sorted(fake_api.state['services']) == ['transit-1-tcp', 'transit-1-udp', 'transit-2-tcp', 'transit-2-udp']
+
+
+def test_failed_api_reload_falls_back_to_a_systemctl_restart(fake_api, monkeypatch):
+    fake_api.fail_on.add('transit-2-tcp')
+
+    (success, message), restarts = _reload(fake_api, monkeypatch)
+
+    assert (success, message) == (True, 'restarted')
+    assert restarts == ['gost-7.service']
+
+
+def test_first_apply_and_settings_changes_restart_without_the_api(fake_api, monkeypatch):
+    for kwargs in ({'applied_config': None}, {'settings_changed': True}):
+        (success, _message), restarts = _reload(fake_api, monkeypatch, **kwargs)
+
+        assert success
+        assert restarts == ['gost-7.service']
+    assert fake_api.calls == []
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from extensions import db
+import models
+from gost_apply import _set_transit_statuses
+
+
+def _add_transits(statuses):
+    db.session.add_all([
+        models.Servers(id=1, name='a', ip_address='10.0.0.1', ssh_username='root', ssh_password=''),
+        models.Servers(id=2, name='b', ip_address='10.0.0.2', ssh_username='root', ssh_password=''),
+    ])
+    db.session.add_all([
+        models.Transits(id=transit_id, name=f"t{transit_id}", server_a_id=1, server_a_listen_port=8000 + transit_id,
+                        server_b_id=2, server_b_connect_port=9000 + transit_id, encryption_protocol='tcp',
+                        destination_ip='1.1.1.1', destination_port=80, status=status,
+                        updated_at=datetime(2024, 1, 1))
+        for transit_id, status in statuses.items()
+    ])
+    db.session.commit()
+
+
+def test_status_updates_share_the_given_timestamp_and_skip_unchanged_rows(app):
+    _add_transits({1: 'pending', 2: 'active', 3: 'pending'})
+    applied_at = datetime(2024, 5, 1, 12, 30, 15, 123456)
+
+    _set_transit_statuses({1, 2}, 'active', applied_at)
+    _set_transit_statuses({3}, 'error', applied_at)
+    db.session.commit()
+    db.session.expire_all()
+
+    rows = {t.id: (t.status, t.updated_at) for t in models.Transits.query}
+    assert rows == {
+        1: ('active', applied_at),
+        2: ('active', datetime(2024, 1, 1)), # Already active, left alone
+        3: ('error', applied_at),
+    }
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+import latency_prober
+import models
+from latency_prober import percentile, probe_transit_latencies
+
+
+@pytest.fixture
+def transit(app, monkeypatch):
+    db.session.add_all([
+        models.Servers(id=1, name='a', ip_address='10.0.0.1', ssh_username='root', ssh_password=''),
+        models.Servers(id=2, name='b', ip_address='10.0.0.2', ssh_username='root', ssh_password=''),
+        models.Transits(id=1, name='t1', server_a_id=1, server_a_listen_port=8080, server_b_id=2,
+                        server_b_connect_port=9090, encryption_protocol='ws', destination_ip='1.1.1.1',
+                        destination_port=80),
+    ])
+    db.session.commit()
+
+    async def fake_probe(targets, **kwargs):
+        return {key: 5.0 for key in targets}
+
+    monkeypatch.setattr(latency_prober, 'probe_tcp_targets', fake_probe)
+
+
+def test_percentiles_use_only_the_last_samples_of_the_window(app, transit):
+    app.config.update(LATENCY_WINDOW_SECONDS=3600, LATENCY_WINDOW_SAMPLES=4)
+    now = datetime.utcnow()
+    db.session.execute(models.TransitLatencySamples.__table__.insert(), [
+        # Older samples in the window that are no longer among the last 4
+        *({'transit_id': 1, 'latency_ms': 900.0, 'measured_at': now - timedelta(minutes=50 - i)} for i in range(10)),
+        {'transit_id': 1, 'latency_ms': 10.0, 'measured_at': now - timedelta(minutes=3)},
+        {'transit_id': 1, 'latency_ms': None, 'measured_at': now - timedelta(minutes=2)}, # Failed, not counted
+        {'transit_id': 1, 'latency_ms': 20.0, 'measured_at': now - timedelta(minutes=1)},
+    ])
+    db.session.commit()
+
+    assert probe_transit_latencies() == 1
+
+    transit = db.session.get(models.Transits, 1)
+    # The last 4 successful samples: 900 (oldest of them), 10, 20 and the new 5
+    assert (transit.latency_ms, transit.latency_p50_ms, transit.latency_p95_ms) == (5.0, 10.0, 900.0)
+
+
+def test_percentile_is_nearest_rank():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile([3, 1, 2, 4], 95) == 4
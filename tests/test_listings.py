@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import pytest
+
+from extensions import db
+import models
+from listings import decode_cursor, encode_cursor, keyset_page, list_servers_page
+
+
+@pytest.fixture
+def servers(app):
+    """Seven servers with many ties on ssh_port and created_at, inserted in a mixed-up order."""
+    ports = {1: 22, 2: 2222, 3: 22, 4: 22, 5: 2200, 6: 2222, 7: 22}
+    db.session.add_all([
+        models.Servers(id=server_id, name=f"s{8 - server_id}", ip_address=f"10.0.0.{server_id}", ssh_port=port,
+                       ssh_username='root', ssh_password='', created_at=datetime(2024, 1, 1 + server_id % 2, 12, 0, 0, 500))
+        for server_id, port in sorted(ports.items(), key=lambda item: item[0] * 3 % 7)
+    ])
+    db.session.commit()
+    return ports
+
+
+def _all_pages(sort, limit):
+    """Follows next_cursor through every page and returns the server IDs in order."""
+    ids, cursor = [], None
+    while True:
+        page = list_servers_page({'sort': sort, 'limit': str(limit), 'cursor': cursor})
+        ids.extend(item['id'] for item in page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return ids
+
+
+def test_cursor_round_trip_keeps_the_value_type():
+    column = models.Servers.created_at
+    moment = datetime(2024, 5, 1, 13, 0, 10, 123456)
+
+    assert decode_cursor(encode_cursor(moment, 7), column) == (moment, 7)
+    assert decode_cursor(encode_cursor('s1', 3), models.Servers.name) == ('s1', 3)
+    assert decode_cursor(encode_cursor(22, 4), models.Servers.ssh_port) == (22, 4)
+    with pytest.raises(ValueError):
+        decode_cursor('not a cursor', column)
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 7])
+def test_pages_break_ties_on_the_id_in_both_directions(servers, limit):
+    by_port = sorted(servers, key=lambda server_id: (servers[server_id], server_id))
+
+    assert _all_pages('ssh_port', limit) == by_port
+    assert _all_pages('-ssh_port', limit) == by_port[::-1]
+    # Four servers share one created_at and three the other
+    by_created = sorted(servers, key=lambda server_id: (server_id % 2, server_id))
+    assert _all_pages('created_at', limit) == by_created
+    assert _all_pages('-created_at', limit) == by_created[::-1]
+
+
+def test_last_page_has_no_cursor(servers):
+    query = db.session.query(models.Servers.id, models.Servers.name)
+
+    rows, cursor = keyset_page(query, models.Servers.name, models.Servers.id, limit=len(servers))
+
+    assert cursor is None
+    assert [row.name for row in rows] == [f"s{n}" for n in range(1, 8)]
@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+
+import pytest
+
+import live_status
+from live_status import ChangeBus, LiveStatusFeed
+
+
+@pytest.fixture
+def feed(app, monkeypatch):
+    """A feed of its own whose detector blocks in its first pass until `release` is set."""
+    feed = LiveStatusFeed(ChangeBus())
+    release = threading.Event()
+    detect = feed._detect
+
+    def blocking_detect(since):
+        release.wait(5)
+        detect(since)
+
+    monkeypatch.setattr(feed, '_detect', blocking_detect)
+    monkeypatch.setattr(live_status, 'feed', feed)
+    feed.release = release
+    yield feed
+    # Lets the detector thread stop
+    feed.idle_timeout = 0
+    release.set()
+    feed.wake()
+
+
+def _live_status_options(html):
+    line = next(line for line in html.splitlines() if 'startLiveStatus(' in line)
+    return json.loads(line.split('startLiveStatus(', 1)[1].rsplit(", 'live-jobs')", 1)[0])
+
+
+def test_unthreaded_server_polls_without_starting_the_detector(app, feed):
+    response = app.test_client().get('/status')
+
+    assert response.status_code == 200
+    assert _live_status_options(response.get_data(as_text=True)) == {
+        'stream_url': None, 'poll_url': '/api/status', 'poll_interval_ms': 2000}
+    assert not feed.running
+
+
+def test_pages_render_before_the_detector_has_loaded_the_rows(app, feed):
+    client = app.test_client()
+
+    started = time.monotonic()
+    status_page = client.get('/status', environ_overrides={'wsgi.multithread': True})
+    transits_page = client.get('/list_transits', environ_overrides={'wsgi.multithread': True})
+
+    assert time.monotonic() - started < 2
+    assert feed.running
+    # No sequence number yet, so the stream starts with a full sync
+    assert _live_status_options(status_page.get_data(as_text=True))['stream_url'] == '/api/status/stream'
+    assert _live_status_options(transits_page.get_data(as_text=True))['stream_url'] == \
+        '/api/status/stream?server_ids=&transit_ids='
+
+    feed.release.set()
+    feed._ready.wait(5)
+    stream_url = _live_status_options(client.get('/status', environ_overrides={'wsgi.multithread': True})
+                                      .get_data(as_text=True))['stream_url']
+    assert stream_url == f"/api/status/stream?since={feed.bus.token}-{feed.bus.seq}"
+
+
+def test_stream_ends_at_the_last_event_id_even_if_filtered_out():
+    feed = LiveStatusFeed(ChangeBus())
+    feed.bus.publish('transits', [{'id': 1, 'status': 'active'}])
+    feed.bus.publish('transits', [{'id': 2, 'status': 'error'}])
+
+    chunks = list(feed.stream(f"{feed.bus.token}-0", transit_ids={1}, max_seconds=0.2))
+
+    token = feed.bus.token
+    assert chunks[:2] == ['retry: 1000\n\n', f'id: {token}-1\nevent: transits\ndata: [{{"id":1,"status":"active"}}]\n\n']
+    assert chunks[-1] == f'id: {token}-2\n\n'
+    assert f'id: {token}-2\nevent' not in ''.join(chunks)
+
+
+def test_resuming_with_an_event_id_from_another_bus_starts_with_a_sync():
+    # Another web worker has published more events than this one, so its ID is a lower number here
+    other_bus = ChangeBus()
+    for status in ('active', 'error', 'active'):
+        other_bus.publish('transits', [{'id': 1, 'status': status}])
+    feed = LiveStatusFeed(ChangeBus())
+    for transit_id in (1, 2, 3, 4, 5):
+        feed.bus.publish('transits', [{'id': transit_id, 'status': 'active'}])
+
+    chunks = list(feed.stream(other_bus.event_id(other_bus.seq), max_seconds=0.2))
+
+    # Not a replay of this bus' events 4 and 5, which would miss 1 to 3
+    assert chunks[1].startswith(f'id: {feed.bus.token}-5\nevent: sync\n')
+    assert 'event: transits' not in ''.join(chunks)
+
+
+def test_event_ids_only_parse_on_their_own_bus():
+    bus = ChangeBus()
+
+    assert bus.parse_event_id(bus.event_id(7)) == 7
+    assert ChangeBus().parse_event_id(bus.event_id(7)) is None
+    assert bus.parse_event_id('7') is None
+    assert bus.parse_event_id(None) is None
+    assert bus.parse_event_id(f"{bus.token}-x") is None
@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from extensions import db
+import metrics_collector
+import models
+from metrics_collector import (RESOLUTIONS, collect_transit_metrics, prune_transit_metrics, top_transits_by_traffic,
+                               transit_metric_series)
+
+START = datetime(2024, 5, 1, 13, 0, 10)
+
+
+@pytest.fixture
+def exporter(serve_http):
+    """A fake GOST v3 exporter per server: {server ID: {(metric, service): value}}, served at /metrics/<ID>."""
+    series = {}
+
+    class FakeExporterHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server_id = int(self.path.rsplit('/', 1)[1])
+            if server_id not in series:
+                self.send_response(503)
+                self.end_headers()
+                return
+            lines = ['# TYPE gost_service_transfer_input_bytes_total counter']
+            lines.extend(f'{metric}{{host="gost",service="{service}"}} {value}'
+                         for (metric, service), value in series[server_id].items())
+            lines.append('gost_services{host="gost"} 4')
+            body = ('\n'.join(lines) + '\n').encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return serve_http(FakeExporterHandler), series
+
+
+@pytest.fixture
+def fleet(app, exporter, monkeypatch):
+    """Two Server A hosts with one transit each (IDs 1 and 2), scraped from the fake exporter at a fake time."""
+    url, series = exporter
+    app.config.update(GOST_VERSION='v3', GOST_METRICS_URL_TEMPLATE=url + '/metrics/{server_id}')
+    db.session.add_all([
+        models.Servers(id=server_id, name=f"server-{server_id}", ip_address=f"10.0.0.{server_id}",
+                       ssh_username='root', ssh_password='')
+        for server_id in (1, 2, 3)
+    ])
+    db.session.add_all([
+        models.Transits(id=1, name='t1', server_a_id=1, server_a_listen_port=8080, server_b_id=3,
+                        server_b_connect_port=9090, encryption_protocol='ws', destination_ip='1.1.1.1', destination_port=80),
+        models.Transits(id=2, name='t2', server_a_id=2, server_a_listen_port=8080, server_b_id=3,
+                        server_b_connect_port=9091, encryption_protocol='tcp', destination_ip='1.1.1.1', destination_port=80),
+    ])
+    db.session.commit()
+    series.update({1: {}, 2: {}, 3: {}})
+
+    class FakeDatetime(datetime):
+        current = START
+
+        @classmethod
+        def utcnow(cls):
+            return cls.current
+
+    monkeypatch.setattr(metrics_collector, 'datetime', FakeDatetime)
+    return series, FakeDatetime
+
+
+def _set(series, server_id, service, bytes_in=0, bytes_out=0, errors=0, connections=0):
+    series.setdefault(server_id, {}).update({
+        ('gost_service_transfer_input_bytes_total', service): bytes_in,
+        ('gost_service_transfer_output_bytes_total', service): bytes_out,
+        ('gost_service_handler_errors_total', service): errors,
+        ('gost_service_requests_in_flight', service): connections,
+    })
+
+
+def _buckets(transit_id, resolution_name):
+    return [(row['bucket_start'], row['bytes_in'], row['bytes_out'], row['errors'], row['connections_max'])
+            for row in transit_metric_series(transit_id, resolution_name)]
+
+
+def test_first_scrape_primes_and_the_next_records_deltas(fleet):
+    series, clock = fleet
+    _set(series, 1, 'transit-1-tcp', bytes_in=1000, bytes_out=5000, errors=1, connections=3)
+    _set(series, 1, 'transit-1-udp', bytes_in=200, bytes_out=300)
+    # The Server B end carries the same traffic again and must not count
+    _set(series, 3, 'transit-1-b9090-relay', bytes_in=99999, bytes_out=99999)
+
+    assert collect_transit_metrics() == (2, 0, [])
+    assert models.ServiceMetricCursors.query.count() == 2
+
+    _set(series, 1, 'transit-1-tcp', bytes_in=1500, bytes_out=7000, errors=3, connections=4)
+    _set(series, 1, 'transit-1-udp', bytes_in=260, bytes_out=340, connections=1)
+    clock.current = START + timedelta(seconds=60)
+
+    assert collect_transit_metrics() == (2, 1, [])
+    assert _buckets(1, '1m') == [(datetime(2024, 5, 1, 13, 1), 560, 2040, 2, 5)]
+
+
+def test_reset_of_one_service_is_not_hidden_by_the_other(fleet):
+    series, clock = fleet
+    _set(series, 1, 'transit-1-tcp', bytes_in=1000)
+    _set(series, 1, 'transit-1-udp', bytes_in=800)
+    collect_transit_metrics()
+
+    # The UDP counter was reset and counted up to 100 again, the TCP one grew by 4000. Their
+    # sum (5100) is above the previous sum (1800), which used to hide the reset.
+    _set(series, 1, 'transit-1-tcp', bytes_in=5000)
+    _set(series, 1, 'transit-1-udp', bytes_in=100)
+    clock.current = START + timedelta(seconds=60)
+    collect_transit_metrics()
+
+    assert _buckets(1, '1m')[0][1] == 4100
+
+
+def test_scrapes_roll_up_into_every_resolution(fleet):
+    series, clock = fleet
+    totals = 0
+    _set(series, 2, 'transit-2-tcp', bytes_in=totals)
+    collect_transit_metrics()
+    # Three more scrapes: two in the same minute, one in the next minute, all in one hour and day
+    for offset, grown in ((20, 100), (40, 250), (75, 1000)):
+        totals += grown
+        _set(series, 2, 'transit-2-tcp', bytes_in=totals, connections=grown)
+        clock.current = START + timedelta(seconds=offset)
+        collect_transit_metrics()
+
+    assert [(start, bytes_in) for start, bytes_in, *_rest in _buckets(2, '1m')] == [
+        (datetime(2024, 5, 1, 13, 0), 350), (datetime(2024, 5, 1, 13, 1), 1000)]
+    assert _buckets(2, '1h') == [(datetime(2024, 5, 1, 13, 0), 1350, 0, 0, 1000)]
+    assert _buckets(2, '1d') == [(datetime(2024, 5, 1), 1350, 0, 0, 1000)]
+    hourly = models.TransitMetrics.query.filter_by(transit_id=2, resolution=RESOLUTIONS['1h']).one()
+    assert (hourly.samples, hourly.connections_sum) == (3, 1350)
+
+
+def test_unreachable_exporter_is_reported_without_losing_the_others(fleet):
+    series, clock = fleet
+    _set(series, 1, 'transit-1-tcp', bytes_in=10)
+    collect_transit_metrics()
+    _set(series, 1, 'transit-1-tcp', bytes_in=30)
+    del series[2]
+    clock.current = START + timedelta(seconds=60)
+
+    server_count, transit_count, errors = collect_transit_metrics()
+
+    assert (server_count, transit_count) == (2, 1)
+    assert len(errors) == 1 and errors[0].startswith("Server 'server-2'") and 'HTTP 503' in errors[0]
+    assert _buckets(1, '1m')[0][1] == 20
+
+
+def test_gost_v2_has_no_exporter(fleet, app):
+    app.config['GOST_VERSION'] = 'v2'
+
+    assert collect_transit_metrics() == (0, 0, ["GOST v2 has no metrics exporter. Traffic metrics need GOST_VERSION=v3."])
+
+
+def _scrape_twice(series, clock, traffic):
+    """Primes the cursors, then records {transit ID: bytes in} one minute later."""
+    for transit_id in traffic:
+        _set(series, transit_id, f"transit-{transit_id}-tcp")
+    collect_transit_metrics()
+    for transit_id, bytes_in in traffic.items():
+        _set(series, transit_id, f"transit-{transit_id}-tcp", bytes_in=bytes_in, connections=transit_id)
+    clock.current = START + timedelta(seconds=60)
+    collect_transit_metrics()
+
+
+def test_top_transits_are_the_busiest_first(fleet, monkeypatch):
+    series, clock = fleet
+    monkeypatch.setattr(metrics_collector, '_top_cache', {})
+    _scrape_twice(series, clock, {1: 300, 2: 5000})
+
+    top = top_transits_by_traffic(limit=10, window_seconds=3600)
+
+    assert [(entry['transit_id'], entry['name'], entry['bytes_in']) for entry in top] == [(2, 't2', 5000), (1, 't1', 300)]
+    assert top_transits_by_traffic(limit=1, window_seconds=3600)[0]['transit_id'] == 2
+    # Outside the window there is nothing to list
+    monkeypatch.setattr(metrics_collector, '_top_cache', {})
+    clock.current = START + timedelta(hours=3)
+    assert top_transits_by_traffic(limit=10, window_seconds=3600) == []
+
+
+def test_pruning_keeps_each_resolution_for_its_own_retention(fleet, app):
+    series, clock = fleet
+    _scrape_twice(series, clock, {1: 300})
+    app.config.update(METRICS_RETENTION_1M=3600, METRICS_RETENTION_1H=86400, METRICS_RETENTION_1D=30 * 86400)
+
+    assert prune_transit_metrics(now=START + timedelta(hours=2)) == 1
+    assert (_buckets(1, '1m'), len(_buckets(1, '1h')), len(_buckets(1, '1d'))) == ([], 1, 1)
+    assert prune_transit_metrics(now=START + timedelta(days=2)) == 1
+    assert (_buckets(1, '1h'), len(_buckets(1, '1d'))) == ([], 1)
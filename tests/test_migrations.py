@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from migrations import Operations, _0010_sort_indexes
+
+
+def _legacy_database(path):
+    """servers and transits as created before created_at was NOT NULL and sortable, with a few rows."""
+    engine = sa.create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        for statement in (
+            "CREATE TABLE servers (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL UNIQUE, "
+            "ssh_port INTEGER NOT NULL DEFAULT 22, created_at DATETIME, updated_at DATETIME)",
+            "CREATE TABLE transits (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, "
+            "server_a_id INTEGER NOT NULL REFERENCES servers (id), server_a_listen_port INTEGER NOT NULL, "
+            "created_at DATETIME, updated_at DATETIME)",
+            "CREATE UNIQUE INDEX uq_transits_server_a_listen_port ON transits (server_a_id, server_a_listen_port)",
+            "INSERT INTO servers VALUES (1, 'a', 22, '2024-01-01 00:00:00.000000', '2024-01-02 00:00:00.000000')",
+            "INSERT INTO servers VALUES (2, 'b', 22, NULL, '2024-02-01 00:00:00.000000')",
+            "INSERT INTO transits VALUES (1, 't1', 1, 8080, NULL, NULL)",
+        ):
+            connection.execute(sa.text(statement))
+    return engine
+
+
+def test_created_at_becomes_not_null_with_nulls_backfilled(tmp_path):
+    engine = _legacy_database(tmp_path / 'legacy.db')
+
+    with engine.begin() as connection:
+        _0010_sort_indexes(Operations(connection))
+    with engine.begin() as connection: # Running it again changes nothing
+        _0010_sort_indexes(Operations(connection))
+
+    inspector = sa.inspect(engine)
+    for table_name in ('servers', 'transits'):
+        columns = {column['name']: column for column in inspector.get_columns(table_name)}
+        assert not columns['created_at']['nullable']
+    assert {index['name'] for index in inspector.get_indexes('transits')} == {
+        'ix_transits_created_at', 'ix_transits_server_a_listen_port', 'uq_transits_server_a_listen_port'}
+    assert {index['name'] for index in inspector.get_indexes('servers')} == {
+        'ix_servers_created_at', 'ix_servers_ssh_port'}
+    assert inspector.get_foreign_keys('transits')[0]['referred_table'] == 'servers'
+
+    with engine.connect() as connection:
+        servers = connection.execute(sa.text("SELECT id, name, created_at FROM servers ORDER BY id")).all()
+        transit_created_at = connection.execute(sa.text("SELECT created_at FROM transits")).scalar_one()
+        assert [tuple(row) for row in servers] == [
+            (1, 'a', '2024-01-01 00:00:00.000000'), (2, 'b', '2024-02-01 00:00:00.000000')]
+        assert datetime.fromisoformat(transit_created_at) <= datetime.utcnow()
+        # Still enforced after the rebuild
+        try:
+            connection.execute(sa.text("INSERT INTO servers (id, name) VALUES (3, 'c')"))
+        except sa.exc.IntegrityError:
+            pass
+        else:
+            raise AssertionError('created_at accepted NULL')
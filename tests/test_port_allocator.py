@@ -0,0 +1,48 @@
+import pytest
+
+from port_allocator import PORT_MAX, PORT_MIN, PortIndex, parse_port_range
+
+
+def test_allocation_covers_the_ends_of_the_port_space():
+    index = PortIndex()
+
+    assert index.allocate(1) == PORT_MIN
+    assert index.allocate(1, PORT_MAX, PORT_MAX) == PORT_MAX
+    assert index.allocate(1, PORT_MAX, PORT_MAX) is None
+    # Port 0 shares the first bitmap byte with port 1 but is never handed out
+    assert index.allocate(2, PORT_MIN, 7) == 1
+    assert not index.is_used(2, 0)
+
+
+def test_allocation_stays_inside_a_range_within_one_byte():
+    index = PortIndex.from_rows([(1, 8), (1, 13)])
+
+    # 8-15 is one bitmap byte; the free ports 9-12 and 14-15 lie around the taken ones
+    assert [index.allocate(1, 13, 14) for _ in range(2)] == [14, None]
+    assert [index.allocate(1, 10, 11) for _ in range(3)] == [10, 11, None]
+    assert index.allocate(1, 8, 15) == 9
+
+
+def test_full_bytes_are_skipped_up_to_the_end_of_the_range():
+    index = PortIndex.from_rows((1, port) for port in range(16000, 16100))
+
+    # The range starts in a full byte and ends in the middle of another one
+    assert index.allocate(1, 16003, 16100) == 16100
+    assert index.allocate(1, 16003, 16100) is None
+    index.discard(1, 16050)
+    assert index.allocate(1, 16003, 16100) == 16050
+    # A discarded port on another server changes nothing
+    index.discard(2, 16051)
+    assert index.allocate(1, 16051, 16051) is None
+
+
+def test_invalid_ranges_are_rejected():
+    index = PortIndex()
+
+    for start, end in ((0, 10), (10, 9), (1, PORT_MAX + 1)):
+        with pytest.raises(ValueError):
+            index.allocate(1, start, end)
+    assert parse_port_range('10000-60000') == (10000, 60000)
+    for value in ('10000', '60000-10000', '1-65536', 'a-b', None):
+        with pytest.raises(ValueError):
+            parse_port_range(value)
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+
+from extensions import db
+import models
+from route_optimizer import RouteGraph, apply_route_changes
+
+DESTINATION = ('203.0.113.5', 443)
+
+
+def _graph(links, exits):
+    """A graph from (source, target, cost) server links, used in both directions, and {Server B: exit cost}."""
+    graph = RouteGraph(destination_links={DESTINATION: exits})
+    for source_id, target_id, cost in links:
+        graph.server_links.setdefault(source_id, {})[target_id] = cost
+        graph.server_links.setdefault(target_id, {})[source_id] = cost
+    return graph
+
+
+def test_paths_are_limited_to_max_hops():
+    # 1 -> 2 -> 3 -> 4 is cheap but takes two relay hops, 1 -> 4 is direct
+    graph = _graph([(1, 2, 1), (2, 3, 1), (3, 4, 1), (1, 4, 100)], {4: 5})
+
+    assert graph.shortest_paths(1, max_hops=0)[4] == (100, (4,))
+    assert graph.shortest_paths(1, max_hops=1)[4] == (100, (4,))
+    assert graph.shortest_paths(1, max_hops=2)[4] == (3, (2, 3, 4))
+    assert graph.best_chain(1, *DESTINATION, max_hops=0) == (105, [4])
+    assert graph.best_chain(1, *DESTINATION, max_hops=2) == (8, [2, 3, 4])
+
+
+def test_server_reached_again_at_a_shallower_depth_is_expanded_from_there():
+    # 3 is cheapest over 2, but at that depth it has no hop left to reach 4. Over the
+    # direct link it is more expensive and one hop shallower, which is the only way to 4.
+    graph = _graph([(1, 2, 1), (2, 3, 1), (1, 3, 10), (3, 4, 1)], {4: 5})
+
+    tree = graph.shortest_paths(1, max_hops=1)
+
+    assert tree[3] == (2, (2, 3))
+    assert tree[4] == (11, (3, 4))
+    assert graph.best_chain(1, *DESTINATION, max_hops=1) == (16, [3, 4])
+
+
+def test_load_uses_links_both_ways_and_skips_old_and_unhealthy_ones(app):
+    db.session.add_all([
+        models.Servers(id=server_id, name=f"s{server_id}", ip_address=f"10.0.0.{server_id}", ssh_username='root',
+                       ssh_password='', connection_status='Error' if server_id == 4 else 'Connected')
+        for server_id in (1, 2, 3, 4)
+    ])
+    old = datetime.utcnow() - timedelta(seconds=app.config['ROUTE_LINK_MAX_AGE'] + 60)
+    db.session.add_all([
+        models.RouteLinks(source_server_id=1, target_server_id=2, latency_ms=10, loss=0.01),
+        models.RouteLinks(source_server_id=2, target_server_id=3, latency_ms=5, loss=0, measured_at=old),
+        models.RouteLinks(source_server_id=1, target_server_id=4, latency_ms=1, loss=0),
+        models.RouteLinks(source_server_id=2, destination_ip=DESTINATION[0], destination_port=DESTINATION[1],
+                          latency_ms=20, loss=0),
+    ])
+    db.session.commit()
+
+    graph = RouteGraph.load()
+
+    assert graph.server_links == {1: {2: 20.0}, 2: {1: 20.0}}
+    assert graph.destination_links == {DESTINATION: {2: 20.0}}
+
+
+def _fleet(transits):
+    """Servers 1-5 and the given relay transits as (ID, Server A, listen port, Server B, connect port)."""
+    db.session.add_all([
+        models.Servers(id=server_id, name=f"s{server_id}", ip_address=f"10.0.0.{server_id}", ssh_username='root',
+                       ssh_password='')
+        for server_id in (1, 2, 3, 4, 5)
+    ])
+    db.session.add_all([
+        models.Transits(id=transit_id, name=f"t{transit_id}", server_a_id=server_a_id,
+                        server_a_listen_port=listen_port, server_b_id=server_b_id,
+                        server_b_connect_port=connect_port, encryption_protocol='ws',
+                        destination_ip=DESTINATION[0], destination_port=DESTINATION[1], status='active')
+        for transit_id, server_a_id, listen_port, server_b_id, connect_port in transits
+    ])
+    db.session.commit()
+
+
+def test_moved_transit_gets_free_ports_on_its_new_chain(app):
+    app.config['PORT_ALLOCATION_RANGE'] = '9000-9010'
+    # Transit 2 listens on 9000 on server 3, the new Server B of transit 1
+    _fleet([(1, 1, 8080, 2, 9000), (2, 3, 9000, 5, 9000)])
+    transit = db.session.get(models.Transits, 1)
+
+    applied, errors = apply_route_changes([{'transit': transit, 'chain': [4, 3]}])
+
+    assert (len(applied), errors) == (1, [])
+    transit = db.session.get(models.Transits, 1)
+    assert (transit.server_b_id, transit.server_b_connect_port, transit.status) == (3, 9001, 'pending')
+    assert [(hop.position, hop.server_id, hop.connect_port) for hop in transit.hops] == [(0, 4, 9000)]
+
+    # Moved back to a direct chain, Server B keeps its connect port since it is free there
+    applied, errors = apply_route_changes([{'transit': transit, 'chain': [2]}])
+
+    assert (len(applied), errors) == (1, [])
+    transit = db.session.get(models.Transits, 1)
+    assert (transit.server_b_id, transit.server_b_connect_port, transit.hops) == (2, 9001, [])
+
+
+def test_transit_without_free_ports_is_left_alone_and_its_ports_released(app):
+    app.config['PORT_ALLOCATION_RANGE'] = '9000-9000'
+    _fleet([(1, 1, 8080, 2, 9000), (2, 3, 9000, 5, 9000), (3, 1, 8081, 5, 9001)])
+    transits = [db.session.get(models.Transits, transit_id) for transit_id in (1, 3)]
+
+    # Transit 1's connect port 9000 is taken on server 3, its new Server B, and the range has no
+    # other. The hop port it got on server 4 before that failed is released, so transit 3 gets it.
+    applied, errors = apply_route_changes([{'transit': transits[0], 'chain': [4, 3]},
+                                           {'transit': transits[1], 'chain': [4, 5]}])
+
+    assert [change['transit'].id for change in applied] == [3]
+    assert errors == ["Transit 't1': no free port left in 9000-9000 on a server of its new chain."]
+    db.session.expire_all()
+    unchanged = db.session.get(models.Transits, 1)
+    assert (unchanged.server_b_id, unchanged.server_b_connect_port, unchanged.status, unchanged.hops) == (
+        2, 9000, 'active', [])
+    moved = db.session.get(models.Transits, 3)
+    assert [(hop.server_id, hop.connect_port) for hop in moved.hops] == [(4, 9000)]
+    # Outside the allocation range, Server B kept its own port
+    assert (moved.server_b_id, moved.server_b_connect_port) == (5, 9001)
@@ -0,0 +1,17 @@
+import pytest
+
+import models
+
+
+@pytest.mark.parametrize('tuning_profile_id', ['fast', '42'])
+def test_add_server_with_an_unknown_tuning_profile_re_renders_the_form(app, tuning_profile_id):
+    response = app.test_client().post('/add_server', data={
+        'server_name': 'edge-1', 'ip_address': '10.0.0.1', 'ssh_username': 'root', 'ssh_password': 'secret',
+        'ssh_port': '22', 'tuning_profile_id': tuning_profile_id,
+    })
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert f"Selected tuning profile (ID: {tuning_profile_id}) does not exist." in html
+    assert 'value="edge-1"' in html
+    assert models.Jobs.query.count() == 0
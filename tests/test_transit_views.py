@@ -0,0 +1,64 @@
+import pytest
+
+from extensions import db
+import models
+
+
+@pytest.fixture
+def servers(app):
+    db.session.add_all([
+        models.Servers(id=1, name='a', ip_address='10.0.0.1', ssh_username='root', ssh_password=''),
+        models.Servers(id=2, name='b', ip_address='10.0.0.2', ssh_username='root', ssh_password=''),
+    ])
+    db.session.commit()
+
+
+def _transit_form(**fields):
+    form = {
+        'transit_name': 'web', 'server_a_id': '1', 'server_a_listen_port': '8080', 'server_b_id': '2',
+        'server_b_connect_port': '9090', 'encryption_protocol': 'ws', 'destination_ip': '1.1.1.1',
+        'destination_port': '80',
+    }
+    form.update(fields)
+    return form
+
+
+@pytest.mark.parametrize('tuning_profile_id', ['fast', '42'])
+def test_add_transit_with_an_unknown_tuning_profile_re_renders_the_form(app, servers, tuning_profile_id):
+    response = app.test_client().post('/add_transit', data=_transit_form(tuning_profile_id=tuning_profile_id))
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert f"Selected tuning profile (ID: {tuning_profile_id}) does not exist." in html
+    assert 'value="web"' in html
+    assert models.Transits.query.count() == 0
+
+
+@pytest.mark.parametrize('fields, error', [
+    ({'destination_ip': ''}, 'All fields are required!'),
+    ({'server_b_id': '1'}, 'Server A and Server B cannot be the same server.'),
+    ({'server_a_listen_port': 'http'}, 'All port numbers must be valid integers.'),
+    ({'destination_port': '70000'}, 'Destination Port must be between 1 and 65535.'),
+    ({'server_a_id': '9'}, 'Selected Server A (ID: 9) does not exist.'),
+    ({'lb_strategy': 'hash'}, "Unknown load balancing strategy &#39;hash&#39;."),
+    ({'server_b_weight': '0'}, 'Server B weights must be between 1 and 100.'),
+    ({'encryption_protocol': 'tcp', 'b_node_server_id': '2', 'b_node_port': '9091', 'b_node_weight': '1'},
+     'Direct TCP/UDP forwards do not go through Server B and cannot have additional Server B nodes.'),
+    ({'server_a_listen_port': '22'}, 'Port 22 is already in use on Server A (a).'),
+])
+def test_add_transit_reports_the_first_invalid_field(app, servers, fields, error):
+    response = app.test_client().post('/add_transit', data=_transit_form(**fields))
+
+    assert response.status_code == 200
+    assert error in response.get_data(as_text=True)
+    assert models.Transits.query.count() == 0
+
+
+def test_add_transit_saves_a_valid_transit(app, servers):
+    response = app.test_client().post('/add_transit', data=_transit_form(server_b_weight='3', lb_strategy='fifo'))
+
+    assert response.status_code == 302
+    transit = models.Transits.query.one()
+    assert (transit.name, transit.server_a_id, transit.server_a_listen_port, transit.server_b_id,
+            transit.server_b_connect_port, transit.server_b_weight, transit.lb_strategy, transit.status) == \
+        ('web', 1, 8080, 2, 9090, 3, 'fifo', 'pending')
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from tunnel_benchmark import find_gost_binary
+
+
+def _fake_gost(directory, version_line):
+    """An executable named gost whose -V prints version_line."""
+    path = directory / 'gost'
+    path.write_text(f"#!/bin/sh\necho '{version_line}'\n")
+    path.chmod(0o755)
+    return str(path)
+
+
+def test_gost_v2_is_used(tmp_path):
+    gost = _fake_gost(tmp_path, 'gost 2.11.5 (go1.20.4 linux/amd64)')
+
+    assert find_gost_binary(gost) == gost
+
+
+def test_given_gost_that_is_not_v2_is_an_error(tmp_path):
+    gost = _fake_gost(tmp_path, 'gost v3.0.0 (go1.22.2 linux/amd64)')
+
+    with pytest.raises(ValueError, match=r"GOST v2 configs, but .* reports 'gost v3\.0\.0"):
+        find_gost_binary(gost)
+
+
+def test_gost_on_the_path_that_is_not_v2_falls_back_to_the_stand_in(tmp_path, monkeypatch):
+    _fake_gost(tmp_path, 'gost v3.0.0 (go1.22.2 linux/amd64)')
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    assert find_gost_binary() is None
@@ -0,0 +1,300 @@
+import json
+
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash, jsonify
+from flask_babel import gettext as _
+
+from extensions import db
+import models
+from gost_apply import plan_gost_config_apply, apply_gost_config_job
+from gost_config_generator import LB_STRATEGIES, RELAY_CHAIN_PROTOCOLS, route_key_transit_id
+from jobs import submit_job
+from live_status import live_status_client
+from listings import list_transits_page, TRANSIT_SORTS, page_urls, list_page_response
+from port_allocator import parse_port_range
+from server_views import load_port_index, tuning_profiles_for_dropdown
+from status_snapshot import json_default
+
+bp = Blueprint('transits', __name__)
+
+
+def _new_transit_from_form(form):
+    """
+    Validates the add transit form and builds the transit it describes (not yet added to the session).
+
+    Returns (None, result) with result holding the 'transit', plus the optimizer's 'suggestion'
+    and the 'route_graph' it came from (both None if not a relay), or (error_message, None).
+    """
+    # Imported on use, so web workers don't load the optimizer on startup (see commands.py)
+    from route_optimizer import RouteGraph, suggest_route
+
+    transit_name = form.get('transit_name')
+    server_a_id = form.get('server_a_id')
+    server_a_listen_port = form.get('server_a_listen_port')
+    server_b_id = form.get('server_b_id')
+    server_b_connect_port = form.get('server_b_connect_port')
+    encryption_protocol = form.get('encryption_protocol')
+    destination_ip = form.get('destination_ip')
+    destination_port = form.get('destination_port')
+    tuning_profile_id = form.get('tuning_profile_id') or None # Optional, defaults to Server A's profile
+    lb_strategy = form.get('lb_strategy') or LB_STRATEGIES[0]
+    # Let the route optimizer pick Server B and the relay hops from the measured links
+    auto_route = bool(form.get('auto_route'))
+    # Additional Server B nodes: parallel lists, rows without a server are ignored
+    b_node_rows = [row for row in zip(form.getlist('b_node_server_id'),
+                                      form.getlist('b_node_port'),
+                                      form.getlist('b_node_weight')) if row[0]]
+
+    # Basic validation
+    if not all([transit_name, server_a_id, server_a_listen_port, server_b_id or auto_route, server_b_connect_port, encryption_protocol, destination_ip, destination_port]):
+        return _('All fields are required!'), None
+
+    if server_a_id == server_b_id:
+        return _('Server A and Server B cannot be the same server.'), None
+
+    # Validate port numbers
+    try:
+        server_a_listen_port_int = int(server_a_listen_port)
+        server_b_connect_port_int = int(server_b_connect_port)
+        destination_port_int = int(destination_port)
+    except ValueError:
+        return _('All port numbers must be valid integers.'), None
+    ports_to_check = {
+        _("Server A Listen Port"): server_a_listen_port_int,
+        _("Server B Connect Port"): server_b_connect_port_int,
+        _("Destination Port"): destination_port_int
+    }
+    for port_name, port_val in ports_to_check.items():
+        if not (1 <= port_val <= 65535):
+            return _("%(port_name)s must be between 1 and 65535.", port_name=port_name), None
+
+    # Validate Server A and Server B exist
+    server_a = db.session.get(models.Servers, server_a_id)
+    if not server_a:
+        return _("Selected Server A (ID: %(server_id)s) does not exist.", server_id=server_a_id), None
+
+    # The fastest measured chain, to use it or to point it out after saving
+    route_graph = RouteGraph.load() if encryption_protocol in RELAY_CHAIN_PROTOCOLS else None
+    suggestion = suggest_route(server_a.id, destination_ip, destination_port_int, route_graph) if route_graph else None
+    if auto_route:
+        if route_graph is None or b_node_rows:
+            return _('The fastest route can only be picked for relays without additional Server B nodes.'), None
+        if suggestion is None:
+            return _('No route to %(destination)s has been measured yet. Run `flask probe-links` or pick Server B yourself.',
+                     destination=f"{destination_ip}:{destination_port_int}"), None
+        server_b_id = suggestion['server_b_id']
+
+    server_b = db.session.get(models.Servers, server_b_id)
+    if not server_b:
+        return _("Selected Server B (ID: %(server_id)s) does not exist.", server_id=server_b_id), None
+
+    # Check for duplicate transit name
+    if models.Transits.query.filter_by(name=transit_name).first():
+        return _("Transit name '%(transit_name)s' already exists.", transit_name=transit_name), None
+
+    # Validate the Server B node group
+    try:
+        server_b_weight = int(form.get('server_b_weight') or 1)
+        max_fails = int(form['max_fails']) if form.get('max_fails') else None
+        fail_timeout = int(form['fail_timeout']) if form.get('fail_timeout') else None
+        b_nodes = [models.TransitBNodes(server_id=int(b_server_id), connect_port=int(b_port), weight=int(b_weight or 1))
+                   for b_server_id, b_port, b_weight in b_node_rows]
+    except ValueError:
+        return _('Weights, ports and failure settings of the Server B nodes must be valid integers.'), None
+    if lb_strategy not in LB_STRATEGIES:
+        return _("Unknown load balancing strategy '%(strategy)s'.", strategy=lb_strategy), None
+    if not (1 <= server_b_weight <= 100 and all(1 <= b_node.weight <= 100 for b_node in b_nodes)):
+        return _('Server B weights must be between 1 and 100.'), None
+    if (max_fails is not None and max_fails < 1) or (fail_timeout is not None and fail_timeout < 1):
+        return _('Max fails and fail timeout must be at least 1.'), None
+    if b_nodes and encryption_protocol in ('tcp', 'udp'):
+        return _('Direct TCP/UDP forwards do not go through Server B and cannot have additional Server B nodes.'), None
+    group_addresses = {(server_b.id, server_b_connect_port_int)}
+    for b_node in b_nodes:
+        b_server = db.session.get(models.Servers, b_node.server_id)
+        if not b_server or b_server.id == server_a.id:
+            return _("Server B node (ID: %(server_id)s) does not exist or is Server A.", server_id=b_node.server_id), None
+        if not 1 <= b_node.connect_port <= 65535:
+            return _("%(port_name)s must be between 1 and 65535.", port_name=_("Server B Connect Port")), None
+        if (b_node.server_id, b_node.connect_port) in group_addresses:
+            return _("Server B node %(server_name)s:%(port)s is listed twice.", server_name=b_server.name, port=b_node.connect_port), None
+        group_addresses.add((b_node.server_id, b_node.connect_port))
+
+    if tuning_profile_id and not (tuning_profile_id.isdigit()
+                                  and db.session.get(models.TuningProfiles, int(tuning_profile_id))):
+        return _("Selected tuning profile (ID: %(profile_id)s) does not exist.", profile_id=tuning_profile_id), None
+
+    # Check for port conflicts on Server A (other transits and its SSH port)
+    if load_port_index(server_a).is_used(server_a.id, server_a_listen_port_int):
+        return _("Port %(port)s is already in use on Server A (%(server_name)s).", port=server_a_listen_port_int, server_name=server_a.name), None
+    # Relays also listen on each Server B node, so its connect port must be free there
+    if current_app.config['GOST_B_SIDE_CONFIGS'] and encryption_protocol in RELAY_CHAIN_PROTOCOLS:
+        port_indexes = {}
+        for b_server_id, connect_port in sorted(group_addresses):
+            b_server = db.session.get(models.Servers, b_server_id)
+            if b_server_id not in port_indexes:
+                port_indexes[b_server_id] = load_port_index(b_server)
+            if port_indexes[b_server_id].is_used(b_server_id, connect_port):
+                return _("Port %(port)s is already in use on Server B (%(server_name)s).", port=connect_port, server_name=b_server.name), None
+
+    # Relay hops listen on a free port of their server
+    hops = []
+    if auto_route:
+        allocation_start, allocation_end = parse_port_range(current_app.config['PORT_ALLOCATION_RANGE'])
+        for position, hop_server_id in enumerate(suggestion['hop_server_ids']):
+            hop_server = db.session.get(models.Servers, hop_server_id)
+            hop_port = load_port_index(hop_server).allocate(hop_server_id, allocation_start, allocation_end)
+            if hop_port is None:
+                return _("No free port left on relay hop %(server_name)s.", server_name=hop_server.name), None
+            hops.append(models.TransitHops(position=position, server_id=hop_server_id, connect_port=hop_port))
+
+    new_transit = models.Transits(
+        name=transit_name,
+        server_a_id=server_a.id,
+        server_a_listen_port=server_a_listen_port_int,
+        server_b_id=server_b.id,
+        server_b_connect_port=server_b_connect_port_int,
+        server_b_weight=server_b_weight,
+        lb_strategy=lb_strategy,
+        max_fails=max_fails,
+        fail_timeout=fail_timeout,
+        b_nodes=b_nodes,
+        hops=hops,
+        encryption_protocol=encryption_protocol,
+        destination_ip=destination_ip,
+        destination_port=destination_port_int,
+        tuning_profile_id=int(tuning_profile_id) if tuning_profile_id else None,
+        status='pending' # Initial status
+    )
+    return None, {'transit': new_transit, 'suggestion': suggestion, 'route_graph': route_graph}
+
+
+@bp.route('/add_transit', methods=['GET', 'POST'])
+def add_transit():
+    if request.method == 'POST':
+        error_message, result = _new_transit_from_form(request.form)
+        if error_message is None:
+            new_transit = result['transit']
+            try:
+                db.session.add(new_transit)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                error_message = _("Error saving transit configuration to database: %(error)s", error=str(e))
+        if error_message is not None:
+            flash(error_message, 'error')
+            # Re-rendered with the submitted values, so nothing has to be typed again
+            servers_for_dropdown = models.Servers.query.order_by(models.Servers.name).all()
+            return render_template('add_transit.html', servers=servers_for_dropdown, tuning_profiles=tuning_profiles_for_dropdown(), current_data=request.form)
+
+        flash(_("Transit configuration '%(transit_name)s' added successfully with status 'pending'.", transit_name=new_transit.name), 'success')
+        from route_optimizer import is_worth_switching
+        suggestion = result['suggestion']
+        if suggestion is not None:
+            chain = [new_transit.server_a_id] + suggestion['hop_server_ids'] + [suggestion['server_b_id']]
+            chain_names = ' → '.join(db.session.get(models.Servers, server_id).name for server_id in chain)
+            chosen_cost = result['route_graph'].chain_cost(new_transit.server_a_id, [new_transit.server_b_id],
+                                                           new_transit.destination_ip, new_transit.destination_port)
+            if request.form.get('auto_route'):
+                flash(_("Route: %(chain)s (measured %(cost)s ms).", chain=chain_names, cost=suggestion['cost_ms']), 'info')
+            elif not new_transit.b_nodes and chosen_cost is not None and is_worth_switching(chosen_cost, suggestion['cost_ms']):
+                flash(_("The route optimizer measured a faster route: %(chain)s (%(cost)s ms). Run `flask optimize-routes --apply` to use it.",
+                        chain=chain_names, cost=suggestion['cost_ms']), 'info')
+        return redirect(url_for('transits.list_transits')) # Redirect to list view after success
+
+    # GET request
+    servers_for_dropdown = models.Servers.query.order_by(models.Servers.name).all()
+    if not servers_for_dropdown:
+        flash(_('No servers found. Please add at least two servers before creating a transit.'), 'error')
+        # Optionally redirect to add_server page or just show the form disabled/with message
+        # return redirect(url_for('servers.add_server'))
+    # Pass current_data as None for GET requests or if not set by a POST error
+    return render_template('add_transit.html', servers=servers_for_dropdown, tuning_profiles=tuning_profiles_for_dropdown(), current_data=None)
+
+
+@bp.route('/list_transits')
+def list_transits():
+    try:
+        page = list_transits_page(request.args)
+    except ValueError as e:
+        flash(_('Invalid list filter: %(error)s', error=str(e)), 'error')
+        return redirect(url_for('transits.list_transits'))
+    servers_for_filter = db.session.query(models.Servers.id, models.Servers.name).order_by(models.Servers.name).all()
+    first_url, next_url = page_urls('transits.list_transits', page)
+    # Only this page's transits (and no servers) are patched live
+    live_status = live_status_client(server_ids='',
+                                     transit_ids=','.join(str(transit['id']) for transit in page['items']))
+    return render_template('list_transits.html', transits=page['items'], filters=request.args,
+                           sorts=TRANSIT_SORTS, servers=servers_for_filter,
+                           first_url=first_url, next_url=next_url, live_status=live_status)
+
+
+@bp.route('/api/transits')
+def api_transits():
+    return list_page_response(list_transits_page)
+
+
+@bp.route('/api/route_suggestion')
+def api_route_suggestion():
+    """
+    Returns the fastest measured chain from a Server A to a destination, for a new transit.
+    ?server_a_id=, ?destination_ip= and ?destination_port= are required; the suggestion is
+    null if the destination wasn't measured yet (see `flask probe-links`).
+    """
+    try:
+        server_a_id = int(request.args['server_a_id'])
+        destination_ip = request.args['destination_ip']
+        destination_port = int(request.args['destination_port'])
+    except (KeyError, ValueError):
+        return jsonify({'error': "server_a_id, destination_ip and destination_port are required."}), 400
+    if db.session.get(models.Servers, server_a_id) is None:
+        return jsonify({'error': f"Server {server_a_id} does not exist."}), 404
+    from route_optimizer import suggest_route
+    return jsonify({'suggestion': suggest_route(server_a_id, destination_ip, destination_port)})
+
+
+@bp.route('/api/transits/<int:transit_id>/metrics')
+def api_transit_metrics(transit_id):
+    """Returns the stored traffic buckets of a transit. ?resolution= is 1m (default), 1h or 1d."""
+    from metrics_collector import transit_metric_series
+
+    db.get_or_404(models.Transits, transit_id)
+    try:
+        series = transit_metric_series(transit_id, request.args.get('resolution') or '1m')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    body = json.dumps({'transit_id': transit_id, 'points': series}, default=json_default)
+    return current_app.response_class(body, mimetype='application/json')
+
+
+@bp.route('/apply_gost_config', methods=['GET', 'POST'])
+def apply_gost_config():
+    if request.method == 'GET':
+        plans, skipped_transits = plan_gost_config_apply()
+        # Show the route-level diff before anything is written or restarted
+        changed_plans = [plan for plan in plans if plan['changed']]
+        diff_route_keys = set()
+        for plan in changed_plans:
+            for route_keys in plan['diff'].values():
+                diff_route_keys.update(route_keys)
+        route_names = {}
+        if diff_route_keys:
+            transit_names = dict(models.Transits.query.with_entities(
+                models.Transits.id, models.Transits.name
+            ).filter(models.Transits.id.in_({route_key_transit_id(key) for key in diff_route_keys})).all())
+            for route_key in diff_route_keys:
+                transit_name = transit_names.get(route_key_transit_id(route_key))
+                if transit_name is None:
+                    continue
+                # Server A routes are keyed by the plain transit ID
+                if isinstance(route_key, int):
+                    route_names[route_key] = transit_name
+                elif '-h' in route_key: # hop_route_key()
+                    route_names[route_key] = _("%(transit_name)s (relay hop)", transit_name=transit_name)
+                else:
+                    route_names[route_key] = _("%(transit_name)s (Server B end)", transit_name=transit_name)
+        return render_template('apply_gost_config.html', plans=changed_plans, route_names=route_names,
+                               skipped_transits=skipped_transits)
+
+    # Writing and reloading every changed shard can take a while, so it runs as a background job
+    job_id = submit_job('apply_gost_config', apply_gost_config_job)
+    return redirect(url_for('jobs.job_status_page', job_id=job_id))
@@ -0,0 +1,737 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import socket
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from gost_config_generator import DEFAULT_GOST_TUNING, ROUTE_BUILDERS, generate_gost_configs_by_server
+from latency_prober import percentile
+
+# Every Transits.encryption_protocol the generator supports
+BENCHMARK_PROTOCOLS = tuple(ROUTE_BUILDERS)
+
+# Both ends of the benchmarked transit, and the sink it forwards to, run on this host
+_LOCALHOST = '127.0.0.1'
+_SERVER_A_ID, _SERVER_B_ID = 1, 2
+
+# The first byte a client sends the sink selects what it does with the connection:
+# read a length-prefixed payload and answer with the byte count, or echo everything back
+_SINK_COUNT, _SINK_ECHO = b'C', b'E'
+
+_CHUNK_SIZE = 64 * 1024
+_UDP_PAYLOAD_SIZE = 1200
+
+# Seconds a runner (gost or the stand-in) gets to open its listeners, and a single
+# measurement to finish
+_STARTUP_TIMEOUT = 10
+_IO_TIMEOUT = 30
+
+# `gost -V` prints e.g. "gost 2.11.5 (go1.20.4 linux/amd64)", and GOST v3 "gost v3.0.0 (...)"
+_GOST_VERSION_PATTERN = re.compile(r'\bgost v?(\d+)\.\d+')
+
+_WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Benchmark sizes, overridable per run (see run_tunnel_benchmark())
+DEFAULT_PARAMETERS = {
+    'throughput_bytes': 64 * 1024 * 1024, # Sent through the tunnel per throughput measurement
+    'streams': 4, # Parallel connections (or UDP sessions) the throughput is measured over
+    'connections': 500, # New connections (or UDP sessions) opened for the setup rate
+    'concurrency': 20, # Of which at most this many at once
+    'latency_samples': 2000, # Round trips of a small message on one connection
+    'message_size': 64,
+}
+
+
+# --- The sink, run as its own process: python tunnel_benchmark.py --sink PORT ---
+
+async def _handle_sink_connection(reader, writer):
+    try:
+        mode = await reader.readexactly(1)
+        if mode == _SINK_COUNT:
+            remaining = size = struct.unpack('!Q', await reader.readexactly(8))[0]
+            while remaining:
+                data = await reader.read(min(remaining, _CHUNK_SIZE))
+                if not data:
+                    break
+                remaining -= len(data)
+            writer.write(struct.pack('!Q', size - remaining))
+            await writer.drain()
+        else:
+            while data := await reader.read(_CHUNK_SIZE):
+                writer.write(data)
+                await writer.drain()
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+class _UdpEcho(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.transport.sendto(data, addr)
+
+
+async def _serve_sink(port):
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(_UdpEcho, local_addr=(_LOCALHOST, port))
+    server = await asyncio.start_server(_handle_sink_connection, _LOCALHOST, port)
+    async with server:
+        await server.serve_forever()
+
+
+# --- The stand-in for gost: python tunnel_benchmark.py --stand-in CONFIG CERT_DIR ---
+
+class _PlainStream:
+    """A TCP (or TLS) connection as the stand-in pipes it: whole chunks in and out."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def read(self):
+        return await self.reader.read(_CHUNK_SIZE)
+
+    def write(self, data):
+        self.writer.write(data)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+
+def _mask(data, key):
+    repeated_key = (key * (len(data) // 4 + 1))[:len(data)]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(repeated_key, 'big')).to_bytes(len(data), 'big')
+
+
+class _WebSocketStream(_PlainStream):
+    """
+    Binary WebSocket frames (RFC 6455) over a connection, as gost's ws and wss transports
+    send them. The client masks its frames, which is most of the transport's CPU cost.
+    """
+
+    def __init__(self, reader, writer, masked):
+        super().__init__(reader, writer)
+        self.masked = masked
+
+    async def read(self):
+        while True:
+            head = await self.reader.readexactly(2)
+            opcode, length = head[0] & 0x0F, head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+            key = await self.reader.readexactly(4) if head[1] & 0x80 else None
+            payload = await self.reader.readexactly(length)
+            if opcode == 0x8: # Close
+                return b''
+            if opcode in (0x0, 0x1, 0x2) and payload:
+                return _mask(payload, key) if key else payload
+
+    def write(self, data):
+        length = len(data)
+        mask_bit = 0x80 if self.masked else 0
+        if length < 126:
+            head = struct.pack('!BB', 0x82, mask_bit | length)
+        elif length < 0x10000:
+            head = struct.pack('!BBH', 0x82, mask_bit | 126, length)
+        else:
+            head = struct.pack('!BBQ', 0x82, mask_bit | 127, length)
+        if self.masked:
+            key = os.urandom(4)
+            self.writer.write(head + key + _mask(data, key))
+        else:
+            self.writer.write(head + data)
+
+
+def _parse_transport(scheme):
+    """Returns (tls, websocket) for a relay node scheme such as 'relay+wss' or 'relay+mtls'."""
+    transport = scheme.partition('+')[2]
+    if transport not in ('tls', 'ws', 'wss', 'mtls', 'mws', 'mwss'):
+        raise ValueError(f"The stand-in can't emulate '{scheme}'")
+    return transport.endswith(('tls', 'wss')), 'ws' in transport
+
+
+async def _dial(host, port, scheme, client_ssl):
+    tls, websocket = _parse_transport(scheme) if scheme != 'tcp' else (False, False)
+    reader, writer = await asyncio.open_connection(host, port, ssl=client_ssl if tls else None)
+    if not websocket:
+        return _PlainStream(reader, writer)
+    key = base64.b64encode(os.urandom(16))
+    writer.write(b'GET /ws HTTP/1.1\r\nHost: %s:%d\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                 b'Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n' % (host.encode(), port, key))
+    response = await reader.readuntil(b'\r\n\r\n')
+    if not response.startswith(b'HTTP/1.1 101'):
+        writer.close()
+        raise ConnectionError(f"WebSocket handshake with {host}:{port} failed")
+    return _WebSocketStream(reader, writer, masked=True)
+
+
+async def _accept_websocket(reader, writer):
+    request = await reader.readuntil(b'\r\n\r\n')
+    key = next((line.partition(b':')[2].strip() for line in request.split(b'\r\n')
+                if line.lower().startswith(b'sec-websocket-key:')), b'')
+    accept = base64.b64encode(hashlib.sha1(key + _WEBSOCKET_GUID).digest())
+    writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                 b'Sec-WebSocket-Accept: %s\r\n\r\n' % accept)
+    return _WebSocketStream(reader, writer, masked=False)
+
+
+async def _pipe(source, target):
+    try:
+        while data := await source.read():
+            target.write(data)
+            await target.drain()
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        target.close()
+
+
+async def _forward_tcp(incoming, host, port, scheme, client_ssl):
+    try:
+        outgoing = await _dial(host, port, scheme, client_ssl)
+    except (OSError, ConnectionError, asyncio.IncompleteReadError):
+        incoming.close()
+        return
+    await asyncio.gather(_pipe(incoming, outgoing), _pipe(outgoing, incoming))
+
+
+class _UdpReply(asyncio.DatagramProtocol):
+    def __init__(self, listener, client_addr):
+        self.listener = listener
+        self.client_addr = client_addr
+
+    def datagram_received(self, data, addr):
+        self.listener.sendto(data, self.client_addr)
+
+
+class _UdpForward(asyncio.DatagramProtocol):
+    """A UDP port forward with one upstream socket per client, like gost's UDP sessions (without their TTL)."""
+
+    def __init__(self, target):
+        self.target = target
+        self.sessions = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        session = self.sessions.get(addr)
+        if session is None:
+            # Datagrams that arrive while the session opens are queued, then sent in order
+            session = self.sessions[addr] = []
+            asyncio.ensure_future(self._open_session(addr))
+        if isinstance(session, list):
+            session.append(data)
+        else:
+            session.sendto(data)
+
+    async def _open_session(self, addr):
+        upstream, _protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _UdpReply(self.transport, addr), remote_addr=self.target)
+        for data in self.sessions[addr]:
+            upstream.sendto(data)
+        self.sessions[addr] = upstream
+
+
+def _relay_listener(node, target, chain_node, server_ssl, client_ssl):
+    """Returns the connection handler of a TCP or relay ServeNode."""
+    tls, websocket = _parse_transport(node.scheme) if node.scheme != 'tcp' else (False, False)
+    next_hop = (target.hostname, target.port, 'tcp') if target else \
+        (chain_node.hostname, chain_node.port, chain_node.scheme)
+
+    async def handle(reader, writer):
+        try:
+            incoming = await _accept_websocket(reader, writer) if websocket else _PlainStream(reader, writer)
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        await _forward_tcp(incoming, *next_hop, client_ssl)
+    return handle, (server_ssl if tls else None)
+
+
+async def _serve_stand_in(config, cert_dir):
+    """
+    Serves the routes of a generated GOST v2 config: TCP and UDP port forwards, and relays
+    over TLS, WebSocket or both, with the real transports but without gost's relay protocol
+    header, multiplexing or tuning parameters. Only chains of one node (no relay hops).
+    """
+    server_ssl = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_ssl.load_cert_chain(os.path.join(cert_dir, 'cert.pem'), os.path.join(cert_dir, 'key.pem'))
+    # Like gost v2, which doesn't verify Server B's certificate unless asked to
+    client_ssl = ssl.create_default_context()
+    client_ssl.check_hostname = False
+    client_ssl.verify_mode = ssl.CERT_NONE
+
+    loop = asyncio.get_running_loop()
+    servers = []
+    for route in config['Routes']:
+        chain_nodes = [urlsplit(node) for node in route.get('ChainNodes', [])]
+        if len(chain_nodes) > 1:
+            print(f"Warning: The stand-in can't chain through relay hops, skipping {route['ServeNodes']}")
+            continue
+        for serve_node in route['ServeNodes']:
+            node = urlsplit(serve_node)
+            target = urlsplit('//' + node.path.lstrip('/')) if node.path.strip('/') else None
+            if node.scheme == 'udp':
+                if target is None:
+                    print(f"Warning: The stand-in doesn't relay UDP, skipping {serve_node}")
+                    continue
+                await loop.create_datagram_endpoint(lambda target=target: _UdpForward((target.hostname, target.port)),
+                                                    local_addr=(_LOCALHOST, node.port))
+                continue
+            if target is None and not chain_nodes:
+                print(f"Warning: {serve_node} has neither a forward target nor a chain, skipping it")
+                continue
+            handle, listener_ssl = _relay_listener(node, target, chain_nodes[0] if chain_nodes else None,
+                                                   server_ssl, client_ssl)
+            servers.append(await asyncio.start_server(handle, _LOCALHOST, node.port, ssl=listener_ssl))
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+def _write_self_signed_cert(cert_dir):
+    """Writes cert.pem and key.pem for the stand-in's TLS listeners (gost has a built-in one)."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'gost-benchmark')])
+    now = datetime.now(timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now)
+            .not_valid_after(now + timedelta(days=365)).sign(key, hashes.SHA256()))
+    with open(os.path.join(cert_dir, 'cert.pem'), 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(os.path.join(cert_dir, 'key.pem'), 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+
+
+# --- Measurements, run by the harness against Server A's listen port ---
+
+async def _count_through(port, size):
+    reader, writer = await asyncio.open_connection(_LOCALHOST, port)
+    try:
+        writer.write(_SINK_COUNT + struct.pack('!Q', size))
+        chunk = bytes(_CHUNK_SIZE)
+        remaining = size
+        while remaining:
+            writer.write(chunk[:remaining])
+            remaining -= min(remaining, _CHUNK_SIZE)
+            await writer.drain()
+        received = struct.unpack('!Q', await reader.readexactly(8))[0]
+        if received != size:
+            raise ConnectionError(f"The sink received {received} of {size} bytes")
+    finally:
+        writer.close()
+
+
+async def _measure_tcp_throughput(port, total_bytes, streams):
+    """Returns the throughput in Mbit/s of `streams` connections that send total_bytes between them."""
+    started = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(*(_count_through(port, total_bytes // streams) for _i in range(streams))),
+                           _IO_TIMEOUT)
+    return total_bytes // streams * streams * 8 / (time.perf_counter() - started) / 1e6
+
+
+async def _echo_connection(port, semaphore, setup_times):
+    async with semaphore:
+        started = time.perf_counter()
+        reader, writer = await asyncio.open_connection(_LOCALHOST, port)
+        try:
+            # gost only dials onwards once a connection is accepted, so it only counts as
+            # set up once a byte made it to the sink and back
+            writer.write(_SINK_ECHO + b'.')
+            await reader.readexactly(1)
+            setup_times.append((time.perf_counter() - started) * 1000)
+        finally:
+            writer.close()
+
+
+async def _measure_tcp_setup(port, count, concurrency):
+    """Returns (connections per second, setup times in ms) for `count` new connections."""
+    semaphore = asyncio.Semaphore(concurrency)
+    setup_times = []
+    started = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(*(_echo_connection(port, semaphore, setup_times) for _i in range(count))),
+                           _IO_TIMEOUT)
+    return count / (time.perf_counter() - started), setup_times
+
+
+async def _measure_tcp_latency(port, samples, message_size):
+    """Returns the round trip times in ms of `samples` messages on one connection."""
+    reader, writer = await asyncio.open_connection(_LOCALHOST, port)
+    message = bytes(message_size)
+    round_trips = []
+    try:
+        writer.write(_SINK_ECHO)
+        for _i in range(samples):
+            started = time.perf_counter()
+            writer.write(message)
+            await asyncio.wait_for(reader.readexactly(message_size), _IO_TIMEOUT)
+            round_trips.append((time.perf_counter() - started) * 1000)
+    finally:
+        writer.close()
+    return round_trips
+
+
+class _UdpClient(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.replies = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self.replies.put_nowait(data)
+
+
+async def _open_udp_client(port):
+    transport, protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+        _UdpClient, remote_addr=(_LOCALHOST, port))
+    return transport, protocol.replies
+
+
+async def _udp_round_trip(transport, replies, message, timeout=1.0):
+    """Returns the round trip time in ms, or None if the datagram or its echo was lost."""
+    started = time.perf_counter()
+    transport.sendto(message)
+    try:
+        await asyncio.wait_for(replies.get(), timeout)
+    except asyncio.TimeoutError:
+        return None
+    return (time.perf_counter() - started) * 1000
+
+
+async def _udp_stream(port, size, window):
+    """Sends size bytes as datagrams with up to `window` in flight; returns the bytes echoed back."""
+    transport, replies = await _open_udp_client(port)
+    payload = bytes(_UDP_PAYLOAD_SIZE)
+    echoed = 0
+    try:
+        for _batch in range(0, size, _UDP_PAYLOAD_SIZE * window):
+            for _i in range(window):
+                transport.sendto(payload)
+            for _i in range(window):
+                try:
+                    echoed += len(await asyncio.wait_for(replies.get(), 0.5))
+                except asyncio.TimeoutError:
+                    break
+    finally:
+        transport.close()
+    return echoed
+
+
+async def _measure_udp_throughput(port, total_bytes, streams, window=32):
+    """Returns (Mbit/s echoed, share of the bytes lost) for `streams` UDP sessions."""
+    started = time.perf_counter()
+    echoed = await asyncio.wait_for(
+        asyncio.gather(*(_udp_stream(port, total_bytes // streams, window) for _i in range(streams))), _IO_TIMEOUT)
+    elapsed = time.perf_counter() - started
+    sent = -(-(total_bytes // streams) // (_UDP_PAYLOAD_SIZE * window)) * _UDP_PAYLOAD_SIZE * window * streams
+    return sum(echoed) * 8 / elapsed / 1e6, 1 - sum(echoed) / sent
+
+
+async def _udp_session(port, semaphore, setup_times):
+    async with semaphore:
+        started = time.perf_counter()
+        transport, replies = await _open_udp_client(port)
+        try:
+            if await _udp_round_trip(transport, replies, b'.') is not None:
+                setup_times.append((time.perf_counter() - started) * 1000)
+        finally:
+            transport.close()
+
+
+async def _measure_udp_setup(port, count, concurrency):
+    """Returns (new UDP sessions per second, setup times in ms); lost sessions have no setup time."""
+    semaphore = asyncio.Semaphore(concurrency)
+    setup_times = []
+    started = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(*(_udp_session(port, semaphore, setup_times) for _i in range(count))),
+                           _IO_TIMEOUT)
+    return len(setup_times) / (time.perf_counter() - started), setup_times
+
+
+async def _measure_udp_latency(port, samples, message_size):
+    """Returns (round trip times in ms, lost count) of `samples` datagrams from one client."""
+    transport, replies = await _open_udp_client(port)
+    message = bytes(message_size)
+    round_trips = []
+    try:
+        for _i in range(samples):
+            round_trip = await _udp_round_trip(transport, replies, message)
+            if round_trip is not None:
+                round_trips.append(round_trip)
+    finally:
+        transport.close()
+    return round_trips, samples - len(round_trips)
+
+
+def _summarize_ms(values):
+    if not values:
+        return None
+    return {'p50': round(percentile(values, 50), 3), 'p99': round(percentile(values, 99), 3),
+            'max': round(max(values), 3)}
+
+
+async def _measure(transport, port, parameters):
+    """Runs the three measurements against a listen port and returns their part of the result."""
+    if transport == 'udp':
+        throughput, loss = await _measure_udp_throughput(port, parameters['throughput_bytes'], parameters['streams'])
+        setup_rate, setup_times = await _measure_udp_setup(port, parameters['connections'], parameters['concurrency'])
+        round_trips, lost = await _measure_udp_latency(port, parameters['latency_samples'], parameters['message_size'])
+        extra = {'throughput_loss': round(loss, 4), 'latency_lost': lost}
+    else:
+        throughput = await _measure_tcp_throughput(port, parameters['throughput_bytes'], parameters['streams'])
+        setup_rate, setup_times = await _measure_tcp_setup(port, parameters['connections'], parameters['concurrency'])
+        round_trips = await _measure_tcp_latency(port, parameters['latency_samples'], parameters['message_size'])
+        extra = {}
+    return {
+        'throughput_mbps': round(throughput, 1),
+        'connections_per_second': round(setup_rate, 1),
+        'setup_ms': _summarize_ms(setup_times),
+        'latency_ms': _summarize_ms(round_trips),
+        **extra,
+    }
+
+
+# --- The harness ---
+
+def _free_port():
+    """Returns a port that is free on the loopback interface for both TCP and UDP."""
+    while True:
+        with socket.socket() as tcp_socket:
+            tcp_socket.bind((_LOCALHOST, 0))
+            port = tcp_socket.getsockname()[1]
+            with socket.socket(type=socket.SOCK_DGRAM) as udp_socket:
+                try:
+                    udp_socket.bind((_LOCALHOST, port))
+                except OSError:
+                    continue
+        return port
+
+
+def _wait_for_port(port, process, log_path):
+    deadline = time.monotonic() + _STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            socket.create_connection((_LOCALHOST, port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    with open(log_path, errors='replace') as f:
+        log_tail = f.read()[-2000:].strip()
+    reason = f"exited with code {process.returncode}" if process.poll() is not None else \
+        f"did not open port {port} within {_STARTUP_TIMEOUT}s"
+    raise RuntimeError(f"{os.path.basename(process.args[0])} {reason}" + (f" ({log_tail})" if log_tail else ''))
+
+
+def _start_process(command, log_path):
+    with open(log_path, 'wb') as log:
+        return subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+
+
+def _stop_processes(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _benchmark_configs(protocol, tuning, sink_port):
+    """
+    Generates the GOST configs of a transit from Server A to Server B (both this host) that
+    forwards to the sink. Returns (listen port, {server ID: config}).
+    """
+    servers_map = {server_id: SimpleNamespace(id=server_id, name=f"benchmark-{server_id}", ip_address=_LOCALHOST,
+                                              ssh_port=None, tuning_profile_id=None)
+                   for server_id in (_SERVER_A_ID, _SERVER_B_ID)}
+    listen_port = _free_port()
+    transit = SimpleNamespace(id=1, name=f"benchmark-{protocol}", server_a_id=_SERVER_A_ID,
+                              server_a_listen_port=listen_port, server_b_id=_SERVER_B_ID,
+                              server_b_connect_port=_free_port(), encryption_protocol=protocol,
+                              destination_ip=_LOCALHOST, destination_port=sink_port,
+                              b_nodes=[], hops=[], tuning_profile_id=None)
+    return listen_port, generate_gost_configs_by_server([transit], servers_map, default_tuning=tuning)
+
+
+def _runner_info(gost_binary):
+    if not gost_binary:
+        return {'name': 'python-stand-in', 'version': platform.python_version(),
+                'note': 'Emulates TCP/UDP forwards and the TLS and WebSocket transports of relays. '
+                        'Ignores multiplexing and tuning parameters; compare protocols, not profiles.'}
+    return {'name': 'gost', 'path': gost_binary, 'version': gost_version(gost_binary)}
+
+
+def _benchmark_case(protocol, profile_name, tuning, work_dir, sink_port, gost_binary, parameters):
+    listen_port, configs = _benchmark_configs(protocol, tuning, sink_port)
+    result = {
+        'protocol': protocol,
+        'profile': profile_name,
+        'transport': 'udp' if protocol == 'udp' else 'tcp',
+        'chain_nodes': configs[_SERVER_A_ID]['Routes'][0].get('ChainNodes', []),
+    }
+    processes = []
+    try:
+        # Server B first, so Server A's first connection finds it listening
+        for server_id in sorted(configs, reverse=True):
+            config_path = os.path.join(work_dir, f"{protocol.replace('+', '-')}-{profile_name}-{server_id}.json")
+            with open(config_path, 'w') as f:
+                json.dump(configs[server_id], f, indent=4)
+            command = [gost_binary, '-C', config_path] if gost_binary else \
+                [sys.executable, os.path.abspath(__file__), '--stand-in', config_path, work_dir]
+            log_path = config_path[:-len('.json')] + '.log'
+            processes.append(_start_process(command, log_path))
+            # Each shard has one TCP listener: the listen port on Server A, the connect port on Server B
+            route = configs[server_id]['Routes'][0]
+            port = listen_port if server_id == _SERVER_A_ID else urlsplit(route['ServeNodes'][0]).port
+            _wait_for_port(port, processes[-1], log_path)
+        result.update(asyncio.run(_measure(result['transport'], listen_port, parameters)))
+    except (RuntimeError, OSError, ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        result['error'] = str(e) or type(e).__name__
+    finally:
+        _stop_processes(processes)
+    return result
+
+
+def run_tunnel_benchmark(protocols=BENCHMARK_PROTOCOLS, tunings=None, gost_binary=None, parameters=None) -> dict:
+    """
+    Benchmarks a transit of every protocol under every tuning profile, entirely on this host.
+
+    For each combination the generated Server A and Server B configs are started, with the
+    gost binary if one is given and with a Python stand-in otherwise, in front of a local
+    sink. Throughput, connection (or UDP session) setup rate and round-trip latency are
+    then measured through Server A's listen port. A failing combination gets an 'error'
+    instead of numbers and doesn't stop the others.
+
+    Args:
+        protocols: Transits.encryption_protocol values to benchmark.
+        tunings: {profile name: GostTuning}; defaults to {'default': DEFAULT_GOST_TUNING}.
+        gost_binary: Path of a gost v2 binary, or None for the stand-in.
+        parameters: Overrides of DEFAULT_PARAMETERS.
+
+    Returns:
+        The report: the runner, host and parameters, and one result per combination.
+    """
+    tunings = tunings or {'default': DEFAULT_GOST_TUNING}
+    parameters = {**DEFAULT_PARAMETERS, **(parameters or {})}
+    report = {
+        'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'runner': _runner_info(gost_binary),
+        'host': {'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'parameters': parameters,
+        'results': [],
+    }
+    with tempfile.TemporaryDirectory(prefix='gost-benchmark-') as work_dir:
+        if not gost_binary:
+            _write_self_signed_cert(work_dir)
+        sink_port = _free_port()
+        sink_log = os.path.join(work_dir, 'sink.log')
+        sink = _start_process([sys.executable, os.path.abspath(__file__), '--sink', str(sink_port)], sink_log)
+        try:
+            _wait_for_port(sink_port, sink, sink_log)
+            for protocol in protocols:
+                for profile_name, tuning in tunings.items():
+                    result = _benchmark_case(protocol, profile_name, tuning, work_dir, sink_port, gost_binary,
+                                             parameters)
+                    report['results'].append(result)
+                    print(f"Info: {format_benchmark_result(result)}")
+        finally:
+            _stop_processes([sink])
+    return report
+
+
+def gost_version(gost_binary):
+    """Returns the first line `gost -V` prints, or None if the binary can't be run."""
+    try:
+        completed = subprocess.run([gost_binary, '-V'], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    output = (completed.stdout or completed.stderr).strip()
+    return output.splitlines()[0] if output else None
+
+
+def find_gost_binary(path=None):
+    """
+    Returns the path of the gost binary to benchmark with: `path`, else gost on the PATH, else
+    None for the stand-in. The generated configs are GOST v2 ones, so a gost on the PATH that
+    isn't v2 is passed over for the stand-in, and a `path` that isn't raises ValueError.
+    """
+    binary = path or shutil.which('gost')
+    if binary is None:
+        return None
+    version = gost_version(binary)
+    match = _GOST_VERSION_PATTERN.search(version or '')
+    if match and match.group(1) == '2':
+        return binary
+    found = f"{binary} reports '{version}'" if version else f"{binary} reports no version with -V"
+    if path:
+        raise ValueError(f"The benchmark runs GOST v2 configs, but {found}.")
+    print(f"Warning: {found}, the benchmark needs GOST v2. Using the Python stand-in.")
+    return None
+
+
+def format_benchmark_result(result) -> str:
+    """One line per result, for the console."""
+    label = f"{result['protocol']:<9} {result['profile']:<12}"
+    if 'error' in result:
+        return f"{label} failed: {result['error']}"
+    latency = result['latency_ms'] or {}
+    setup = result['setup_ms'] or {}
+    return (f"{label} {result['throughput_mbps']:>8.1f} Mbit/s  {result['connections_per_second']:>7.1f} conn/s  "
+            f"setup p99 {setup.get('p99', float('nan')):6.2f}ms  latency p50 {latency.get('p50', float('nan')):6.3f}ms "
+            f"p99 {latency.get('p99', float('nan')):6.3f}ms")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--sink']:
+        asyncio.run(_serve_sink(int(sys.argv[2])))
+    elif sys.argv[1:2] == ['--stand-in']:
+        with open(sys.argv[2]) as config_file:
+            asyncio.run(_serve_stand_in(json.load(config_file), sys.argv[3]))
+    else:
+        # python tunnel_benchmark.py [--gost PATH] [--output REPORT.json] [PROTOCOL ...]
+        # Compares the default profile with a production-like one (no debug logging, multiplexed)
+        from gost_config_generator import GostTuning
+
+        args = sys.argv[1:]
+        options = {}
+        for option in ('--gost', '--output'):
+            if option in args:
+                index = args.index(option)
+                options[option] = args[index + 1]
+                del args[index:index + 2]
+        benchmark_report = run_tunnel_benchmark(
+            protocols=args or BENCHMARK_PROTOCOLS,
+            tunings={'default': DEFAULT_GOST_TUNING, 'production': GostTuning(debug=False, retries=3, multiplex=True)},
+            gost_binary=find_gost_binary(options.get('--gost')),
+            parameters={'throughput_bytes': 16 * 1024 * 1024, 'connections': 200, 'latency_samples': 500})
+        if '--output' in options:
+            with open(options['--output'], 'w') as report_file:
+                json.dump(benchmark_report, report_file, indent=4)
+            print(f"Info: Wrote the report to {options['--output']}")
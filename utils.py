@@ -1,58 +1,54 @@
-from cryptography.fernet import Fernet, InvalidToken
-import paramiko
 import socket # For socket.error
+import time
+from ssh_pool import ssh_pool
+from app_metrics import ssh_test_duration, systemctl_duration
 
 def generate_key():
     """Generates a Fernet key."""
+    from cryptography.fernet import Fernet # Imported on use, like paramiko below, to keep startup fast
     return Fernet.generate_key()
 
-def encrypt_password(password, key):
-    """Encrypts a password using the given Fernet key."""
-    if not password:
-        return None
-    f = Fernet(key)
-    return f.encrypt(password.encode()).decode()
-
-def decrypt_password(encrypted_password, key):
-    """Decrypts an encrypted password using the given Fernet key."""
-    if not encrypted_password:
-        return None
-    f = Fernet(key)
-    try:
-        return f.decrypt(encrypted_password.encode()).decode()
-    except InvalidToken:
-        # This can happen if the key is wrong or the token is corrupted
-        print("Error: Invalid token or key during decryption.")
-        return None
-
-def test_ssh_connection(ip, port, username, password):
+def test_ssh_connection(ip, port, username, password, reuse=False, timeout=10, key_filename=None):
     """
     Tests an SSH connection to the given server details.
+    With reuse=True an already authenticated, healthy pooled session counts as success,
+    which is what periodic health checks want; new credentials should be tested without it.
+    With key_filename the private key file is used instead of the password.
     Returns (True, None) on success, or (False, error_message) on failure.
     """
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy()) # Automatically add host keys
+    import paramiko # Only loaded once the first SSH connection is made
 
+    started = time.perf_counter()
+    outcome = 'error' # Label of the duration metric
     try:
         # Ensure port is an integer
         port = int(port)
-        if not password: # paramiko might hang or error weirdly with None password
-            return False, "Password cannot be empty for SSH test."
-            
-        client.connect(ip, port=port, username=username, password=password, timeout=10)
+        if not password and not key_filename: # paramiko might hang or error weirdly with None password
+            return False, "Password or SSH key cannot be empty for SSH test."
+
+        # Without reuse a fresh connection is opened so the given password is really verified;
+        # the authenticated session is then kept in the pool for later deploys.
+        with ssh_pool.connection(ip, port, username, password, timeout=timeout, reuse=reuse,
+                                 key_filename=key_filename):
+            pass
+        outcome = 'success'
         return True, None
     except paramiko.AuthenticationException:
-        return False, "Authentication failed (wrong username or password)."
+        outcome = 'auth_failed'
+        return False, "Authentication failed (wrong username, password or SSH key)."
     except paramiko.SSHException as e:
+        outcome = 'ssh_error'
         return False, f"SSH error: {str(e)}"
     except socket.error as e: # More specific network errors
+        outcome = 'network_error'
         return False, f"Network error: {str(e)}"
     except TimeoutError: # Python's built-in TimeoutError
+         outcome = 'timeout'
          return False, f"Connection timed out to {ip}:{port}."
     except Exception as e:
         return False, f"An unexpected error occurred: {str(e)}"
     finally:
-        client.close()
+        ssh_test_duration.labels(outcome=outcome).observe(time.perf_counter() - started)
 
 import subprocess
 from flask_babel import gettext as _ # Import gettext
@@ -63,6 +59,8 @@ def _run_systemctl_command(action, service_name="gost.service"):
     Returns (success: bool, output: str).
     Note: This will likely require sudo privileges for the user running the Flask app.
     """
+    started = time.perf_counter()
+    outcome = 'error' # Label of the duration metric
     try:
         # Using 'sudo' directly here. If passwordless sudo is not configured for the
         # user running the app, this will fail or hang if sudo prompts for a password.
@@ -72,8 +70,10 @@ def _run_systemctl_command(action, service_name="gost.service"):
         process = subprocess.run(command, capture_output=True, text=True, timeout=15, check=False)
         
         if process.returncode == 0:
+            outcome = 'success'
             return True, process.stdout.strip() or _("%(action)s %(service_name)s successful.", action=action, service_name=service_name)
         else:
+            outcome = 'failure'
             error_message = process.stderr.strip() or process.stdout.strip() or _("Unknown error during %(action)s %(service_name)s.", action=action, service_name=service_name)
             # Log the full command and error for debugging
             print(f"Error running command '{' '.join(command)}': {error_message}")
@@ -85,26 +85,36 @@ def _run_systemctl_command(action, service_name="gost.service"):
         print(_("Error: 'sudo' or 'systemctl' command not found. Make sure it's in PATH."))
         return False, _("'sudo' or 'systemctl' command not found.")
     except subprocess.TimeoutExpired:
+        outcome = 'timeout'
         print(_("Error: Command '%(command)s' timed out.", command=' '.join(command)))
         return False, _("Command to %(action)s %(service_name)s timed out.", action=action, service_name=service_name)
     except Exception as e:
         print(_("An unexpected error occurred while trying to %(action)s %(service_name)s: %(error)s", action=action, service_name=service_name, error=str(e)))
         return False, _("An unexpected error occurred: %(error)s", error=str(e))
+    finally:
+        systemctl_duration.labels(action=action, outcome=outcome).observe(time.perf_counter() - started)
 
-def restart_gost_service():
+def restart_gost_service(service_name="gost.service"):
     """Restarts the GOST service. Returns (success, message)."""
-    return _run_systemctl_command('restart')
+    return _run_systemctl_command('restart', service_name)
+
+def reload_gost_service(service_name="gost.service"):
+    """
+    Reloads the GOST service without stopping it (systemd ExecReload, e.g. a SIGHUP).
+    Returns (success, message).
+    """
+    return _run_systemctl_command('reload', service_name)
 
-def stop_gost_service():
+def stop_gost_service(service_name="gost.service"):
     """Stops the GOST service. Returns (success, message)."""
-    return _run_systemctl_command('stop')
+    return _run_systemctl_command('stop', service_name)
 
-def start_gost_service():
+def start_gost_service(service_name="gost.service"):
     """Starts the GOST service. Returns (success, message)."""
-    return _run_systemctl_command('start')
+    return _run_systemctl_command('start', service_name)
 
-def get_gost_service_status():
+def get_gost_service_status(service_name="gost.service"):
     """Gets the GOST service status. Returns (success, message)."""
     # 'is-active' is a simple way to check if it's running.
     # For more detailed status, 'status' can be used, but parsing its output is more complex.
-    return _run_systemctl_command('is-active')
+    return _run_systemctl_command('is-active', service_name)
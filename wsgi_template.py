@@ -11,9 +11,10 @@ if project_home not in sys.path:
 # os.environ['FERNET_KEY'] = 'your_production_fernet_key_here' # Best set via PythonAnywhere's web UI
 # os.environ['DATABASE_URL'] = 'your_production_database_url_here' # If using a different DB in prod
 
-# Import the Flask app instance.
+# Create the Flask app instance.
 # Ensure 'app.py' (or your main Flask file) is in the project_home directory specified above.
-from app import app as application  # The 'application' variable is what PythonAnywhere's WSGI server looks for.
+from app import create_app
+application = create_app()  # The 'application' variable is what PythonAnywhere's WSGI server looks for.
 
 # Optional: If your app uses an instance folder for configuration or SQLite DB,
 # ensure PythonAnywhere knows where it is if it's not automatically detected.
@@ -22,9 +23,8 @@ from app import app as application  # The 'application' variable is what PythonA
 #    os.makedirs(application.instance_path)
 
 # Optional: Initialize database if it needs to happen on app load and is safe to do so.
-# with application.app_context():
-#    from app import init_db
-#    init_db() # Or a more specific production init function
+# from app import init_db
+# init_db(application) # Or a more specific production init function
 
 # Optional: Add any other production-specific setup here.
 # For example, logging configuration.